@@ -0,0 +1,399 @@
+"""
+In-memory columnar analytics engine
+
+With ``ANALYTICS_ENGINE=numpy`` the statistics in ``crud`` (region and
+commune stats, trends, region comparison, summary) are computed from a
+copy of the ``air_quality`` table held in NumPy arrays instead of SQL:
+
+- one array per column; pollutants as float64 with NaN for missing values
+  (float64 so sums match the database's double precision aggregates)
+- commune / region / departement names and their normalized forms are
+  dictionary-encoded as int32 codes, so a name filter is evaluated once
+  per distinct name and then becomes an ``isin`` over integer codes
+- group-bys are ``np.unique`` + ``bincount`` / ``ufunc.at`` reductions
+
+The table is streamed into preallocated arrays, ``LOAD_BATCH_SIZE`` rows
+at a time, so a load never holds more than one batch of row objects.
+
+The store follows the dataset version (``app.cache``): rows written by ORM
+flushes since the loaded version are re-read by id and spliced in; any
+write whose rows are unknown (bulk upserts, ingestion) triggers a full
+reload. Writes of other processes (replicas, ``app.ingest``) do not move
+this process's version: every ``ANALYTICS_CHECK_INTERVAL`` seconds the row
+count and greatest id are compared with those of the loaded snapshot, and
+a snapshot older than ``ANALYTICS_MAX_AGE`` seconds is reloaded anyway to
+pick up rows updated in place. Results are raw aggregates with the same
+attribute names as the SQL rows, so ``crud`` formats both paths
+identically.
+
+The default engine is ``sql``.
+"""
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.cache import changes_since, dataset_version
+from app.distribution import (
+    DISTRIBUTION_POLLUTANTS,
+    grouped_exceedances,
+    grouped_percentiles,
+    set_percentiles,
+)
+from app.models import AirQualityRecord, POLLUTANTS
+from app.search import MatchMode, matches, normalize_text
+from app.thresholds import THRESHOLDS
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sql").lower()
+ANALYTICS_CHECK_INTERVAL = float(os.getenv("ANALYTICS_CHECK_INTERVAL", "10"))
+ANALYTICS_MAX_AGE = float(os.getenv("ANALYTICS_MAX_AGE", "600"))
+
+# Pollutants averaged by the statistics endpoints
+STATS_POLLUTANTS = ("no2", "pm10", "pm25", "o3")
+
+STRING_COLUMNS = ("commune", "code_insee", "region", "departement", "commune_norm", "region_norm")
+LOADED_COLUMNS = ("id", "annee") + STRING_COLUMNS + POLLUTANTS
+
+COLUMN_TYPES = {
+    "id": np.int64,
+    "annee": np.int32,
+    **{name: np.int32 for name in STRING_COLUMNS},  # Dictionary codes
+    **{name: np.float64 for name in POLLUTANTS},
+}
+
+LOAD_BATCH_SIZE = 10000
+REFRESH_BATCH_SIZE = 500
+
+
+def enabled() -> bool:
+    """Whether statistics should be answered by the in-memory engine"""
+    return ANALYTICS_ENGINE == "numpy"
+
+
+class Dictionary:
+    """Append-only mapping between strings and int32 codes"""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, values: Iterable[str]):
+        """Codes of ``values``, adding unseen strings"""
+        with self._lock:
+            codes = [self._codes.get(v) for v in values]
+            for i, code in enumerate(codes):
+                if code is None:
+                    value = values[i]
+                    code = self._codes.get(value)
+                    if code is None:
+                        code = self._codes[value] = len(self.values)
+                        self.values.append(value)
+                    codes[i] = code
+        return np.array(codes, dtype=np.int32)
+
+    def code(self, value: str) -> Optional[int]:
+        return self._codes.get(value)
+
+    def matching(self, predicate: Callable[[str], bool]):
+        """Codes of the strings satisfying ``predicate``"""
+        values = list(self.values)
+        return np.array([code for code, v in enumerate(values) if predicate(v)], dtype=np.int32)
+
+
+class Snapshot:
+    """Column arrays and their dictionaries at one dataset version"""
+
+    def __init__(
+        self,
+        columns: Dict[str, "np.ndarray"],
+        dictionaries: Dict[str, Dictionary],
+        fingerprint: tuple,
+        loaded_at: float
+    ):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.fingerprint = fingerprint  # (row count, greatest id) when read
+        self.loaded_at = loaded_at  # Time of the full load it derives from
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+    def name_mask(self, column: str, value: str, mode: MatchMode):
+        """Rows whose normalized ``column`` matches ``value``"""
+        codes = self.dictionaries[column].matching(lambda name: matches(name, value, mode))
+        return np.isin(self.columns[column], codes)
+
+    def all_rows(self):
+        return np.ones(len(self), dtype=bool)
+
+
+def _encode(rows: List, dictionaries: Dict[str, Dictionary]) -> Dict[str, "np.ndarray"]:
+    """Column arrays from rows of ``LOADED_COLUMNS``"""
+    values = list(zip(*rows)) if rows else [()] * len(LOADED_COLUMNS)
+    columns = {}
+    for name, column in zip(LOADED_COLUMNS, values):
+        if name in STRING_COLUMNS:
+            columns[name] = dictionaries[name].encode(column)
+        else:
+            columns[name] = np.array(column, dtype=COLUMN_TYPES[name])  # None -> NaN
+    return columns
+
+
+def _select_columns():
+    return select(*[getattr(AirQualityRecord, name) for name in LOADED_COLUMNS])
+
+
+def _fingerprint(db: Session) -> tuple:
+    """Row count and greatest id, which change with any insert or delete"""
+    return tuple(db.execute(select(func.count(), func.max(AirQualityRecord.id))).one())
+
+
+def _reduce(inverse, size: int, values) -> dict:
+    """Per-group count, sum, min and max of the non-missing ``values``"""
+    valid = ~np.isnan(values)
+    groups, values = inverse[valid], values[valid]
+    count = np.bincount(groups, minlength=size)
+    total = np.bincount(groups, weights=values, minlength=size)
+    low = np.full(size, np.inf)
+    high = np.full(size, -np.inf)
+    np.minimum.at(low, groups, values)
+    np.maximum.at(high, groups, values)
+    return {"count": count, "sum": total, "min": low, "max": high}
+
+
+def _value(reduced: dict, key: str, group: int) -> Optional[float]:
+    """A reduced value as a Python float, None for groups without values"""
+    if not reduced["count"][group]:
+        return None
+    if key == "avg":
+        return float(reduced["sum"][group] / reduced["count"][group])
+    return float(reduced[key][group])
+
+
+def _group_stats(snapshot: Snapshot, keys, mask, with_extremes: bool = True):
+    """
+    Statistics of the masked rows grouped by ``keys``.
+
+    Returns the distinct keys, the inverse index of every masked row and one
+    namespace per group with ``count``, ``avg_*``, (optionally) the
+    ``max_no2``/``max_pm10``/``min_no2``/``min_pm10`` extremes and the
+    percentiles and exceedances of ``app.distribution``.
+    """
+    uniques, inverse = np.unique(keys[mask], return_inverse=True)
+    size = len(uniques)
+    counts = np.bincount(inverse, minlength=size)
+    reduced = {p: _reduce(inverse, size, snapshot.columns[p][mask]) for p in STATS_POLLUTANTS}
+
+    groups = []
+    for g in range(size):
+        stats = SimpleNamespace(count=int(counts[g]))
+        for p in STATS_POLLUTANTS:
+            setattr(stats, f"avg_{p}", _value(reduced[p], "avg", g))
+        if with_extremes:
+            stats.max_no2 = _value(reduced["no2"], "max", g)
+            stats.max_pm10 = _value(reduced["pm10"], "max", g)
+            stats.min_no2 = _value(reduced["no2"], "min", g)
+            stats.min_pm10 = _value(reduced["pm10"], "min", g)
+        groups.append(stats)
+
+    codes = snapshot.columns["code_insee"][mask]
+    for p in DISTRIBUTION_POLLUTANTS:
+        values = snapshot.columns[p][mask]
+        percentiles = grouped_percentiles(inverse, size, values)
+        exceedances = grouped_exceedances(inverse, size, codes, values, THRESHOLDS[p].low)
+        for g, stats in enumerate(groups):
+            set_percentiles(stats, percentiles[g], p)
+            setattr(stats, f"exceed_{p}", int(exceedances[g]))
+    return uniques, inverse, groups
+
+
+def _empty_stats(with_extremes: bool = True) -> SimpleNamespace:
+    stats = SimpleNamespace(count=0, **{f"avg_{p}": None for p in STATS_POLLUTANTS})
+    if with_extremes:
+        stats.max_no2 = stats.max_pm10 = stats.min_no2 = stats.min_pm10 = None
+    return stats
+
+
+class ColumnStore:
+    """Columnar copy of the air_quality table, refreshed on dataset changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = 0.0
+        self.version: Optional[int] = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshot = None
+            self.version = None
+
+    def _load(self, db: Session) -> Snapshot:
+        """Stream the whole table into column arrays sized by a row count"""
+        loaded_at = time.monotonic()
+        fingerprint = _fingerprint(db)
+        size = fingerprint[0]
+        dictionaries = {name: Dictionary() for name in STRING_COLUMNS}
+        columns = {name: np.empty(size, dtype=COLUMN_TYPES[name]) for name in LOADED_COLUMNS}
+
+        filled = 0
+        result = db.execute(_select_columns().execution_options(yield_per=LOAD_BATCH_SIZE))
+        try:
+            for rows in result.partitions():
+                end = filled + len(rows)
+                if end > size:
+                    # Rows inserted since the count; the fingerprint will differ
+                    size = max(end, 2 * size)
+                    columns = {
+                        name: np.concatenate([column, np.empty(size - len(column), dtype=column.dtype)])
+                        for name, column in columns.items()
+                    }
+                for name, values in _encode(rows, dictionaries).items():
+                    columns[name][filled:end] = values
+                filled = end
+        finally:
+            result.close()
+
+        columns = {name: column[:filled] for name, column in columns.items()}
+        return Snapshot(columns, dictionaries, fingerprint, loaded_at)
+
+    def _apply(self, db: Session, base: Snapshot, ids: List[int]) -> Snapshot:
+        """Replace the rows of ``ids`` by their current database values"""
+        rows = []
+        for start in range(0, len(ids), REFRESH_BATCH_SIZE):
+            batch = ids[start:start + REFRESH_BATCH_SIZE]
+            rows += db.execute(_select_columns().where(AirQualityRecord.id.in_(batch))).all()
+        fresh = _encode(rows, base.dictionaries)
+        keep = ~np.isin(base.columns["id"], np.array(ids, dtype=np.int64))
+        columns = {name: np.concatenate([base.columns[name][keep], fresh[name]]) for name in LOADED_COLUMNS}
+        return Snapshot(columns, base.dictionaries, _fingerprint(db), base.loaded_at)
+
+    def _outdated(self, db: Session, snapshot: Snapshot) -> bool:
+        """Whether another process may have written since ``snapshot`` was read"""
+        now = time.monotonic()
+        if now - snapshot.loaded_at > ANALYTICS_MAX_AGE:
+            return True
+        with self._lock:
+            if now - self._checked_at <= ANALYTICS_CHECK_INTERVAL:
+                return False
+            self._checked_at = now
+        return _fingerprint(db) != snapshot.fingerprint
+
+    def snapshot(self, db: Session) -> Snapshot:
+        """Snapshot at the current dataset version, refreshing it if needed"""
+        current = dataset_version()
+        with self._lock:
+            base, base_version = self._snapshot, self.version
+
+        # Database reads happen outside the lock: under AsyncSession they
+        # yield to the event loop, where another request may refresh too
+        if base is not None and base_version == current:
+            if not self._outdated(db, base):
+                return base
+            changes = None
+        else:
+            changes = changes_since(base_version) if base is not None else None
+        if changes is None:
+            snapshot = self._load(db)
+        else:
+            ids = sorted(key[1][0] for key in changes if key[0] is AirQualityRecord)
+            snapshot = self._apply(db, base, ids) if ids else base
+
+        with self._lock:
+            if self.version == base_version:
+                self._snapshot, self.version = snapshot, current
+                self._checked_at = time.monotonic()
+        return snapshot
+
+    def region_stats(self, db: Session, region: str, annee: Optional[int], match: MatchMode):
+        """Aggregates of ``crud.get_stats_by_region``"""
+        snapshot = self.snapshot(db)
+        mask = snapshot.name_mask("region_norm", region, match)
+        if annee:
+            mask &= snapshot.columns["annee"] == annee
+        _, _, groups = _group_stats(snapshot, np.zeros(len(snapshot), dtype=np.int8), mask)
+        return groups[0] if groups else _empty_stats()
+
+    def compare_regions(self, db: Session, regions: Optional[List[str]], annee: Optional[int]):
+        """Per normalized region aggregates of ``crud.compare_regions``"""
+        snapshot = self.snapshot(db)
+        mask = snapshot.all_rows()
+        if regions is not None:
+            dictionary = snapshot.dictionaries["region_norm"]
+            codes = [dictionary.code(normalize_text(r)) for r in regions]
+            mask &= np.isin(snapshot.columns["region_norm"], [c for c in codes if c is not None])
+        if annee:
+            mask &= snapshot.columns["annee"] == annee
+
+        keys = snapshot.columns["region_norm"]
+        uniques, inverse, groups = _group_stats(snapshot, keys, mask)
+
+        # Display name: the greatest raw spelling in the group, as max() in SQL
+        names = snapshot.dictionaries["region"].values
+        pairs = np.unique(np.stack([inverse, snapshot.columns["region"][mask]]), axis=1)
+        display = {}
+        for g, code in pairs.T:
+            display[g] = max(display.get(g, ""), names[code])
+
+        norms = snapshot.dictionaries["region_norm"].values
+        for g, stats in enumerate(groups):
+            stats.region = display[g]
+            stats.region_norm = norms[uniques[g]]
+        return groups
+
+    def commune_stats(self, db: Session, commune: str, match: MatchMode):
+        """Aggregates of ``crud.get_stats_by_commune``"""
+        snapshot = self.snapshot(db)
+        mask = snapshot.name_mask("commune_norm", commune, match)
+        _, _, groups = _group_stats(
+            snapshot, np.zeros(len(snapshot), dtype=np.int8), mask, with_extremes=False
+        )
+        return groups[0] if groups else _empty_stats(with_extremes=False)
+
+    def pollutant_trend(
+        self,
+        db: Session,
+        pollutant: str,
+        region: Optional[str],
+        commune: Optional[str],
+        match: MatchMode
+    ) -> List[SimpleNamespace]:
+        """Per year averages of ``crud.get_pollutant_trend``"""
+        snapshot = self.snapshot(db)
+        mask = snapshot.all_rows()
+        if commune:
+            mask &= snapshot.name_mask("commune_norm", commune, match)
+        if region:
+            mask &= snapshot.name_mask("region_norm", region, match)
+
+        years, inverse = np.unique(snapshot.columns["annee"][mask], return_inverse=True)
+        reduced = _reduce(inverse, len(years), snapshot.columns[pollutant][mask])
+        return [
+            SimpleNamespace(annee=int(year), value=_value(reduced, "avg", g))
+            for g, year in enumerate(years)
+        ]
+
+    def summary(self, db: Session) -> SimpleNamespace:
+        """Aggregates of ``crud.get_summary``"""
+        snapshot = self.snapshot(db)
+        columns = snapshot.columns
+        result = SimpleNamespace(
+            total_records=len(snapshot),
+            total_regions=len(np.unique(columns["region"])),
+            total_communes=len(np.unique(columns["commune"])),
+            min_annee=int(columns["annee"].min()) if len(snapshot) else None,
+            max_annee=int(columns["annee"].max()) if len(snapshot) else None,
+        )
+        for p in STATS_POLLUTANTS:
+            values = columns[p][~np.isnan(columns[p])]
+            setattr(result, f"avg_{p}", float(values.mean()) if values.size else None)
+        return result
+
+
+store = ColumnStore()
@@ -0,0 +1,149 @@
+"""
+In-process caching keyed by a dataset version counter
+
+Every committed write to the database bumps the dataset version, which
+invalidates everything cached under the previous version. Writes are
+detected through SQLAlchemy session events, so ORM writes (``crud``,
+``load_sample_data``) and Core DML executed through a session are covered
+without each call site having to remember to invalidate.
+
+Each version bump also records which rows it wrote, as ORM identity keys,
+when that is known (ORM flushes). ``changes_since`` lets derived in-memory
+copies of the data refresh incrementally; Core DML and explicit bumps
+record an unknown change set, which means "reload everything".
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, FrozenSet, Hashable, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_version = 0
+_version_lock = threading.Lock()
+
+_DIRTY_KEY = "dataset_dirty"
+_CHANGES_KEY = "dataset_changes"
+_UNTRACKED_KEY = "dataset_untracked"
+
+CHANGE_LOG_SIZE = 256
+
+# (version, identity keys written by the bump that produced it, or None)
+_change_log: deque = deque(maxlen=CHANGE_LOG_SIZE)
+
+
+def dataset_version() -> int:
+    """Current dataset version"""
+    return _version
+
+
+def bump_dataset_version(changes: Optional[FrozenSet[tuple]] = None) -> int:
+    """
+    Invalidate every cached result; call after writes made outside a Session.
+
+    ``changes`` are the identity keys of the written rows, when known.
+    """
+    global _version
+    with _version_lock:
+        _version += 1
+        _change_log.append((_version, changes))
+        return _version
+
+
+def changes_since(version: int) -> Optional[Set[tuple]]:
+    """Identity keys written after ``version``, or None when unknown"""
+    with _version_lock:
+        if version == _version:
+            return set()
+        entries = [changes for v, changes in _change_log if v > version]
+        if len(entries) != _version - version or any(c is None for c in entries):
+            return None
+        return set().union(*entries)
+
+
+def _clear_session_state(session) -> None:
+    for key in (_DIRTY_KEY, _CHANGES_KEY, _UNTRACKED_KEY):
+        session.info.pop(key, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_dirty_on_flush(session, flush_context):
+    if session.new or session.dirty or session.deleted:
+        session.info[_DIRTY_KEY] = True
+        changes = session.info.setdefault(_CHANGES_KEY, set())
+        for obj in itertools.chain(session.new, session.dirty, session.deleted):
+            changes.add(inspect(obj).mapper.identity_key_from_instance(obj))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_dirty_on_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info[_DIRTY_KEY] = True
+        orm_execute_state.session.info[_UNTRACKED_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    dirty = session.info.get(_DIRTY_KEY, False)
+    untracked = session.info.get(_UNTRACKED_KEY, False)
+    changes = session.info.get(_CHANGES_KEY)
+    _clear_session_state(session)
+    if dirty:
+        bump_dataset_version(None if untracked or changes is None else frozenset(changes))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _reset_on_rollback(session, previous_transaction):
+    _clear_session_state(session)
+
+
+class VersionedCache:
+    """
+    Thread-safe LRU cache whose entries are only valid for the dataset
+    version they were computed under, and optionally for ``ttl`` seconds.
+
+    Callers read the version *before* computing a value and pass it to
+    ``set``, so a result computed while a write was committing is never
+    stored under the newer version.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value cached under the current dataset version"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            version, value, stored_at = entry
+            if version != _version or (self.ttl is not None and time.monotonic() - stored_at > self.ttl):
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, version: Optional[int] = None) -> None:
+        """Cache a value computed under ``version`` (default: current)"""
+        if version is None:
+            version = _version
+        with self._lock:
+            if version != _version:
+                return
+            self._entries[key] = (version, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
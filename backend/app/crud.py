@@ -1,58 +1,294 @@
 """
 CRUD operations for Air Quality data
 """
+import json
+from types import SimpleNamespace
+import numpy as np
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from typing import List, Optional
-from app.models import AirQualityRecord
-from app.schemas import AirQualityCreate, AirQualityUpdate
+from sqlalchemy import Integer, and_, cast, func, desc, literal_column, or_, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.cache import VersionedCache, dataset_version
+from app import analytics, geo, rollup
+from app.geo import BBox, Near
+from app.distribution import (
+    DISTRIBUTION_POLLUTANTS,
+    exceedance_column,
+    format_distribution,
+    grouped_percentiles,
+    percentile_columns,
+    set_percentiles,
+)
+from app.metrics import instrument
+from app.models import AirQualityRecord, POLLUTANTS, rollup_table
+from app.pagination import encode_cursor
+from app.refresher import METADATA_SOFT_TTL
+from app.schemas import AirQualityCreate, AirQualityResponse, AirQualityUpdate
+from app.search import MatchMode, match_condition, normalize_text
 
+# Exact counts per filter combination, dropped on every write
+_count_cache = VersionedCache(maxsize=512)
 
-def get_records(
-    db: Session,
+# Dataset summary snapshot, recomputed after the next write or once it is
+# as old as the metadata soft TTL (writes of other processes)
+_summary_cache = VersionedCache(maxsize=1, ttl=METADATA_SOFT_TTL)
+
+# Exceedances (and requested percentiles) per filter combination; they scan
+# the raw table, so they are kept for the dataset version, at most as long
+# as the metadata soft TTL (writes of other processes)
+_distribution_cache = VersionedCache(maxsize=256, ttl=METADATA_SOFT_TTL)
+
+# Dashboard bootstrap payloads, per first page size and trend pollutant,
+# expiring like the summary snapshot they embed
+_dashboard_cache = VersionedCache(maxsize=16, ttl=METADATA_SOFT_TTL)
+
+# Columns listed by get_records, in the order of the response schema
+RECORD_FIELDS = tuple(AirQualityResponse.model_fields)
+RECORD_COLUMNS = [getattr(AirQualityRecord, field) for field in RECORD_FIELDS]
+
+EXPORT_BATCH_SIZE = 1000
+
+_SELECT_RELTUPLES = text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table")
+
+
+def _dialect(db: Session) -> str:
+    """Name of the database dialect behind a session"""
+    return db.get_bind().dialect.name
+
+
+def _bbox_condition(bbox: BBox):
+    """Records inside ``bbox``, located through the grid cell index"""
+    return and_(
+        or_(*[AirQualityRecord.grid_cell.between(low, high) for low, high in geo.cell_ranges(bbox)]),
+        AirQualityRecord.longitude.between(bbox.min_lon, bbox.max_lon),
+        AirQualityRecord.latitude.between(bbox.min_lat, bbox.max_lat),
+    )
+
+
+def _near_condition(near: Near, dialect: str):
+    """Records within ``near.radius_km`` of its center"""
+    if dialect == "postgresql" and geo.postgis:
+        center = func.ST_SetSRID(func.ST_MakePoint(near.longitude, near.latitude), 4326)
+        return func.ST_DWithin(
+            literal_column(f"{AirQualityRecord.__tablename__}.geog"),
+            func.geography(center),
+            near.radius_km * 1000
+        )
+
+    # Equirectangular distance: only arithmetic, so it runs on any database
+    dx = (AirQualityRecord.longitude - near.longitude) * geo.km_per_degree_longitude(near.latitude)
+    dy = (AirQualityRecord.latitude - near.latitude) * geo.KM_PER_DEGREE
+    return and_(_bbox_condition(geo.near_bbox(near)), dx * dx + dy * dy <= near.radius_km ** 2)
+
+
+def _apply_record_filters(
+    query,
+    dialect: str,
     commune: Optional[str] = None,
     region: Optional[str] = None,
     annee: Optional[int] = None,
-    skip: int = 0,
-    limit: int = 100
-) -> List[AirQualityRecord]:
-    """Get air quality records with optional filters"""
-    query = db.query(AirQualityRecord)
-    
+    match: MatchMode = "contains",
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+):
+    """Apply the name/year/location filters shared by listing, counting and stats"""
     if commune:
-        query = query.filter(AirQualityRecord.commune.ilike(f"%{commune}%"))
+        query = query.filter(match_condition(AirQualityRecord.commune_norm, commune, match, dialect))
     if region:
-        query = query.filter(AirQualityRecord.region.ilike(f"%{region}%"))
+        query = query.filter(match_condition(AirQualityRecord.region_norm, region, match, dialect))
     if annee:
         query = query.filter(AirQualityRecord.annee == annee)
+    if bbox:
+        query = query.filter(_bbox_condition(bbox))
+    if near:
+        query = query.filter(_near_condition(near, dialect))
+    return query
+
+
+def records_statement(
+    dialect: str,
+    commune: Optional[str] = None,
+    region: Optional[str] = None,
+    annee: Optional[int] = None,
+    match: MatchMode = "contains",
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+):
+    """SELECT of ``RECORD_COLUMNS`` matching the filters, in listing order"""
+    query = _apply_record_filters(
+        select(*RECORD_COLUMNS), dialect, commune, region, annee, match, bbox, near
+    )
+    return query.order_by(desc(AirQualityRecord.annee), desc(AirQualityRecord.id))
+
+
+@instrument
+def get_records(
+    db: Session,
+    commune: Optional[str] = None,
+    region: Optional[str] = None,
+    annee: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[Tuple[int, int]] = None,
+    match: MatchMode = "contains",
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+) -> List[Row]:
+    """
+    Get air quality records with optional filters.
+
+    Returns plain rows of ``RECORD_COLUMNS`` rather than ORM entities, so
+    large pages skip identity-map bookkeeping and can be encoded directly.
+    Rows are ordered by ``(annee, id)`` descending so the order is stable
+    across rows sharing a year. When ``after`` is given (the ``(annee, id)``
+    key of the last row already seen), ``skip`` is ignored and the query
+    seeks directly past that key. ``match`` selects how commune/region
+    names are matched (see ``app.search``); ``bbox`` and ``near`` restrict
+    the records to an area (see ``app.geo``).
+    """
+    query = records_statement(_dialect(db), commune, region, annee, match, bbox, near)
+    if after is not None:
+        query = query.filter(tuple_(AirQualityRecord.annee, AirQualityRecord.id) < after)
+    else:
+        query = query.offset(skip)
     
-    return query.order_by(desc(AirQualityRecord.annee)).offset(skip).limit(limit).all()
+    return db.execute(query.limit(limit)).all()
+
+
+@instrument
+def iter_records(
+    db: Session,
+    commune: Optional[str] = None,
+    region: Optional[str] = None,
+    annee: Optional[int] = None,
+    match: MatchMode = "contains",
+    batch_size: int = EXPORT_BATCH_SIZE,
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+) -> Iterator[List[Row]]:
+    """
+    Stream every record matching the filters in batches of rows.
 
+    Uses a server-side cursor where the driver supports one, so memory
+    depends on ``batch_size`` only, however many rows match.
+    """
+    query = records_statement(_dialect(db), commune, region, annee, match, bbox, near)
+    result = db.execute(query.execution_options(yield_per=batch_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
 
+
+@instrument
 def get_record_by_id(db: Session, record_id: int) -> Optional[AirQualityRecord]:
     """Get a single record by ID"""
     return db.query(AirQualityRecord).filter(AirQualityRecord.id == record_id).first()
 
 
+@instrument
 def get_total_count(
     db: Session,
     commune: Optional[str] = None,
     region: Optional[str] = None,
-    annee: Optional[int] = None
+    annee: Optional[int] = None,
+    match: MatchMode = "contains",
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
 ) -> int:
     """Get total count of records with filters"""
-    query = db.query(func.count(AirQualityRecord.id))
-    
-    if commune:
-        query = query.filter(AirQualityRecord.commune.ilike(f"%{commune}%"))
-    if region:
-        query = query.filter(AirQualityRecord.region.ilike(f"%{region}%"))
-    if annee:
-        query = query.filter(AirQualityRecord.annee == annee)
-    
+    query = _apply_record_filters(
+        db.query(func.count(AirQualityRecord.id)), _dialect(db), commune, region, annee, match, bbox, near
+    )
     return query.scalar()
 
 
+def _estimate_count(
+    db: Session,
+    commune: Optional[str] = None,
+    region: Optional[str] = None,
+    annee: Optional[int] = None,
+    match: MatchMode = "contains",
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+) -> Optional[int]:
+    """
+    Estimate a filtered row count from PostgreSQL planner statistics.
+
+    Unfiltered counts read ``pg_class.reltuples``; filtered counts take the
+    row estimate of the top plan node from ``EXPLAIN``. Returns None when no
+    estimate is available (other dialects, never-analyzed table).
+    """
+    if _dialect(db) != "postgresql":
+        return None
+
+    if not (commune or region or annee or bbox or near):
+        estimate = db.execute(
+            _SELECT_RELTUPLES,
+            {"table": AirQualityRecord.__tablename__}
+        ).scalar()
+    else:
+        query = _apply_record_filters(
+            db.query(AirQualityRecord.id), "postgresql", commune, region, annee, match, bbox, near
+        )
+        compiled = query.statement.compile(dialect=db.get_bind().dialect)
+        params = (
+            tuple(compiled.params[name] for name in compiled.positiontup)
+            if compiled.positional else compiled.params
+        )
+        plan = db.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled}", params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]["Plan"]["Plan Rows"]
+
+    if estimate is None or estimate < 0:
+        return None
+    return int(estimate)
+
+
+@instrument
+def count_records(
+    db: Session,
+    commune: Optional[str] = None,
+    region: Optional[str] = None,
+    annee: Optional[int] = None,
+    mode: str = "exact",
+    match: MatchMode = "contains",
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+) -> Tuple[Optional[int], str]:
+    """
+    Count records for a listing according to a counting strategy.
+
+    - **exact**: ``COUNT`` cached per filter combination until the next write
+    - **estimate**: planner statistics on PostgreSQL, exact elsewhere
+    - **none**: skip counting
+
+    Returns ``(total, mode)`` where ``mode`` is the strategy actually used.
+    """
+    if mode == "none":
+        return None, "none"
+
+    if mode == "estimate":
+        estimate = _estimate_count(db, commune, region, annee, match, bbox, near)
+        if estimate is not None:
+            return estimate, "estimate"
+
+    key = (commune, region, annee, match, bbox, near)
+    version = dataset_version()
+    total = _count_cache.get(key)
+    if total is None:
+        total = get_total_count(
+            db, commune=commune, region=region, annee=annee, match=match, bbox=bbox, near=near
+        )
+        _count_cache.set(key, total, version)
+    return total, "exact"
+
+
+@instrument
 def create_record(db: Session, record: AirQualityCreate) -> AirQualityRecord:
     """Create a new air quality record"""
     db_record = AirQualityRecord(**record.model_dump())
@@ -62,6 +298,90 @@ def create_record(db: Session, record: AirQualityCreate) -> AirQualityRecord:
     return db_record
 
 
+# Natural key of a measurement, backed by the uq_code_insee_annee index
+UPSERT_KEY = ("code_insee", "annee")
+UPSERT_BATCH_SIZE = 500
+
+
+def upsert_statement(statement):
+    """
+    Turn an INSERT (values or from_select) into an upsert on ``UPSERT_KEY``.
+
+    Conflicting rows are only rewritten when at least one value actually
+    differs, so re-importing unchanged data touches nothing. Returns the
+    ids of written rows.
+    """
+    table = AirQualityRecord.__table__
+    update_columns = [c.name for c in table.columns if c.name not in ("id",) + UPSERT_KEY]
+    compared_columns = [c for c in update_columns if not c.endswith("_norm")]
+
+    statement = statement.on_conflict_do_update(
+        index_elements=list(UPSERT_KEY),
+        set_={c: statement.excluded[c] for c in update_columns},
+        where=or_(*[table.c[c].is_distinct_from(statement.excluded[c]) for c in compared_columns])
+    )
+    return statement.returning(table.c.id)
+
+
+def dialect_insert(dialect: str):
+    """The ON CONFLICT-capable insert() construct for a dialect"""
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upsert is not supported on {dialect}")
+
+
+def dedupe_rows(rows: Iterable[dict]) -> List[dict]:
+    """Keep the last row per natural key (one statement can't touch a row twice)"""
+    return list({tuple(row[k] for k in UPSERT_KEY): row for row in rows}.values())
+
+
+def _rollup_groups(db: Session, rows: List[dict]) -> set:
+    """Rollup groups of the rows plus the groups their keys currently belong to"""
+    key = tuple_(*[getattr(AirQualityRecord, k) for k in UPSERT_KEY])
+    current = db.execute(
+        select(*[getattr(AirQualityRecord, k) for k in rollup.GROUP_KEYS])
+        .where(key.in_([tuple(row[k] for k in UPSERT_KEY) for row in rows]))
+    ).all()
+    return {tuple(g) for g in current} | {tuple(row[k] for k in rollup.GROUP_KEYS) for row in rows}
+
+
+@instrument
+def upsert_rows(db: Session, rows: List[dict], refresh_rollup: bool = True) -> int:
+    """
+    Upsert plain row dicts (with derived columns) without committing.
+
+    Returns the number of rows inserted or changed. Pass
+    ``refresh_rollup=False`` when the caller rebuilds the rollup itself.
+    """
+    insert = dialect_insert(_dialect(db))
+    written = 0
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        batch = rows[start:start + UPSERT_BATCH_SIZE]
+        groups = _rollup_groups(db, batch) if refresh_rollup else None
+        statement = upsert_statement(insert(AirQualityRecord.__table__).values(batch))
+        batch_written = len(db.execute(statement).all())
+        if batch_written and refresh_rollup:
+            rollup.refresh_groups(db.connection(), groups)
+        written += batch_written
+    return written
+
+
+@instrument
+def upsert_records(db: Session, records: List[AirQualityCreate]) -> dict:
+    """Insert or update records keyed on (code_insee, annee)"""
+    rows = dedupe_rows(AirQualityRecord.derived_values(r.model_dump()) for r in records)
+    written = upsert_rows(db, rows)
+    db.commit()
+    return {
+        "received": len(records),
+        "written": written,
+        "unchanged": len(rows) - written,
+    }
+
+
+@instrument
 def update_record(
     db: Session,
     record_id: int,
@@ -81,6 +401,7 @@ def update_record(
     return db_record
 
 
+@instrument
 def delete_record(db: Session, record_id: int) -> bool:
     """Delete a record by ID"""
     db_record = get_record_by_id(db, record_id)
@@ -92,12 +413,14 @@ def delete_record(db: Session, record_id: int) -> bool:
     return True
 
 
+@instrument
 def get_regions(db: Session) -> List[str]:
     """Get list of unique regions"""
     results = db.query(AirQualityRecord.region).distinct().order_by(AirQualityRecord.region).all()
     return [r[0] for r in results]
 
 
+@instrument
 def get_communes(db: Session, region: Optional[str] = None) -> List[str]:
     """Get list of unique communes"""
     query = db.query(AirQualityRecord.commune).distinct()
@@ -107,30 +430,114 @@ def get_communes(db: Session, region: Optional[str] = None) -> List[str]:
     return [c[0] for c in results]
 
 
+@instrument
 def get_years(db: Session) -> List[int]:
     """Get list of available years"""
     results = db.query(AirQualityRecord.annee).distinct().order_by(desc(AirQualityRecord.annee)).all()
     return [y[0] for y in results]
 
 
-def get_stats_by_region(db: Session, region: str, annee: Optional[int] = None) -> dict:
-    """Get aggregated statistics for a region"""
-    query = db.query(
-        func.count(AirQualityRecord.id).label('count'),
-        func.avg(AirQualityRecord.no2).label('avg_no2'),
-        func.avg(AirQualityRecord.pm10).label('avg_pm10'),
-        func.avg(AirQualityRecord.pm25).label('avg_pm25'),
-        func.avg(AirQualityRecord.o3).label('avg_o3'),
-        func.max(AirQualityRecord.no2).label('max_no2'),
-        func.max(AirQualityRecord.pm10).label('max_pm10'),
-        func.min(AirQualityRecord.no2).label('min_no2'),
-        func.min(AirQualityRecord.pm10).label('min_pm10'),
-    ).filter(AirQualityRecord.region.ilike(f"%{region}%"))
-    
-    if annee:
-        query = query.filter(AirQualityRecord.annee == annee)
-    
-    result = query.first()
+def _rollup_avg(pollutant: str):
+    """Average of a pollutant over rollup groups (NULL when never measured)"""
+    return (
+        func.sum(rollup_table.c[f"{pollutant}_sum"])
+        / func.nullif(func.sum(rollup_table.c[f"{pollutant}_count"]), 0)
+    )
+
+
+def _region_stats_columns():
+    """Aggregate columns of region statistics over rollup rows"""
+    t = rollup_table.c
+    return (
+        func.sum(t.count).label('count'),
+        _rollup_avg('no2').label('avg_no2'),
+        _rollup_avg('pm10').label('avg_pm10'),
+        _rollup_avg('pm25').label('avg_pm25'),
+        _rollup_avg('o3').label('avg_o3'),
+        func.max(t.no2_max).label('max_no2'),
+        func.max(t.pm10_max).label('max_pm10'),
+        func.min(t.no2_min).label('min_no2'),
+        func.min(t.pm10_min).label('min_pm10'),
+    )
+
+
+def _distributions(
+    db: Session,
+    key=None,
+    region_norms: Optional[List[str]] = None,
+    percentiles: bool = False,
+    **filters
+) -> Dict[Optional[str], SimpleNamespace]:
+    """
+    Exceedances, and percentiles if asked, of the records matching ``filters``.
+
+    Grouped by the ``key`` column when given, else a single result under
+    the ``None`` key. Both scan the raw table, so results are cached per
+    filter combination (see ``_distribution_cache``).
+    """
+    version = dataset_version()
+    cache_key = (
+        key.key if key is not None else None,
+        tuple(region_norms) if region_norms is not None else None,
+        percentiles,
+        tuple(sorted(filters.items())),
+    )
+    results = _distribution_cache.get(cache_key)
+    if results is None:
+        results = _compute_distributions(db, key, region_norms, percentiles, filters)
+        _distribution_cache.set(cache_key, results, version)
+    return results
+
+
+def _compute_distributions(
+    db: Session,
+    key,
+    region_norms: Optional[List[str]],
+    percentiles: bool,
+    filters: dict
+) -> Dict[Optional[str], SimpleNamespace]:
+    """
+    Uncached ``_distributions``.
+
+    Percentiles come from ``percentile_cont`` on PostgreSQL and from NumPy
+    over the matching measurements elsewhere.
+    """
+    dialect = _dialect(db)
+    keys = [key] if key is not None else []
+
+    def filtered(query):
+        query = _apply_record_filters(query, dialect, **filters)
+        if region_norms is not None:
+            query = query.filter(AirQualityRecord.region_norm.in_(region_norms))
+        return query
+
+    columns = [exceedance_column(p) for p in DISTRIBUTION_POLLUTANTS]
+    if percentiles and dialect == "postgresql":
+        columns += [c for p in DISTRIBUTION_POLLUTANTS for c in percentile_columns(p)]
+    results = {
+        (row[0] if keys else None): SimpleNamespace(**row._asdict())
+        for row in filtered(db.query(*keys, *columns)).group_by(*keys).all()
+    }
+    if not percentiles or dialect == "postgresql" or not results:
+        return results
+
+    measurements = [getattr(AirQualityRecord, p) for p in DISTRIBUTION_POLLUTANTS]
+    rows = filtered(db.query(*keys, *measurements)).all()
+    values = list(zip(*rows)) if rows else [()] * (len(keys) + len(measurements))
+    if keys:
+        uniques, inverse = np.unique(np.array(values.pop(0), dtype=str), return_inverse=True)
+        uniques = [str(u) for u in uniques]
+    else:
+        uniques, inverse = [None], np.zeros(len(rows), dtype=np.int64)
+    for pollutant, column in zip(DISTRIBUTION_POLLUTANTS, values):
+        column = np.array(column, dtype=np.float64)
+        for group, percentiles in zip(uniques, grouped_percentiles(inverse, len(uniques), column)):
+            set_percentiles(results[group], percentiles, pollutant)
+    return results
+
+
+def _region_stats(region: str, annee: Optional[int], result, spread, percentiles: bool) -> dict:
+    """Format a row of region statistics and its distribution"""
     return {
         "region": region,
         "annee": annee,
@@ -143,20 +550,147 @@ def get_stats_by_region(db: Session, region: str, annee: Optional[int] = None) -
         "max_pm10": result.max_pm10,
         "min_no2": result.min_no2,
         "min_pm10": result.min_pm10,
+        "distribution": format_distribution(spread, percentiles),
     }
 
 
-def get_stats_by_commune(db: Session, commune: str) -> dict:
-    """Get aggregated statistics for a commune"""
-    query = db.query(
-        func.count(AirQualityRecord.id).label('count'),
-        func.avg(AirQualityRecord.no2).label('avg_no2'),
-        func.avg(AirQualityRecord.pm10).label('avg_pm10'),
-        func.avg(AirQualityRecord.pm25).label('avg_pm25'),
-        func.avg(AirQualityRecord.o3).label('avg_o3'),
-    ).filter(AirQualityRecord.commune.ilike(f"%{commune}%"))
+@instrument
+def get_stats_by_region(
+    db: Session,
+    region: str,
+    annee: Optional[int] = None,
+    match: MatchMode = "contains",
+    percentiles: bool = False
+) -> dict:
+    """
+    Get aggregated statistics for a region (answered from the rollup).
+
+    Exceedances are cached per dataset version; ``percentiles`` adds the
+    p50/p90/p98 of the measurements.
+    """
+    if analytics.enabled():
+        result = analytics.store.region_stats(db, region, annee, match)
+        return _region_stats(region, annee, result, result, percentiles)
+
+    t = rollup_table.c
+    query = db.query(*_region_stats_columns()).filter(
+        match_condition(t.region_norm, region, match, _dialect(db))
+    )
+    if annee:
+        query = query.filter(t.annee == annee)
+    
+    spread = _distributions(db, region=region, annee=annee, match=match, percentiles=percentiles)[None]
+    return _region_stats(region, annee, query.first(), spread, percentiles)
+
+
+@instrument
+def compare_regions(
+    db: Session,
+    regions: Optional[List[str]] = None,
+    annee: Optional[int] = None,
+    percentiles: bool = False,
+    match: MatchMode = "contains"
+) -> List[dict]:
+    """
+    Get statistics for several regions in one query.
+
+    Each name is matched like ``get_stats_by_region`` does with ``match``,
+    so a compared region has the statistics of its own endpoint. Results
+    follow the order of ``regions``; regions without data are left out.
+    ``regions=None`` compares every region, in alphabetical order.
+    """
+    if regions is not None and match != "exact":
+        return _compare_matching(db, regions, annee, percentiles, match)
+
+    # Exact names: one GROUP BY over the normalized names
+    norms = [normalize_text(r) for r in regions] if regions is not None else None
+    if analytics.enabled():
+        results = analytics.store.compare_regions(db, regions, annee)
+        spreads = {row.region_norm: row for row in results}
+    else:
+        t = rollup_table.c
+        query = db.query(func.max(t.region).label('region'), t.region_norm, *_region_stats_columns())
+        if norms is not None:
+            query = query.filter(t.region_norm.in_(norms))
+        if annee:
+            query = query.filter(t.annee == annee)
+        results = query.group_by(t.region_norm).all()
+        spreads = _distributions(
+            db, key=AirQualityRecord.region_norm, region_norms=norms, percentiles=percentiles, annee=annee
+        )
+    rows = {row.region_norm: row for row in results}
+
+    if regions is None:
+        return [
+            _region_stats(row.region, annee, row, spreads.get(row.region_norm), percentiles)
+            for row in sorted(rows.values(), key=lambda r: r.region)
+        ]
+    return [
+        _region_stats(region, annee, rows[norm], spreads.get(norm), percentiles)
+        for region, norm in zip(regions, norms)
+        if norm in rows
+    ]
+
+
+def _compare_matching(
+    db: Session,
+    regions: List[str],
+    annee: Optional[int],
+    percentiles: bool,
+    match: MatchMode
+) -> List[dict]:
+    """``compare_regions`` by prefix or substring: one aggregate per name, in a UNION ALL"""
+    if analytics.enabled():
+        results = spreads = [analytics.store.region_stats(db, r, annee, match) for r in regions]
+    else:
+        t = rollup_table.c
+        dialect = _dialect(db)
+        queries = []
+        for position, region in enumerate(regions):
+            # Inline constant: an untyped bind in a UNION's select list trips asyncpg
+            label = literal_column(str(position)).label('position')
+            query = db.query(label, *_region_stats_columns()).filter(
+                match_condition(t.region_norm, region, match, dialect)
+            )
+            if annee:
+                query = query.filter(t.annee == annee)
+            queries.append(query)
+        rows = {row.position: row for row in queries[0].union_all(*queries[1:]).all()}
+        results = [rows[position] for position in range(len(regions))]
+        spreads = [
+            _distributions(db, region=region, annee=annee, match=match, percentiles=percentiles)[None]
+            if result.count else None
+            for region, result in zip(regions, results)
+        ]
+    return [
+        _region_stats(region, annee, result, spread, percentiles)
+        for region, result, spread in zip(regions, results, spreads)
+        if result.count
+    ]
+
+
+@instrument
+def get_stats_by_commune(
+    db: Session,
+    commune: str,
+    match: MatchMode = "contains",
+    percentiles: bool = False
+) -> dict:
+    """Get aggregated statistics for a commune, with p50/p90/p98 if ``percentiles``"""
+    if analytics.enabled():
+        result = spread = analytics.store.commune_stats(db, commune, match)
+    else:
+        query = db.query(
+            func.count(AirQualityRecord.id).label('count'),
+            func.avg(AirQualityRecord.no2).label('avg_no2'),
+            func.avg(AirQualityRecord.pm10).label('avg_pm10'),
+            func.avg(AirQualityRecord.pm25).label('avg_pm25'),
+            func.avg(AirQualityRecord.o3).label('avg_o3'),
+        )
+        query = _apply_record_filters(query, _dialect(db), commune=commune, match=match)
+        result = query.first()
+        spread = _distributions(db, commune=commune, match=match, percentiles=percentiles)[None]
     
-    result = query.first()
     return {
         "commune": commune,
         "count": result.count or 0,
@@ -164,33 +698,286 @@ def get_stats_by_commune(db: Session, commune: str) -> dict:
         "avg_pm10": round(result.avg_pm10, 2) if result.avg_pm10 else None,
         "avg_pm25": round(result.avg_pm25, 2) if result.avg_pm25 else None,
         "avg_o3": round(result.avg_o3, 2) if result.avg_o3 else None,
+        "distribution": format_distribution(spread, percentiles),
     }
 
 
+def _trend_rows(
+    db: Session,
+    pollutant: str,
+    region: Optional[str],
+    commune: Optional[str],
+    match: MatchMode
+):
+    """Per year averages of a pollutant; from the rollup unless a commune is given"""
+    if commune:
+        query = db.query(
+            AirQualityRecord.annee,
+            func.avg(getattr(AirQualityRecord, pollutant)).label('value')
+        )
+        query = _apply_record_filters(query, _dialect(db), commune=commune, region=region, match=match)
+        annee = AirQualityRecord.annee
+    else:
+        t = rollup_table.c
+        query = db.query(t.annee.label('annee'), _rollup_avg(pollutant).label('value'))
+        if region:
+            query = query.filter(match_condition(t.region_norm, region, match, _dialect(db)))
+        annee = t.annee
+    
+    return query.group_by(annee).order_by(annee).all()
+
+
+@instrument
 def get_pollutant_trend(
     db: Session,
     pollutant: str,
     region: Optional[str] = None,
-    commune: Optional[str] = None
+    commune: Optional[str] = None,
+    match: MatchMode = "contains"
 ) -> List[dict]:
-    """Get trend of a specific pollutant over years"""
-    pollutant_column = getattr(AirQualityRecord, pollutant, None)
-    if not pollutant_column:
+    """
+    Get trend of a specific pollutant over years.
+
+    Region-level trends are answered from the rollup; commune filters need
+    the raw table.
+    """
+    if pollutant not in POLLUTANTS:
         return []
     
-    query = db.query(
-        AirQualityRecord.annee,
-        func.avg(pollutant_column).label('value')
-    )
-    
-    if region:
-        query = query.filter(AirQualityRecord.region.ilike(f"%{region}%"))
-    if commune:
-        query = query.filter(AirQualityRecord.commune.ilike(f"%{commune}%"))
-    
-    results = query.group_by(AirQualityRecord.annee).order_by(AirQualityRecord.annee).all()
+    if analytics.enabled():
+        results = analytics.store.pollutant_trend(db, pollutant, region, commune, match)
+    else:
+        results = _trend_rows(db, pollutant, region, commune, match)
     
     return [
         {"annee": r.annee, "value": round(r.value, 2) if r.value else None}
         for r in results
     ]
+
+
+def _summary_row(db: Session):
+    """Dataset-wide aggregates in a single query"""
+    return db.query(
+        func.count(AirQualityRecord.id).label('total_records'),
+        func.count(func.distinct(AirQualityRecord.region)).label('total_regions'),
+        func.count(func.distinct(AirQualityRecord.commune)).label('total_communes'),
+        func.avg(AirQualityRecord.no2).label('avg_no2'),
+        func.avg(AirQualityRecord.pm10).label('avg_pm10'),
+        func.avg(AirQualityRecord.pm25).label('avg_pm25'),
+        func.avg(AirQualityRecord.o3).label('avg_o3'),
+        func.min(AirQualityRecord.annee).label('min_annee'),
+        func.max(AirQualityRecord.annee).label('max_annee'),
+    ).one()
+
+
+@instrument
+def get_summary(db: Session) -> dict:
+    """
+    Get a summary of the whole dataset.
+
+    Computed with a single aggregate query and kept as a snapshot until
+    the dataset version changes, so repeated dashboard loads don't touch
+    the database. The snapshot also expires after ``METADATA_SOFT_TTL``
+    seconds, so the background refresh of ``app.refresher`` recomputes it
+    after writes this process cannot see.
+    """
+    version = dataset_version()
+    summary = _summary_cache.get("summary")
+    if summary is not None:
+        return summary
+
+    result = analytics.store.summary(db) if analytics.enabled() else _summary_row(db)
+
+    summary = {
+        "total_records": result.total_records,
+        "total_regions": result.total_regions,
+        "total_communes": result.total_communes,
+        "year_range": {
+            "min": result.min_annee,
+            "max": result.max_annee
+        },
+        "global_averages": {
+            "no2": round(result.avg_no2, 2) if result.avg_no2 else None,
+            "pm10": round(result.avg_pm10, 2) if result.avg_pm10 else None,
+            "pm25": round(result.avg_pm25, 2) if result.avg_pm25 else None,
+            "o3": round(result.avg_o3, 2) if result.avg_o3 else None,
+        }
+    }
+    _summary_cache.set("summary", summary, version)
+    return summary
+
+
+@instrument
+def get_dashboard(db: Session, page_size: int = 20, pollutant: str = "no2") -> dict:
+    """
+    Everything the dashboard shows on load, in one payload.
+
+    Regions, years, the record total and the ``pollutant`` trend all come
+    from a single query over the rollup grouped by region and year; with
+    the first page of records and the summary snapshot, a cold call runs
+    three queries at most. Kept until the dataset version changes or for
+    ``METADATA_SOFT_TTL`` seconds, like ``get_summary``.
+    """
+    version = dataset_version()
+    key = (page_size, pollutant)
+    dashboard = _dashboard_cache.get(key)
+    if dashboard is not None:
+        return dashboard
+
+    t = rollup_table.c
+    groups = db.query(
+        t.region,
+        t.annee,
+        func.sum(t.count).label('count'),
+        func.sum(t[f"{pollutant}_sum"]).label('total'),
+        func.sum(t[f"{pollutant}_count"]).label('measured'),
+    ).group_by(t.region, t.annee).order_by(t.region).all()
+
+    years: Dict[int, list] = {}
+    for group in groups:
+        year = years.setdefault(group.annee, [0.0, 0])
+        year[0] += group.total or 0.0
+        year[1] += group.measured or 0
+
+    rows = get_records(db, skip=0, limit=page_size + 1)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].annee, rows[-1].id)
+
+    dashboard = {
+        "regions": list(dict.fromkeys(g.region for g in groups)),
+        "years": sorted(years, reverse=True),
+        "summary": get_summary(db),
+        "records": {
+            "total": sum(g.count for g in groups),
+            "count_mode": "exact",
+            "page": 1,
+            "page_size": page_size,
+            "next_cursor": next_cursor,
+            "data": [dict(zip(RECORD_FIELDS, row)) for row in rows],
+        },
+        "trend": {
+            "pollutant": pollutant,
+            "region": None,
+            "commune": None,
+            "data": [
+                {"annee": annee, "value": round(total / measured, 2) if measured and total else None}
+                for annee, (total, measured) in sorted(years.items())
+            ],
+        },
+    }
+    _dashboard_cache.set(key, dashboard, version)
+    return dashboard
+
+
+def _cell_index(column, origin: float, size: float, dialect: str):
+    """Index of the grid cell containing ``column`` along one axis"""
+    offset = (column - origin) / size
+    if dialect == "postgresql":
+        return func.floor(offset)
+    return cast(offset, Integer)  # offset >= 0, truncation is floor
+
+
+@instrument
+def get_map_points(
+    db: Session,
+    pollutant: str,
+    annee: Optional[int] = None,
+    bbox: Optional[BBox] = None,
+    cell_size: Optional[float] = None
+) -> List[Row]:
+    """
+    Average of a pollutant per located commune, or per grid cell of
+    ``cell_size`` degrees, over the records inside ``bbox``.
+
+    Rows have ``longitude``/``latitude`` (mean position of the records),
+    ``value`` and ``communes``; per commune rows also have ``code_insee``,
+    ``commune`` and ``region``.
+    """
+    value = getattr(AirQualityRecord, pollutant)
+    longitude, latitude = AirQualityRecord.longitude, AirQualityRecord.latitude
+    columns = [
+        func.avg(longitude).label('longitude'),
+        func.avg(latitude).label('latitude'),
+        func.avg(value).label('value'),
+        func.count(func.distinct(AirQualityRecord.code_insee)).label('communes'),
+    ]
+    if cell_size is None:
+        keys = [AirQualityRecord.code_insee]
+        columns += [
+            AirQualityRecord.code_insee,
+            func.max(AirQualityRecord.commune).label('commune'),
+            func.max(AirQualityRecord.region).label('region'),
+        ]
+    else:
+        dialect = _dialect(db)
+        keys = [
+            _cell_index(longitude, -180, cell_size, dialect),
+            _cell_index(latitude, -90, cell_size, dialect),
+        ]
+
+    query = db.query(*columns).filter(
+        value.isnot(None), longitude.isnot(None), latitude.isnot(None)
+    )
+    if annee:
+        query = query.filter(AirQualityRecord.annee == annee)
+    if bbox:
+        query = query.filter(_bbox_condition(bbox))
+    return query.group_by(*keys).all()
+
+
+@instrument
+def get_nearest_communes(
+    db: Session,
+    latitude: float,
+    longitude: float,
+    limit: int = 5,
+    radius_km: float = 50
+) -> List[dict]:
+    """
+    Located communes closest to a point, within ``radius_km``.
+
+    Candidates come from the spatial index; their haversine distance is
+    computed on the (few) matching rows. Closest first.
+    """
+    near = Near(latitude, longitude, radius_km)
+    query = db.query(
+        AirQualityRecord.code_insee,
+        func.max(AirQualityRecord.commune).label('commune'),
+        func.max(AirQualityRecord.region).label('region'),
+        func.max(AirQualityRecord.departement).label('departement'),
+        func.avg(AirQualityRecord.latitude).label('latitude'),
+        func.avg(AirQualityRecord.longitude).label('longitude'),
+    ).filter(_near_condition(near, _dialect(db))).group_by(AirQualityRecord.code_insee)
+
+    communes = [
+        {
+            "commune": row.commune,
+            "code_insee": row.code_insee,
+            "region": row.region,
+            "departement": row.departement,
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+            "distance_km": round(geo.distance_km(latitude, longitude, row.latitude, row.longitude), 3),
+        }
+        for row in query.all()
+    ]
+    communes.sort(key=lambda c: c["distance_km"])
+    return communes[:limit]
+
+
+def backfill_grid_cells(connection) -> int:
+    """Compute the grid cell of located records that lack one"""
+    dialect = connection.dialect.name
+    t = AirQualityRecord.__table__.c
+    cell = (
+        _cell_index(t.latitude, -90, geo.CELL_SIZE, dialect) * geo.GRID_WIDTH
+        + _cell_index(t.longitude, -180, geo.CELL_SIZE, dialect)
+    )
+    result = connection.execute(
+        update(AirQualityRecord.__table__)
+        .where(t.grid_cell.is_(None), t.latitude.isnot(None), t.longitude.isnot(None))
+        .values(grid_cell=cast(cell, Integer))
+    )
+    return result.rowcount
@@ -0,0 +1,119 @@
+"""
+Async variants of the CRUD operations
+
+Each function mirrors the one of the same name in ``app.crud`` and
+accepts either session kind:
+
+- ``AsyncSession``: the sync implementation runs through
+  ``AsyncSession.run_sync``, so every query is awaited on the async driver
+  (asyncpg / aiosqlite) and no thread is held while the database works.
+- ``Session``: the call is offloaded to Starlette's threadpool, which is
+  what FastAPI did for the former ``def`` handlers.
+
+Keeping a single sync implementation means the query logic, the cache
+and the rollup maintenance (driven by ``Session`` events, which also fire
+under ``AsyncSession``) cannot drift between the two paths.
+
+Reads returning plain rows and dicts are coalesced: concurrent identical
+calls share one query (see ``app.singleflight``). ``get_record_by_id`` is
+not, since it returns an entity attached to the caller's session.
+"""
+import functools
+from typing import Any, AsyncIterator, Callable, List, Optional, TypeVar, Union
+
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from app import crud
+from app.geo import BBox, Near
+from app.metrics import instrument
+from app.search import MatchMode
+from app.singleflight import coalesce
+
+T = TypeVar("T")
+
+AnySession = Union[AsyncSession, Session]
+
+
+async def run(db: AnySession, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run ``fn(session, *args, **kwargs)`` without blocking the event loop"""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def rollback(db: AnySession) -> None:
+    """Roll back the current transaction"""
+    if isinstance(db, AsyncSession):
+        await db.rollback()
+    else:
+        await run_in_threadpool(db.rollback)
+
+
+def _async_variant(fn: Callable[..., T]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    async def wrapper(db: AnySession, *args: Any, **kwargs: Any) -> T:
+        return await run(db, fn, *args, **kwargs)
+    return wrapper
+
+
+get_records = coalesce(_async_variant(crud.get_records))
+get_record_by_id = _async_variant(crud.get_record_by_id)
+get_total_count = coalesce(_async_variant(crud.get_total_count))
+count_records = coalesce(_async_variant(crud.count_records))
+create_record = _async_variant(crud.create_record)
+upsert_rows = _async_variant(crud.upsert_rows)
+upsert_records = _async_variant(crud.upsert_records)
+update_record = _async_variant(crud.update_record)
+delete_record = _async_variant(crud.delete_record)
+get_regions = coalesce(_async_variant(crud.get_regions))
+get_communes = coalesce(_async_variant(crud.get_communes))
+get_years = coalesce(_async_variant(crud.get_years))
+get_stats_by_region = coalesce(_async_variant(crud.get_stats_by_region))
+compare_regions = coalesce(_async_variant(crud.compare_regions))
+get_stats_by_commune = coalesce(_async_variant(crud.get_stats_by_commune))
+get_pollutant_trend = coalesce(_async_variant(crud.get_pollutant_trend))
+get_summary = coalesce(_async_variant(crud.get_summary))
+get_dashboard = coalesce(_async_variant(crud.get_dashboard))
+get_map_points = coalesce(_async_variant(crud.get_map_points))
+get_nearest_communes = coalesce(_async_variant(crud.get_nearest_communes))
+
+
+@instrument
+async def stream_records(
+    db: AnySession,
+    commune: Optional[str] = None,
+    region: Optional[str] = None,
+    annee: Optional[int] = None,
+    match: MatchMode = "contains",
+    batch_size: int = crud.EXPORT_BATCH_SIZE,
+    bbox: Optional[BBox] = None,
+    near: Optional[Near] = None
+) -> AsyncIterator[List[Row]]:
+    """
+    Stream every record matching the filters in batches of rows.
+
+    Meant to feed a streaming response, which is sent after the request's
+    session has been closed: the rows are read through a dedicated session
+    bound to the same engine, closed when the stream ends.
+    """
+    filters = dict(commune=commune, region=region, annee=annee, match=match, bbox=bbox, near=near)
+
+    if isinstance(db, AsyncSession):
+        async with AsyncSession(db.bind, autoflush=False) as session:
+            query = crud.records_statement(db.bind.dialect.name, **filters)
+            result = await session.stream(query.execution_options(yield_per=batch_size))
+            async for batch in result.partitions():
+                yield batch
+        return
+
+    session = Session(bind=db.get_bind(), autoflush=False)
+    batches = crud.iter_records(session, batch_size=batch_size, **filters)
+    try:
+        async for batch in iterate_in_threadpool(batches):
+            yield batch
+    finally:
+        await run_in_threadpool(batches.close)
+        await run_in_threadpool(session.close)
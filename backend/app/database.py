@@ -3,9 +3,13 @@ Database configuration and utilities
 """
 import os
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 from app.models import Base, AirQualityRecord
+from app import crud, geo, rollup
+from app.pool import engine_options, pool_status
+from app.search import normalize_text
 
 logger = logging.getLogger(__name__)
 
@@ -26,14 +30,46 @@ if DATABASE_URL.startswith("sqlite"):
         connect_args={"check_same_thread": False}
     )
 else:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    engine = create_engine(DATABASE_URL, **engine_options())
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Serve requests through an async engine (asyncpg / aiosqlite). Startup,
+# ingestion CLI and maintenance keep using the sync engine above.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
 
-def get_db():
-    """Dependency to get database session"""
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(url: str) -> str:
+    """Rewrite a database URL to use the matching async driver"""
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+", 1)[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {scheme}")
+    return f"{ASYNC_DRIVERS[backend]}://{rest}"
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        async_database_url(DATABASE_URL),
+        **({} if DATABASE_URL.startswith("sqlite") else engine_options(is_async=True))
+    )
+    # Objects are serialized after the session commits, outside any
+    # greenlet, so they must not expire and lazy load
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+
+
+def get_sync_db():
+    """Dependency to get a sync database session"""
     db = SessionLocal()
     try:
         yield db
@@ -41,12 +77,153 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """Dependency to get an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Dependency to get database session; crud_async accepts either kind
+get_db = get_async_db if DB_ASYNC else get_sync_db
+
+
+def get_ingest_db():
+    """
+    Dependency to get a sync session for bulk imports, whatever ``DB_ASYNC``.
+
+    Reading, parsing and validating an upload blocks, so imports run in the
+    threadpool rather than on the event loop, and COPY needs psycopg2.
+    """
+    yield from get_sync_db()
+
+
+def get_pool_status() -> dict:
+    """Pool status of the engines serving requests"""
+    status = {"sync": pool_status(engine)}
+    if async_engine is not None:
+        status["async"] = pool_status(async_engine.sync_engine)
+    return status
+
+
 def create_tables():
     """Create all database tables"""
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created successfully")
 
 
+def _columns(connection, table: str) -> set:
+    """Column names of an existing table"""
+    return {column["name"] for column in inspect(connection).get_columns(table)}
+
+
+def _create_indexes(connection, names) -> None:
+    """Create the model indexes ``names`` missing from an existing table"""
+    for index in AirQualityRecord.__table__.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+def sync_search_columns(bind=engine):
+    """Add and fill the normalized search columns if the database predates them"""
+    table = AirQualityRecord.__tablename__
+    with bind.begin() as connection:
+        existing = _columns(connection, table)
+        for name in ("commune", "region"):
+            column = f"{name}_norm"
+            if column in existing:
+                continue
+            # Existing rows need a default to satisfy NOT NULL until filled
+            connection.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN {column} VARCHAR(100) NOT NULL DEFAULT ''"
+            ))
+            values = connection.execute(text(f"SELECT DISTINCT {name} FROM {table}")).scalars().all()
+            if values:
+                connection.execute(
+                    text(f"UPDATE {table} SET {column} = :normalized WHERE {name} = :value"),
+                    [{"normalized": normalize_text(v), "value": v} for v in values]
+                )
+            if connection.dialect.name == "postgresql":
+                # SQLite cannot drop a column default; writes always set it anyway
+                connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT"))
+            logger.info(f"Added {column} for {len(values)} distinct names")
+
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        _create_indexes(connection, ("idx_commune_norm", "idx_region_norm"))
+
+
+def sync_upsert_key(bind=engine):
+    """Drop duplicate (code_insee, annee) rows and add the upsert key if the database predates it"""
+    table = AirQualityRecord.__tablename__
+    with bind.begin() as connection:
+        if "uq_code_insee_annee" in {i["name"] for i in inspect(connection).get_indexes(table)}:
+            return
+        # Keep the latest row of each key, as a re-import would have
+        removed = connection.execute(text(
+            f"DELETE FROM {table} WHERE EXISTS ("
+            f"SELECT 1 FROM {table} AS newer WHERE newer.code_insee = {table}.code_insee "
+            f"AND newer.annee = {table}.annee AND newer.id > {table}.id)"
+        )).rowcount
+        if removed:
+            logger.warning(f"Removed {removed} duplicate (code_insee, annee) records")
+        _create_indexes(connection, ("uq_code_insee_annee",))
+
+
+def sync_rollup(bind=engine):
+    """Build the statistics rollup if the database predates it"""
+    with bind.begin() as connection:
+        rollup.rebuild_if_empty(connection)
+
+
+# Geography column and GiST index, created when PostGIS can be enabled
+POSTGIS_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS postgis",
+    f"ALTER TABLE {AirQualityRecord.__tablename__} ADD COLUMN IF NOT EXISTS geog geography(Point, 4326) "
+    "GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography) STORED",
+    f"CREATE INDEX IF NOT EXISTS idx_geog ON {AirQualityRecord.__tablename__} USING gist (geog)",
+)
+
+
+def sync_spatial(bind=engine):
+    """Fill the spatial grid cells and enable the PostGIS column when available"""
+    table = AirQualityRecord.__tablename__
+    with bind.begin() as connection:
+        # Databases created before the grid cell column
+        if "grid_cell" not in _columns(connection, table):
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN grid_cell INTEGER"))
+        _create_indexes(connection, ("idx_grid_cell",))
+        filled = crud.backfill_grid_cells(connection)
+    if filled:
+        logger.info(f"Computed the grid cell of {filled} records")
+
+    if bind.dialect.name != "postgresql":
+        return
+    try:
+        with bind.begin() as connection:
+            for statement in POSTGIS_DDL:
+                connection.execute(text(statement))
+    except SQLAlchemyError as e:
+        logger.info(f"PostGIS unavailable, radius searches use the grid index: {e}")
+        return
+    geo.postgis = True
+    logger.info("PostGIS enabled for radius searches")
+
+
+def sync_indexes(bind=engine):
+    """Create the model indexes missing from a table created by an older version"""
+    with bind.begin() as connection:
+        _create_indexes(connection, {index.name for index in AirQualityRecord.__table__.indexes})
+
+
+def sync_schema(bind=engine):
+    """Bring a database created by an older version to the current schema"""
+    sync_search_columns(bind)
+    sync_upsert_key(bind)
+    sync_rollup(bind)
+    sync_spatial(bind)
+    sync_indexes(bind)
+
+
 def load_sample_data():
     """Load sample data if database is empty"""
     db = SessionLocal()
@@ -0,0 +1,95 @@
+"""
+Percentile and exceedance statistics
+
+The statistics endpoints report, for each pollutant of ``app.thresholds``,
+the median, 90th and 98th percentiles of the measurements and the number
+of communes with a measurement above the guideline value.
+
+Percentiles interpolate linearly between the closest ranks, which is the
+definition of PostgreSQL's ``percentile_cont``: PostgreSQL computes them
+in SQL, other databases return the measurements and NumPy computes them
+per group. Exceedances are a ``COUNT(DISTINCT code_insee)`` everywhere.
+
+Percentiles need every measurement of the group, so they are only
+computed on request; exceedances always are.
+
+Raw results (SQL rows or namespaces) carry one ``p50_no2``-style
+attribute per percentile and one ``exceed_no2``-style attribute per
+pollutant; ``format_distribution`` turns them into the response shape.
+"""
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import case, func
+
+from app.models import AirQualityRecord
+from app.thresholds import THRESHOLDS
+
+DISTRIBUTION_POLLUTANTS = tuple(THRESHOLDS)
+
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p98": 0.98}
+
+
+def exceedance_column(pollutant: str):
+    """Number of distinct communes measured above the guideline value"""
+    column = getattr(AirQualityRecord, pollutant)
+    return func.count(func.distinct(
+        case((column > THRESHOLDS[pollutant].low, AirQualityRecord.code_insee))
+    )).label(f"exceed_{pollutant}")
+
+
+def percentile_columns(pollutant: str) -> list:
+    """``percentile_cont`` aggregates of a pollutant (PostgreSQL only)"""
+    column = getattr(AirQualityRecord, pollutant)
+    return [
+        func.percentile_cont(fraction).within_group(column).label(f"{name}_{pollutant}")
+        for name, fraction in PERCENTILES.items()
+    ]
+
+
+def grouped_percentiles(inverse, size: int, values) -> List[List[Optional[float]]]:
+    """Percentiles of the non-missing ``values`` of each group"""
+    valid = ~np.isnan(values)
+    inverse, values = inverse[valid], values[valid]
+    order = np.lexsort((values, inverse))
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=size))])
+    sorted_values = values[order]
+    fractions = np.array(list(PERCENTILES.values())) * 100
+
+    results = []
+    for g in range(size):
+        group = sorted_values[bounds[g]:bounds[g + 1]]
+        if group.size:
+            results.append([float(v) for v in np.percentile(group, fractions)])
+        else:
+            results.append([None] * len(PERCENTILES))
+    return results
+
+
+def grouped_exceedances(inverse, size: int, codes, values, threshold: float):
+    """Number of distinct ``codes`` of each group with a value above ``threshold``"""
+    with np.errstate(invalid="ignore"):
+        above = values > threshold
+    if not above.any():
+        return np.zeros(size, dtype=np.int64)
+    pairs = np.unique(np.stack([inverse[above], codes[above]]), axis=1)
+    return np.bincount(pairs[0], minlength=size)
+
+
+def set_percentiles(target, percentiles: List[Optional[float]], pollutant: str) -> None:
+    """Store computed percentiles as ``p50_no2``-style attributes"""
+    for name, value in zip(PERCENTILES, percentiles):
+        setattr(target, f"{name}_{pollutant}", value)
+
+
+def format_distribution(result, percentiles: bool = True) -> dict:
+    """Per pollutant percentiles (None unless ``percentiles``) and exceedances of a raw result"""
+    distribution = {}
+    for pollutant in DISTRIBUTION_POLLUTANTS:
+        values = {}
+        for name in PERCENTILES:
+            value = getattr(result, f"{name}_{pollutant}", None) if percentiles else None
+            values[name] = round(value, 2) if value is not None else None
+        values["exceedances"] = getattr(result, f"exceed_{pollutant}", None) or 0
+        distribution[pollutant] = values
+    return distribution
@@ -0,0 +1,215 @@
+"""
+Streaming encoders for full dataset exports
+
+Each encoder turns an async stream of row batches (see
+``crud_async.stream_records``) into an async stream of byte chunks, one
+chunk per batch, so an export never holds more than one batch in memory.
+
+Columnar formats (Arrow IPC stream, Parquet) build one Arrow record batch
+per cursor batch, with a schema derived from ``AirQualityRecord``:
+pollutants as float32 (measurement precision is far below float32's),
+coordinates as float64, and nullability taken from the model columns.
+They require pyarrow.
+"""
+import csv
+import io
+import zlib
+from typing import AsyncIterator, List, Literal, Optional
+
+import orjson
+from sqlalchemy.engine import Row
+
+from app.crud import RECORD_FIELDS
+from app.models import AirQualityRecord, POLLUTANTS
+
+ExportFormat = Literal["ndjson", "csv", "arrow", "parquet"]
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": ARROW_STREAM_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+}
+
+FILE_EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrows", "parquet": "parquet"}
+
+# Formats that are worth compressing with gzip (Parquet pages already are)
+TEXT_FORMATS = ("ndjson", "csv")
+
+Batches = AsyncIterator[List[Row]]
+
+
+async def encode_ndjson(batches: Batches) -> AsyncIterator[bytes]:
+    """One JSON object per line, with the same fields as /records"""
+    async for batch in batches:
+        yield b"".join(orjson.dumps(dict(zip(RECORD_FIELDS, row))) + b"\n" for row in batch)
+
+
+async def encode_csv(batches: Batches) -> AsyncIterator[bytes]:
+    """CSV with a header row, empty cells for missing values"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(RECORD_FIELDS)
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # Header of an empty export
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ValueError("Arrow and Parquet formats require pyarrow") from e
+    return pyarrow
+
+
+def arrow_schema():
+    """Arrow schema of the exported records"""
+    pa = _pyarrow()
+    columns = AirQualityRecord.__table__.columns
+    fields = []
+    for name in RECORD_FIELDS:
+        if name in POLLUTANTS:
+            arrow_type = pa.float32()
+        elif name in ("latitude", "longitude"):
+            arrow_type = pa.float64()
+        elif name == "id":
+            arrow_type = pa.int32()
+        elif name == "annee":
+            arrow_type = pa.int16()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type, nullable=columns[name].nullable))
+    return pa.schema(fields)
+
+
+def to_record_batch(rows: List[Row], schema=None):
+    """Arrow record batch from rows of ``RECORD_COLUMNS``"""
+    pa = _pyarrow()
+    schema = schema or arrow_schema()
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_writer(export_format: str, sink: _ChunkSink, schema):
+    pa = _pyarrow()
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    return pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+
+
+async def _encode_columnar(batches: Batches, export_format: str) -> AsyncIterator[bytes]:
+    """Arrow IPC stream or Parquet file, one record batch / row group per batch"""
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    writer = _arrow_writer(export_format, sink, schema)
+    async for batch in batches:
+        writer.write_batch(to_record_batch(batch, schema))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+async def encode_arrow(batches: Batches) -> AsyncIterator[bytes]:
+    """Arrow IPC stream format"""
+    async for chunk in _encode_columnar(batches, "arrow"):
+        yield chunk
+
+
+async def encode_parquet(batches: Batches) -> AsyncIterator[bytes]:
+    """Parquet file, one row group per batch"""
+    async for chunk in _encode_columnar(batches, "parquet"):
+        yield chunk
+
+
+def encode_page(rows: List[Row], export_format: str) -> bytes:
+    """Encode one page of rows in a columnar format"""
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    writer = _arrow_writer(export_format, sink, schema)
+    writer.write_batch(to_record_batch(rows, schema))
+    writer.close()
+    return sink.drain()
+
+
+def negotiate(requested: Optional[str], accept: Optional[str], default: str) -> str:
+    """Format from the ``format`` parameter, else an Arrow ``Accept`` header"""
+    if requested:
+        return requested
+    if accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        return "arrow"
+    return default
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "arrow": encode_arrow,
+    "parquet": encode_parquet,
+}
+
+
+def encode(batches: Batches, export_format: ExportFormat) -> AsyncIterator[bytes]:
+    """Encode row batches in the requested format"""
+    return ENCODERS[export_format](batches)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip"""
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() != "gzip":
+            continue
+        key, _, value = params.partition("=")
+        try:
+            return key.strip() != "q" or float(value) > 0
+        except ValueError:
+            return False
+    return False
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Compress a byte stream on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,150 @@
+"""
+Geographic helpers: spatial grid, distances and the map layer
+
+Records carry a ``grid_cell``: the index of the 0.1° x 0.1° cell holding
+their coordinates, numbered row by row from (-90, -180). It is a plain
+B-tree indexed integer, so a bounding box becomes one ``BETWEEN`` range
+of cells per grid row and a viewport query only reads the rows inside
+it. When PostGIS is available (see ``database.sync_spatial``), a
+generated ``geog`` geography column with a GiST index answers radius
+searches instead; ``postgis`` records whether it is in use.
+
+Radius filters in SQL use an equirectangular approximation, which is
+well within commune size at these radii; distances reported to clients
+are haversine.
+
+The map is served as GeoJSON aggregated to the viewport: one feature per
+commune once zoomed in past ``CLUSTER_MAX_ZOOM``, and one feature per
+grid cell below. A cell spans a quarter of a web map tile at the
+requested zoom (360 / 2^zoom / 4 degrees), so the number of features
+depends on the viewport size in pixels, not on the number of records.
+"""
+import math
+from typing import List, NamedTuple, Optional, Tuple
+
+CLUSTER_MAX_ZOOM = 9
+CELLS_PER_TILE = 4
+
+# Spatial index grid
+CELL_SIZE = 0.1  # degrees
+GRID_WIDTH = round(360 / CELL_SIZE)  # cells per row
+MAX_CELL_RANGES = 64  # above, a bbox is looked up as a single range of cells
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+# Set at startup when the PostGIS geography column is available
+postgis = False
+
+
+class BBox(NamedTuple):
+    """Bounding box, in the GeoJSON order of its corners"""
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+
+def parse_bbox(value: Optional[str]) -> Optional[BBox]:
+    """Parse ``min_lon,min_lat,max_lon,max_lat``, raising ValueError when invalid"""
+    if not value:
+        return None
+    parts = value.split(",")
+    if len(parts) != 4:
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    bbox = BBox(*(float(p) for p in parts))
+    if not (-180 <= bbox.min_lon <= bbox.max_lon <= 180 and -90 <= bbox.min_lat <= bbox.max_lat <= 90):
+        raise ValueError("bbox corners are out of range or inverted")
+    return bbox
+
+
+class Near(NamedTuple):
+    """Circle around a point"""
+    latitude: float
+    longitude: float
+    radius_km: float
+
+
+def parse_near(value: Optional[str], radius_km: float) -> Optional[Near]:
+    """Parse ``lat,lon``, raising ValueError when invalid"""
+    if not value:
+        return None
+    parts = value.split(",")
+    if len(parts) != 2:
+        raise ValueError("near must be lat,lon")
+    latitude, longitude = (float(p) for p in parts)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("near is out of range")
+    return Near(latitude, longitude, radius_km)
+
+
+def grid_row(latitude: float) -> int:
+    return math.floor((latitude + 90) / CELL_SIZE)
+
+
+def grid_column(longitude: float) -> int:
+    return math.floor((longitude + 180) / CELL_SIZE)
+
+
+def grid_cell(latitude: Optional[float], longitude: Optional[float]) -> Optional[int]:
+    """Grid cell holding a point, None without coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    return grid_row(latitude) * GRID_WIDTH + grid_column(longitude)
+
+
+def cell_ranges(bbox: BBox) -> List[Tuple[int, int]]:
+    """Inclusive ranges of the grid cells covering ``bbox``"""
+    first_row, last_row = grid_row(bbox.min_lat), grid_row(bbox.max_lat)
+    first_column, last_column = grid_column(bbox.min_lon), grid_column(bbox.max_lon)
+    if last_row - first_row >= MAX_CELL_RANGES:
+        return [(first_row * GRID_WIDTH + first_column, last_row * GRID_WIDTH + last_column)]
+    return [
+        (row * GRID_WIDTH + first_column, row * GRID_WIDTH + last_column)
+        for row in range(first_row, last_row + 1)
+    ]
+
+
+def km_per_degree_longitude(latitude: float) -> float:
+    return KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6)
+
+
+def near_bbox(near: Near) -> BBox:
+    """Bounding box of a circle"""
+    delta_lat = near.radius_km / KM_PER_DEGREE
+    delta_lon = near.radius_km / km_per_degree_longitude(near.latitude)
+    return BBox(
+        max(near.longitude - delta_lon, -180),
+        max(near.latitude - delta_lat, -90),
+        min(near.longitude + delta_lon, 180),
+        min(near.latitude + delta_lat, 90),
+    )
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def cell_size(zoom: int) -> Optional[float]:
+    """Grid cell size in degrees at ``zoom``, None when communes are shown individually"""
+    if zoom > CLUSTER_MAX_ZOOM:
+        return None
+    return 360 / 2 ** zoom / CELLS_PER_TILE
+
+
+def point_feature(longitude: float, latitude: float, properties: dict) -> dict:
+    """GeoJSON point feature"""
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+        "properties": properties,
+    }
+
+
+def feature_collection(features: List[dict], **members) -> dict:
+    """GeoJSON feature collection, with extra foreign members"""
+    return {"type": "FeatureCollection", "features": features, **members}
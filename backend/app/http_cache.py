@@ -0,0 +1,138 @@
+"""
+HTTP response cache for the read-only endpoints
+
+``ResponseCacheMiddleware`` gives every cacheable GET a strong ETag
+derived from the dataset version, the process boot id, the path and the
+sorted query parameters. A matching ``If-None-Match`` is answered with
+``304 Not Modified`` before the request reaches a router, so it never
+touches the database. Successful bodies are kept in a bounded LRU with a
+TTL; entries die with the dataset version they were computed under, so
+committed writes invalidate them immediately.
+
+The cache is per process: the boot id keeps ETags from different workers
+or restarts from ever matching each other. Writes made by another process
+(the other replica, ``app.ingest``) do not move this process's dataset
+version, so the ETag also carries the current TTL period: validators and
+bodies both expire at the end of the period, and a response is never
+served or revalidated more than ``RESPONSE_CACHE_TTL`` seconds after it was
+computed.
+"""
+import hashlib
+import os
+import time
+import uuid
+from typing import Iterable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from app.cache import VersionedCache, dataset_version
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+CACHEABLE_PATHS = (
+    "/api/v1/regions",
+    "/api/v1/years",
+    "/api/v1/communes",
+    "/api/v1/stats/",
+    "/api/v1/trends/",
+    "/api/v1/summary",
+    "/api/v1/compare",
+    "/api/v1/thresholds",
+    "/api/v1/map",
+    "/api/v1/dashboard",
+)
+
+CACHE_CONTROL = b"no-cache"
+
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def ttl_period(ttl: float) -> int:
+    """Index of the current ``ttl`` seconds long period"""
+    return int(time.time() // ttl)
+
+
+def make_etag(path: str, query_string: bytes, version: int, period: int) -> str:
+    """Strong ETag for a path and query under a dataset version and TTL period"""
+    params = urlencode(sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)))
+    digest = hashlib.sha1(f"{path}?{params}".encode()).hexdigest()[:16]
+    return f'"{BOOT_ID}-{version}-{period}-{digest}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header value matches the ETag (weak comparison)"""
+    # nginx weakens strong ETags when it gzips the response
+    candidates = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _header(headers: Iterable[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving cacheable GET requests from memory"""
+
+    def __init__(
+        self,
+        app,
+        paths: Iterable[str] = CACHEABLE_PATHS,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL
+    ):
+        self.app = app
+        self.paths = tuple(paths)
+        self.ttl = ttl
+        self.cache = VersionedCache(maxsize=maxsize, ttl=ttl)
+
+    def _cacheable(self, scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["method"] == "GET"
+            and scope["path"].startswith(self.paths)
+        )
+
+    async def __call__(self, scope, receive, send):
+        if not self._cacheable(scope):
+            await self.app(scope, receive, send)
+            return
+
+        version = dataset_version()
+        etag = make_etag(scope["path"], scope.get("query_string", b""), version, ttl_period(self.ttl))
+        validators = [(b"etag", etag.encode()), (b"cache-control", CACHE_CONTROL)]
+
+        if_none_match = _header(scope["headers"], b"if-none-match")
+        if if_none_match is not None and _etag_matches(if_none_match.decode("latin-1"), etag):
+            await send({"type": "http.response.start", "status": 304, "headers": validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cached = self.cache.get(etag)
+        if cached is not None:
+            status, headers, body = cached
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start = {}
+        chunks = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                start["status"] = message["status"]
+                start["headers"] = list(message.get("headers", []))
+                cache_control = _header(start["headers"], b"cache-control")
+                start["store"] = message["status"] == 200 and cache_control is None
+                if start["store"]:
+                    start["headers"] += validators
+                message = {**message, "headers": start["headers"]}
+            elif message["type"] == "http.response.body" and start.get("store"):
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    self.cache.set(etag, (start["status"], start["headers"], b"".join(chunks)), version)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,342 @@
+"""
+Bulk ingestion of air quality files (CSV / Parquet)
+
+Files are streamed in fixed-size chunks, each chunk is validated against
+``AirQualityCreate`` and upserted on ``(code_insee, annee)``: ``COPY`` into
+a staging table then ``INSERT ... SELECT ... ON CONFLICT`` on PostgreSQL
+(psycopg2), batched ``INSERT ... ON CONFLICT`` elsewhere. Re-running an
+import is idempotent and only rewrites rows whose values changed. Memory
+use depends on the chunk size only, never on the file size. The rollup
+is rebuilt once at the end of a run (see ``ingest_run``), whatever the
+number of files.
+
+Usage:
+    python -m app.ingest DATA_Science_PROJECT_AirQuality_France/ [--chunk-size 5000]
+"""
+import argparse
+import csv
+import io
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import BinaryIO, Iterable, Iterator, List, Optional, TextIO, Union
+
+from pydantic import ValidationError
+from sqlalchemy import column, select, table, text
+from sqlalchemy.orm import Session
+
+from app import crud, rollup
+from app.cache import bump_dataset_version
+from app.models import AirQualityRecord
+from app.schemas import AirQualityCreate, IngestReport
+from app.search import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 50
+
+CSV_EXTENSIONS = (".csv", ".txt")
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+# Source header (normalized, alphanumerics only) -> model column
+COLUMN_ALIASES = {
+    "commune": "commune", "nomcommune": "commune", "libellecommune": "commune",
+    "codeinsee": "code_insee", "insee": "code_insee", "codecommune": "code_insee",
+    "inseecom": "code_insee",
+    "region": "region", "nomregion": "region", "libelleregion": "region",
+    "departement": "departement", "nomdepartement": "departement",
+    "libelledepartement": "departement",
+    "annee": "annee", "year": "annee",
+    "no2": "no2", "pm10": "pm10", "pm25": "pm25", "o3": "o3",
+    "somo35": "somo35", "aot40": "aot40",
+    "latitude": "latitude", "lat": "latitude",
+    "longitude": "longitude", "lon": "longitude", "lng": "longitude",
+}
+
+FLOAT_COLUMNS = {"no2", "pm10", "pm25", "o3", "somo35", "aot40", "latitude", "longitude"}
+STRING_COLUMNS = {"commune", "code_insee", "region", "departement"}
+NULL_MARKERS = {"", "NA", "N/A", "NAN", "NULL", "NONE", "-"}
+
+INSERT_COLUMNS = [c.name for c in AirQualityRecord.__table__.columns if c.name != "id"]
+
+STAGING_TABLE = f"{AirQualityRecord.__tablename__}_staging"
+
+
+@lru_cache(maxsize=256)
+def _column_for(header: str) -> Optional[str]:
+    """Map a source header to a model column"""
+    key = "".join(c for c in normalize_text(header) if c.isalnum())
+    return COLUMN_ALIASES.get(key)
+
+
+def _clean_row(raw: dict) -> dict:
+    """Rename source columns and coerce raw values before validation"""
+    row = {}
+    for header, value in raw.items():
+        target = _column_for(str(header))
+        if target is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value.upper() in NULL_MARKERS:
+                value = None
+            elif target in FLOAT_COLUMNS:
+                value = value.replace(",", ".")  # French decimal comma
+        if value is not None and target in STRING_COLUMNS and not isinstance(value, str):
+            value = str(value)
+        if target == "code_insee" and value and value.isdigit():
+            value = value.zfill(5)  # Leading zero lost by numeric sources
+        row[target] = value
+    return row
+
+
+def iter_csv_chunks(stream: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[dict]]:
+    """Yield rows of a CSV stream in chunks, detecting the delimiter from the header"""
+    header_line = stream.readline()
+    if not header_line:
+        return
+    delimiter = max(",;\t", key=header_line.count)
+    reader = csv.DictReader(itertools.chain([header_line], stream), delimiter=delimiter)
+    while True:
+        chunk = list(itertools.islice(reader, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_parquet_chunks(
+    source: Union[str, BinaryIO],
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[List[dict]]:
+    """Yield rows of a Parquet file in chunks (one record batch at a time)"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ValueError("Parquet ingestion requires pyarrow") from e
+
+    parquet_file = pq.ParquetFile(source)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield batch.to_pylist()
+
+
+def _validate_chunk(rows: List[dict], first_row: int, report: IngestReport) -> List[dict]:
+    """Validate a chunk, recording rejected rows in the report"""
+    valid = []
+    for offset, raw in enumerate(rows):
+        try:
+            record = AirQualityCreate.model_validate(_clean_row(raw))
+        except ValidationError as e:
+            report.rows_rejected += 1
+            if len(report.errors) < MAX_REPORTED_ERRORS:
+                error = e.errors()[0]
+                field = ".".join(str(loc) for loc in error["loc"])
+                report.errors.append(f"row {first_row + offset}: {field}: {error['msg']}")
+            continue
+        valid.append(AirQualityRecord.derived_values(record.model_dump()))
+    return valid
+
+
+def _copy_rows(db: Session, rows: List[dict]) -> int:
+    """COPY rows into a staging table, then upsert them from there"""
+    db.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} "
+        f"(LIKE {AirQualityRecord.__tablename__} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    ))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[c] is None else row[c] for c in INSERT_COLUMNS])
+    buffer.seek(0)
+
+    dbapi_connection = db.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} ({', '.join(INSERT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+    staging = table(STAGING_TABLE, *[column(c) for c in INSERT_COLUMNS])
+    statement = crud.dialect_insert("postgresql")(AirQualityRecord.__table__).from_select(
+        INSERT_COLUMNS, select(*staging.columns)
+    )
+    return len(db.execute(crud.upsert_statement(statement)).all())
+
+
+def write_rows(db: Session, rows: List[dict]) -> int:
+    """Upsert validated, deduplicated rows; returns how many were inserted or changed"""
+    if not rows:
+        return 0
+    if db.get_bind().dialect.driver == "psycopg2":
+        return _copy_rows(db, rows)
+    return crud.upsert_rows(db, rows, refresh_rollup=False)
+
+
+def ingest_chunks(
+    db: Session,
+    chunks: Iterable[List[dict]],
+    report: Optional[IngestReport] = None
+) -> IngestReport:
+    """
+    Validate and write chunks of raw rows, committing after each chunk.
+
+    Does not refresh the rollup: run it inside ``ingest_run``.
+    """
+    report = report or IngestReport()
+    started = time.perf_counter() - report.elapsed_seconds
+
+    try:
+        for chunk in chunks:
+            valid = crud.dedupe_rows(_validate_chunk(chunk, report.rows_read + 1, report))
+            report.rows_read += len(chunk)
+            written = write_rows(db, valid)
+            db.commit()
+            report.rows_written += written
+            report.rows_unchanged += len(valid) - written
+
+            report.elapsed_seconds = time.perf_counter() - started
+            report.rows_per_second = report.rows_read / report.elapsed_seconds if report.elapsed_seconds else 0.0
+            logger.info(
+                f"Ingested {report.rows_read} rows: {report.rows_written} written, "
+                f"{report.rows_unchanged} unchanged, {report.rows_rejected} rejected "
+                f"({report.rows_per_second:.0f} rows/s)"
+            )
+    except Exception:
+        db.rollback()
+        raise
+
+    return report
+
+
+def _refresh_rollup(db: Session, report: IngestReport) -> None:
+    """Rebuild the rollup and invalidate caches if the run wrote anything"""
+    if report.rows_written:
+        rollup.rebuild(db.connection())
+        db.commit()
+        bump_dataset_version()
+
+
+@contextmanager
+def ingest_run(db: Session, report: Optional[IngestReport] = None) -> Iterator[IngestReport]:
+    """
+    Report shared by the ``ingest_file`` calls of one run.
+
+    Bulk writes bypass the session events that maintain the rollup and
+    invalidate caches, so both are refreshed once when the run ends, even
+    after an error for the chunks already committed. A refresh failing
+    after an ingest error is logged, and the ingest error raised.
+    """
+    report = report or IngestReport()
+    try:
+        yield report
+    except Exception:
+        try:
+            _refresh_rollup(db, report)
+        except Exception:
+            db.rollback()
+            logger.exception("Rollup rebuild failed after an ingest error")
+        raise
+    _refresh_rollup(db, report)
+
+
+def detect_format(filename: str) -> str:
+    """Guess the file format from its extension"""
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in CSV_EXTENSIONS:
+        return "csv"
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    raise ValueError(f"Unsupported file type: {filename}")
+
+
+def ingest_file(
+    db: Session,
+    source: Union[str, BinaryIO],
+    file_format: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    report: Optional[IngestReport] = None
+) -> IngestReport:
+    """
+    Ingest one CSV or Parquet file, given as a path or a binary stream.
+
+    ``file_format`` is detected from the path's extension when omitted.
+    """
+    if file_format is None:
+        if not isinstance(source, str):
+            raise ValueError("file_format is required for streams")
+        file_format = detect_format(source)
+
+    report = report or IngestReport()
+    report.files += 1
+
+    if file_format == "parquet":
+        return ingest_chunks(db, iter_parquet_chunks(source, chunk_size), report)
+    if file_format != "csv":
+        raise ValueError(f"Unsupported format: {file_format}")
+
+    if isinstance(source, str):
+        with open(source, newline="", encoding="utf-8-sig") as stream:
+            return ingest_chunks(db, iter_csv_chunks(stream, chunk_size), report)
+
+    stream = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+    try:
+        return ingest_chunks(db, iter_csv_chunks(stream, chunk_size), report)
+    finally:
+        stream.detach()
+
+
+def import_file(
+    db: Session,
+    source: BinaryIO,
+    file_format: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> IngestReport:
+    """Ingest one uploaded file as a run of its own"""
+    with ingest_run(db) as report:
+        ingest_file(db, source, file_format, chunk_size=chunk_size, report=report)
+    return report
+
+
+def iter_data_files(paths: Iterable[str]) -> Iterator[str]:
+    """Expand directories into the CSV/Parquet files they contain"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                if name.lower().endswith(CSV_EXTENSIONS + PARQUET_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Bulk load air quality CSV/Parquet files")
+    parser.add_argument("paths", nargs="+", help="Files or directories to ingest")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from app.database import SessionLocal, create_tables, sync_schema
+
+    logging.basicConfig(level=logging.INFO)
+    create_tables()
+    sync_schema()  # Upsert key and search columns of older databases
+
+    db = SessionLocal()
+    try:
+        with ingest_run(db) as report:
+            for path in iter_data_files(args.paths):
+                logger.info(f"Ingesting {path}")
+                ingest_file(db, path, chunk_size=args.chunk_size, report=report)
+    finally:
+        db.close()
+
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,18 @@
 Air Quality Dashboard - Backend API
 FastAPI application for serving air quality data
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
 
-from app.database import engine, create_tables, load_sample_data
-from app.routers import air_quality, stats
+from app.http_cache import ResponseCacheMiddleware
+from app.metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, render_metrics
+from app.database import (
+    engine, async_engine, create_tables, get_pool_status, load_sample_data, sync_schema
+)
+from app.routers import admin, air_quality, dashboard, maps, stats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,10 +25,13 @@ async def lifespan(app: FastAPI):
     """Initialize database on startup"""
     logger.info("Starting up... Creating database tables")
     create_tables()
+    sync_schema()
     load_sample_data()
     logger.info("Database initialized successfully")
     yield
     logger.info("Shutting down...")
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 app = FastAPI(
@@ -31,10 +39,14 @@ app = FastAPI(
     description="API REST pour les données de qualité de l'air en France",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/docs",
     redoc_url="/redoc"
 )
 
+# Cache read-only endpoints (added first so CORS headers wrap 304 responses)
+app.add_middleware(ResponseCacheMiddleware)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -44,9 +56,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics, outermost so cached and CORS responses are measured too
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
 # Include routers
 app.include_router(air_quality.router, prefix="/api/v1", tags=["Air Quality"])
 app.include_router(stats.router, prefix="/api/v1", tags=["Statistics"])
+app.include_router(maps.router, prefix="/api/v1", tags=["Map"])
+app.include_router(dashboard.router, prefix="/api/v1", tags=["Dashboard"])
+app.include_router(admin.router, prefix="/api/v1", tags=["Admin"])
 
 
 @app.get("/", tags=["Root"])
@@ -68,3 +86,15 @@ async def health_check():
         "service": "air-quality-api",
         "version": "1.0.0"
     }
+
+
+@app.get("/health/pool", tags=["Health"])
+async def pool_health():
+    """Connection pool occupancy and checkout wait times"""
+    return get_pool_status()
+
+
+@app.get("/metrics", tags=["Health"], include_in_schema=False)
+def metrics():
+    """Prometheus metrics"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,228 @@
+"""
+Prometheus metrics
+
+- HTTP: request latency and response size histograms per route template
+  (``/api/v1/records/{record_id}``, not the raw path, to bound label
+  cardinality) and the number of requests in flight.
+- Database: query duration and row count histograms labelled with the
+  ``crud`` function that issued the query. Functions decorated with
+  ``instrument`` set a context variable that SQLAlchemy engine events read;
+  queries issued outside them are labelled ``other``. Reads answered by a
+  coalesced call (see ``app.singleflight``) are counted per function.
+
+Row counts come from ``cursor.rowcount``: always set for writes, and for
+SELECT only by drivers that buffer results client-side (psycopg2); other
+drivers report -1 and no row count is observed.
+
+With several uvicorn workers set ``PROMETHEUS_MULTIPROC_DIR`` so
+``/metrics`` aggregates every worker.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional, TypeVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import BaseRoute, Match
+
+T = TypeVar("T")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+UNMATCHED_ROUTE = "unmatched"
+UNTRACKED_FUNCTION = "other"
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "HTTP response body size",
+    ["method", "route"], buckets=SIZE_BUCKETS
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being served",
+    ["method"], multiprocess_mode="livesum"
+)
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Database query latency",
+    ["function"], buckets=LATENCY_BUCKETS
+)
+QUERY_ROWS = Histogram(
+    "db_query_rows", "Rows returned or affected by a database query",
+    ["function"], buckets=ROW_BUCKETS
+)
+QUERY_ERRORS = Counter(
+    "db_query_errors_total", "Database queries that raised",
+    ["function"]
+)
+COALESCED_CALLS = Counter(
+    "db_coalesced_calls_total", "crud reads answered by an identical call already in flight",
+    ["function"]
+)
+
+_current_function: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "crud_function", default=None
+)
+
+_QUERY_START_KEY = "metrics_query_start"
+
+
+def current_function() -> str:
+    """Name of the instrumented function running in this context"""
+    return _current_function.get() or UNTRACKED_FUNCTION
+
+
+@contextmanager
+def _labelled(name: str):
+    """Label queries with ``name`` unless an outer call already did"""
+    if _current_function.get() is not None:
+        yield
+        return
+    token = _current_function.set(name)
+    try:
+        yield
+    finally:
+        _current_function.reset(token)
+
+
+def instrument(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Label the queries issued by ``fn`` (the outermost instrumented call wins).
+
+    Generators are labelled one step at a time, since each step may run in
+    a different context (threadpool iteration of a streaming response).
+    """
+    name = fn.__name__
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            iterator = fn(*args, **kwargs)
+            try:
+                while True:
+                    with _labelled(name):
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                    yield item
+            finally:
+                iterator.close()
+        return generator_wrapper
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def async_generator_wrapper(*args, **kwargs):
+            iterator = fn(*args, **kwargs)
+            try:
+                while True:
+                    with _labelled(name):
+                        try:
+                            item = await iterator.__anext__()
+                        except StopAsyncIteration:
+                            return
+                    yield item
+            finally:
+                await iterator.aclose()
+        return async_generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _labelled(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_QUERY_START_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _observe_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info[_QUERY_START_KEY].pop()
+    function = current_function()
+    QUERY_LATENCY.labels(function).observe(elapsed)
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        QUERY_ROWS.labels(function).observe(cursor.rowcount)
+
+
+@event.listens_for(Engine, "handle_error")
+def _observe_query_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get(_QUERY_START_KEY):
+        connection.info[_QUERY_START_KEY].pop()
+    QUERY_ERRORS.labels(current_function()).inc()
+
+
+def route_template(routes: Iterable[BaseRoute], scope) -> str:
+    """Path template of the route serving a request"""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+        if match == Match.PARTIAL and partial is None:
+            partial = getattr(route, "path", UNMATCHED_ROUTE)
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP request metrics"""
+
+    def __init__(self, app, routes: Iterable[BaseRoute]):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+        size = {"bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                size["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            route = route_template(self.routes, scope)
+            REQUEST_LATENCY.labels(method, route, str(status["code"])).observe(elapsed)
+            RESPONSE_SIZE.labels(method, route).observe(size["bytes"])
+
+
+def render_metrics() -> bytes:
+    """Metrics in the Prometheus text format"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
@@ -1,11 +1,25 @@
 """
 SQLAlchemy Models for Air Quality Data
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index, DDL, Table, event
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import validates
+
+from app.geo import grid_cell
+from app.search import normalize_text
 
 Base = declarative_base()
 
+# Pollutant columns measured for every record
+POLLUTANTS = ("no2", "pm10", "pm25", "o3", "somo35", "aot40")
+
+# Trigram operator classes used by the search indexes on PostgreSQL
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
 
 class AirQualityRecord(Base):
     """Model for air quality measurements"""
@@ -29,13 +43,55 @@ class AirQualityRecord(Base):
     # Coordinates
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
+    grid_cell = Column(Integer, nullable=True)  # Spatial index cell, see app.geo
+    
+    # Search shadow columns (lower-cased, accent-folded), see app.search
+    commune_norm = Column(String(100), nullable=False)
+    region_norm = Column(String(100), nullable=False)
     
     # Composite indexes for common queries
     __table_args__ = (
         Index('idx_commune_annee', 'commune', 'annee'),
         Index('idx_region_annee', 'region', 'annee'),
+        Index('idx_annee_id', 'annee', 'id'),  # Keyset pagination
+        Index('uq_code_insee_annee', 'code_insee', 'annee', unique=True),  # Upsert key
+        Index('idx_grid_cell', 'grid_cell'),  # Bounding box / radius searches
+        # Trigram GIN on PostgreSQL, B-tree (prefix range scans) elsewhere
+        Index('idx_commune_norm', 'commune_norm', postgresql_using='gin',
+              postgresql_ops={'commune_norm': 'gin_trgm_ops'}),
+        Index('idx_region_norm', 'region_norm', postgresql_using='gin',
+              postgresql_ops={'region_norm': 'gin_trgm_ops'}),
     )
     
+    @validates('commune', 'region')
+    def _sync_search_columns(self, key, value):
+        """Keep the normalized shadow columns in sync with the names"""
+        setattr(self, f"{key}_norm", normalize_text(value))
+        return value
+    
+    @validates('latitude', 'longitude')
+    def _sync_grid_cell(self, key, value):
+        """Keep the spatial grid cell in sync with the coordinates"""
+        latitude = value if key == 'latitude' else self.latitude
+        longitude = value if key == 'longitude' else self.longitude
+        self.grid_cell = grid_cell(latitude, longitude)
+        return value
+    
+    @staticmethod
+    def derived_values(values: dict) -> dict:
+        """
+        Add the derived columns to a plain row dict.
+
+        Bulk paths that bypass the ORM (COPY, executemany, upserts) must
+        call this, since the model validators only run on ORM objects.
+        """
+        return {
+            **values,
+            "commune_norm": normalize_text(values["commune"]),
+            "region_norm": normalize_text(values["region"]),
+            "grid_cell": grid_cell(values.get("latitude"), values.get("longitude")),
+        }
+    
     def to_dict(self):
         """Convert model to dictionary"""
         return {
@@ -54,3 +110,26 @@ class AirQualityRecord(Base):
             "latitude": self.latitude,
             "longitude": self.longitude
         }
+
+
+# Region x departement x year rollup of air_quality, maintained by app.rollup.
+# Averages are recovered as <pollutant>_sum / <pollutant>_count.
+rollup_table = Table(
+    "air_quality_rollup",
+    Base.metadata,
+    Column("region", String(100), primary_key=True),
+    Column("departement", String(100), primary_key=True),
+    Column("annee", Integer, primary_key=True),
+    Column("region_norm", String(100), nullable=False, index=True),
+    Column("count", Integer, nullable=False),
+    *[
+        column
+        for pollutant in POLLUTANTS
+        for column in (
+            Column(f"{pollutant}_count", Integer, nullable=False),
+            Column(f"{pollutant}_sum", Float, nullable=True),
+            Column(f"{pollutant}_min", Float, nullable=True),
+            Column(f"{pollutant}_max", Float, nullable=True),
+        )
+    ],
+)
@@ -0,0 +1,29 @@
+"""
+Keyset (seek) pagination helpers
+
+A cursor is an opaque, URL-safe token encoding the sort key ``(annee, id)``
+of the last row of a page. The next page starts strictly after that key,
+so the database seeks straight to it through ``idx_annee_id`` instead of
+scanning and discarding every skipped row like ``OFFSET`` does.
+"""
+import base64
+import json
+from typing import Tuple
+
+
+def encode_cursor(annee: int, record_id: int) -> str:
+    """Encode the sort key of the last row of a page as an opaque token"""
+    raw = json.dumps([annee, record_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Decode a cursor token, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        annee, record_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(annee, int) or not isinstance(record_id, int):
+        raise ValueError("Invalid cursor")
+    return annee, record_id
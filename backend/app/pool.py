@@ -0,0 +1,141 @@
+"""
+Connection pool configuration and metrics
+
+Pool sizing comes from environment variables (set through the backend
+ConfigMap) so it can be tuned against ``max_connections`` without a
+rebuild: every pod opens at most ``replicas x workers x (DB_POOL_SIZE +
+DB_MAX_OVERFLOW)`` connections.
+
+- ``DB_POOL_SIZE``: connections kept open per engine (default 5)
+- ``DB_MAX_OVERFLOW``: extra connections opened under load (default 10)
+- ``DB_POOL_TIMEOUT``: seconds to wait for a connection before failing (default 30)
+- ``DB_POOL_RECYCLE``: seconds after which a connection is replaced (default 1800)
+- ``DB_POOL_PRE_PING``: test connections on checkout (default true)
+- ``DB_EXTERNAL_POOLER``: an external pooler such as PgBouncer does the
+  pooling; connections are opened per checkout and closed on release
+  (``NullPool``) and asyncpg's prepared statement cache is disabled, as
+  transaction pooling requires
+
+Checkout wait times and pool occupancy are recorded by ``TimedQueuePool``
+and reported by ``pool_status``.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+DB_EXTERNAL_POOLER = _env_bool("DB_EXTERNAL_POOLER", False)
+
+
+class PoolMetrics:
+    """Cumulative checkout statistics of a pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        """Record one checkout attempt"""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self) -> dict:
+        """Current values as a dict"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+
+
+class _TimedPoolMixin:
+    """Time how long each checkout waits for a connection"""
+
+    def __init__(self, *args, metrics: Optional[PoolMetrics] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics or PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # Keep the statistics across engine.dispose()
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """QueuePool recording checkout wait times"""
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool recording checkout wait times"""
+
+
+def engine_options(is_async: bool = False) -> dict:
+    """Pool keyword arguments for create_engine / create_async_engine"""
+    if DB_EXTERNAL_POOLER:
+        options = {"poolclass": NullPool, "pool_pre_ping": False}
+        if is_async:
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        return options
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def pool_status(engine: Engine) -> dict:
+    """Configuration, occupancy and checkout statistics of an engine's pool"""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        status.update(metrics.snapshot())
+    return status
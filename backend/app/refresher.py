@@ -0,0 +1,160 @@
+"""
+Stale-while-revalidate cache of the dashboard metadata
+
+Regions, years, communes and the summary only change when data is
+imported, yet every cache miss used to rerun their ``DISTINCT`` scans in
+the request. ``Refresher`` keeps the last result of each of these reads
+and always answers from it once warm. When the entry is older than
+``METADATA_SOFT_TTL`` seconds or was computed under an older dataset
+version, the request still gets it immediately and a background task
+recomputes it on its own session, bound to the request session's engine.
+Only a cold entry makes a request wait.
+
+The soft TTL catches writes this process cannot see (other workers,
+``app.ingest`` runs); snapshots kept by the wrapped reads themselves (the
+``crud`` summary) expire after the same TTL so a refresh rereads the
+database. A response served from an entry of an older dataset
+version is sent with ``Cache-Control: no-store``, so the response cache
+and the browser never keep it under the new version's ETag.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable, Tuple
+
+from fastapi import Response
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from app.cache import dataset_version
+
+logger = logging.getLogger(__name__)
+
+METADATA_SOFT_TTL = float(os.getenv("METADATA_SOFT_TTL", "60"))
+METADATA_CACHE_SIZE = 256
+
+STALE_CACHE_CONTROL = "no-store"
+
+
+class _Entry:
+    __slots__ = ("value", "version", "computed_at", "refreshing")
+
+    def __init__(self, value: Any, version: int):
+        self.value = value
+        self.version = version
+        self.computed_at = time.monotonic()
+        self.refreshing = False
+
+
+def _bind_of(db):
+    """Engine behind a sync or async session"""
+    return db.bind if isinstance(db, AsyncSession) else db.get_bind()
+
+
+@asynccontextmanager
+async def _session(bind):
+    """Dedicated session on ``bind``, independent of any request"""
+    if isinstance(bind, AsyncEngine):
+        async with AsyncSession(bind, autoflush=False) as session:
+            yield session
+        return
+
+    session = sessionmaker(bind=bind, autoflush=False)()
+    try:
+        yield session
+    finally:
+        await run_in_threadpool(session.close)
+
+
+class Refresher:
+    """Last result of async ``crud`` reads, revalidated in the background"""
+
+    def __init__(self, soft_ttl: float = METADATA_SOFT_TTL, maxsize: int = METADATA_CACHE_SIZE):
+        self.soft_ttl = soft_ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._tasks: set = set()
+
+    async def get(
+        self,
+        db,
+        fn: Callable[..., Awaitable[Any]],
+        **kwargs: Any
+    ) -> Tuple[Any, bool]:
+        """
+        Result of ``fn(db, **kwargs)``, from the cache unless it is cold.
+
+        Returns ``(value, current)`` where ``current`` tells whether the
+        value was computed under the current dataset version.
+        """
+        bind = _bind_of(db)
+        key = (fn.__name__, bind, tuple(sorted(kwargs.items())))
+        version = dataset_version()
+
+        entry = self._entries.get(key)
+        if entry is None:
+            value = await fn(db, **kwargs)
+            self._store(key, value, version)
+            return value, True
+
+        self._entries.move_to_end(key)
+        if entry.version != version or time.monotonic() - entry.computed_at > self.soft_ttl:
+            self._revalidate(key, entry, bind, fn, kwargs)
+        return entry.value, entry.version == version
+
+    def _store(self, key: Hashable, value: Any, version: int) -> None:
+        current = self._entries.get(key)
+        if current is not None and current.version > version:
+            return
+        self._entries[key] = _Entry(value, version)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _revalidate(self, key: Hashable, entry: _Entry, bind, fn, kwargs: dict) -> None:
+        if entry.refreshing:
+            return
+        entry.refreshing = True
+        task = asyncio.get_running_loop().create_task(self._refresh(key, entry, bind, fn, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key: Hashable, entry: _Entry, bind, fn, kwargs: dict) -> None:
+        version = dataset_version()
+        try:
+            async with _session(bind) as session:
+                value = await fn(session, **kwargs)
+        except Exception as e:
+            # Keep serving the previous value, retry on a later request
+            logger.warning(f"Could not refresh {fn.__name__}: {e}")
+            entry.refreshing = False
+            return
+        self._store(key, value, version)
+
+    async def wait(self) -> None:
+        """Wait for the refreshes in progress"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        self._entries.clear()
+
+
+metadata = Refresher()
+
+
+async def serve(response: Response, db, fn: Callable[..., Awaitable[Any]], **kwargs: Any) -> Any:
+    """
+    Result of a metadata read for a request.
+
+    Values of an older dataset version are marked so that no cache keeps them.
+    """
+    value, current = await metadata.get(db, fn, **kwargs)
+    if not current:
+        response.headers["Cache-Control"] = STALE_CACHE_CONTROL
+    return value
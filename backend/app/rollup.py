@@ -0,0 +1,107 @@
+"""
+Region x departement x year rollup of the air_quality table
+
+``air_quality_rollup`` holds, per (region, departement, annee) group, the
+record count and the count/sum/min/max of every pollutant, so region
+statistics and trends are answered from a few hundred rows instead of a
+scan of the raw table.
+
+The rollup is kept in sync incrementally: after every ORM flush the
+groups touched by new, modified or deleted records (including the group
+a record moved out of) are recomputed from the raw table in the same
+transaction. Bulk paths that bypass the ORM call ``refresh_groups`` or
+``rebuild`` themselves.
+"""
+import itertools
+import logging
+from typing import Iterable, Set, Tuple
+
+from sqlalchemy import delete, event, func, inspect, insert, select, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models import AirQualityRecord, POLLUTANTS, rollup_table
+
+logger = logging.getLogger(__name__)
+
+GROUP_KEYS = ("region", "departement", "annee")
+REFRESH_BATCH_SIZE = 500
+
+Group = Tuple[str, str, int]
+
+
+def _aggregate_select():
+    """SELECT computing rollup rows from the raw table"""
+    columns = [
+        AirQualityRecord.region,
+        AirQualityRecord.departement,
+        AirQualityRecord.annee,
+        AirQualityRecord.region_norm,
+        func.count(AirQualityRecord.id),
+    ]
+    for pollutant in POLLUTANTS:
+        column = getattr(AirQualityRecord, pollutant)
+        columns += [func.count(column), func.sum(column), func.min(column), func.max(column)]
+    return select(*columns).group_by(
+        AirQualityRecord.region,
+        AirQualityRecord.departement,
+        AirQualityRecord.annee,
+        AirQualityRecord.region_norm,
+    )
+
+
+def _insert_from(query):
+    """INSERT INTO the rollup from an aggregate SELECT"""
+    return insert(rollup_table).from_select([c.name for c in rollup_table.columns], query)
+
+
+def refresh_groups(connection: Connection, groups: Iterable[Group]) -> None:
+    """Recompute the rollup rows of the given (region, departement, annee) groups"""
+    groups = list(groups)
+    rollup_key = tuple_(*[rollup_table.c[k] for k in GROUP_KEYS])
+    record_key = tuple_(*[getattr(AirQualityRecord, k) for k in GROUP_KEYS])
+
+    for start in range(0, len(groups), REFRESH_BATCH_SIZE):
+        batch = groups[start:start + REFRESH_BATCH_SIZE]
+        connection.execute(delete(rollup_table).where(rollup_key.in_(batch)))
+        connection.execute(_insert_from(_aggregate_select().where(record_key.in_(batch))))
+
+
+def rebuild(connection: Connection) -> None:
+    """Recompute the whole rollup from the raw table"""
+    connection.execute(delete(rollup_table))
+    connection.execute(_insert_from(_aggregate_select()))
+
+
+def rebuild_if_empty(connection: Connection) -> None:
+    """Build the rollup on first start against an already populated database"""
+    has_rollup = connection.execute(select(rollup_table.c.count).limit(1)).first()
+    has_records = connection.execute(select(AirQualityRecord.id).limit(1)).first()
+    if has_records and not has_rollup:
+        logger.info("Building air quality rollup")
+        rebuild(connection)
+
+
+def _previous_value(obj: AirQualityRecord, key: str):
+    """Value of an attribute before the pending flush"""
+    history = inspect(obj).attrs[key].history
+    return history.deleted[0] if history.deleted else getattr(obj, key)
+
+
+def _touched_groups(session: Session) -> Set[Group]:
+    """Groups affected by the records of a flush"""
+    groups = set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, AirQualityRecord):
+            continue
+        groups.add(tuple(getattr(obj, k) for k in GROUP_KEYS))
+        if obj in session.dirty:
+            groups.add(tuple(_previous_value(obj, k) for k in GROUP_KEYS))
+    return groups
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_after_flush(session, flush_context):
+    groups = _touched_groups(session)
+    if groups:
+        refresh_groups(session.connection(), groups)
@@ -0,0 +1,54 @@
+"""
+API Router for operational diagnostics
+"""
+import os
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+
+from app.schemas import SlowQueryListResponse
+from app.slow_queries import recorder
+
+# Recorded parameters may contain data: the admin endpoints are disabled
+# unless a token is set, and then require it
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Check the X-Admin-Token header; 404 when no ADMIN_TOKEN is configured"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not (x_admin_token and secrets.compare_digest(x_admin_token, ADMIN_TOKEN)):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/admin/slow-queries", response_model=SlowQueryListResponse)
+async def get_slow_queries(
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of queries"),
+    function: Optional[str] = Query(None, description="Only queries issued by this crud function")
+):
+    """
+    Get the most recent slow queries.
+    
+    Each entry has the statement, its bound parameters, the calling crud
+    function, elapsed time, row count and, when sampled, its query plan.
+    """
+    queries = recorder.entries()
+    if function:
+        queries = [q for q in queries if q["function"] == function]
+    return {
+        "threshold_ms": recorder.threshold_ms,
+        "explain_sample": recorder.explain_sample,
+        "queries": queries[:limit]
+    }
+
+
+@router.delete("/admin/slow-queries", status_code=204)
+async def clear_slow_queries():
+    """Empty the slow query buffer"""
+    recorder.clear()
+    return None
@@ -1,123 +1,310 @@
 """
 API Router for Air Quality CRUD operations
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, File, Header, HTTPException, Query, UploadFile
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, List, Literal
 
-from app.database import get_db
-from app import crud
+from app.database import get_db, get_ingest_db
+from app import crud, crud_async, export, geo, ingest, refresher
+from app.crud_async import AnySession
+from app.pagination import encode_cursor, decode_cursor
+from app.search import MatchMode
 from app.schemas import (
     AirQualityResponse,
     AirQualityCreate,
     AirQualityUpdate,
     AirQualityListResponse,
     RegionListResponse,
-    YearListResponse
+    YearListResponse,
+    IngestReport,
+    NearestCommuneListResponse,
+    UpsertResponse
 )
 
 router = APIRouter()
 
+BBOX_DESCRIPTION = "Area as min_lon,min_lat,max_lon,max_lat"
+NEAR_DESCRIPTION = "Center of a radius search as lat,lon"
+
+
+def _location_filters(bbox: Optional[str], near: Optional[str], radius_km: float) -> dict:
+    """Parse the bbox / near query parameters"""
+    try:
+        return {"bbox": geo.parse_bbox(bbox), "near": geo.parse_near(near, radius_km)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 @router.get("/records", response_model=AirQualityListResponse)
-def get_records(
+async def get_records(
     commune: Optional[str] = Query(None, description="Filter by commune name"),
     region: Optional[str] = Query(None, description="Filter by region"),
     annee: Optional[int] = Query(None, description="Filter by year"),
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(50, ge=1, le=1000, description="Items per page"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Opaque cursor returned as next_cursor"),
+    count: Literal["exact", "estimate", "none"] = Query("exact", description="Total counting strategy"),
+    match: MatchMode = Query("contains", description="Name matching: exact, prefix or contains"),
+    bbox: Optional[str] = Query(None, description=BBOX_DESCRIPTION),
+    near: Optional[str] = Query(None, description=NEAR_DESCRIPTION),
+    radius_km: float = Query(10, gt=0, le=500, description="Radius of the near search (km)"),
+    page_format: Optional[Literal["json", "arrow", "parquet"]] = Query(
+        None, alias="format", description="Response format (default: json, or arrow per Accept)"
+    ),
+    accept: Optional[str] = Header(None),
+    db: AnySession = Depends(get_db)
 ):
     """
     Get air quality records with optional filters and pagination.
     
-    - **commune**: Filter by commune name (partial match)
-    - **region**: Filter by region name (partial match)
+    - **commune**: Filter by commune name (case and accent insensitive)
+    - **region**: Filter by region name (case and accent insensitive)
     - **annee**: Filter by year (exact match)
     - **page**: Page number (default: 1)
     - **page_size**: Items per page (default: 50, max: 1000)
+    - **cursor**: Keyset cursor from a previous response's `next_cursor`.
+      When given, `page` is ignored and latency stays flat however deep you page.
+    - **count**: `exact` (cached until the next write), `estimate` (planner
+      statistics on PostgreSQL) or `none` (no total). `count_mode` in the
+      response tells which strategy produced `total`.
+    - **match**: how names are matched, `exact`, `prefix` or `contains` (default)
+    - **bbox**: only records located inside `min_lon,min_lat,max_lon,max_lat`
+    - **near** / **radius_km**: only records within `radius_km` (default 10) of `lat,lon`
+    - **format**: `json` (default), `arrow` (also selected by
+      `Accept: application/vnd.apache.arrow.stream`) or `parquet`. Columnar
+      responses carry the page metadata in `X-Total-Count`, `X-Count-Mode`
+      and `X-Next-Cursor` headers.
     """
+    location = _location_filters(bbox, near, radius_km)
+    response_format = export.negotiate(page_format, accept, "json")
+    if response_format != "json":
+        try:
+            export.arrow_schema()
+        except ValueError as e:
+            raise HTTPException(status_code=406, detail=str(e))
+    
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     skip = (page - 1) * page_size
     
-    records = crud.get_records(
+    # Fetch one extra row to know whether a next page exists
+    records = await crud_async.get_records(
         db=db,
         commune=commune,
         region=region,
         annee=annee,
         skip=skip,
-        limit=page_size
+        limit=page_size + 1,
+        after=after,
+        match=match,
+        **location
     )
     
-    total = crud.get_total_count(db, commune=commune, region=region, annee=annee)
+    next_cursor = None
+    if len(records) > page_size:
+        records = records[:page_size]
+        next_cursor = encode_cursor(records[-1].annee, records[-1].id)
     
-    return {
+    total, count_mode = await crud_async.count_records(
+        db, commune=commune, region=region, annee=annee, mode=count, match=match, **location
+    )
+    
+    if response_format != "json":
+        headers = {"X-Count-Mode": count_mode}
+        if total is not None:
+            headers["X-Total-Count"] = str(total)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return Response(
+            export.encode_page(records, response_format),
+            media_type=export.MEDIA_TYPES[response_format],
+            headers=headers
+        )
+    
+    # Rows come straight from typed columns: encode them without
+    # re-validating each one through AirQualityResponse
+    return ORJSONResponse({
         "total": total,
+        "count_mode": count_mode,
         "page": page,
         "page_size": page_size,
-        "data": records
+        "next_cursor": next_cursor,
+        "data": [dict(zip(crud.RECORD_FIELDS, row)) for row in records]
+    })
+
+
+@router.get("/records/export")
+async def export_records(
+    export_format: Optional[export.ExportFormat] = Query(
+        None, alias="format", description="ndjson (default), csv, arrow or parquet"
+    ),
+    commune: Optional[str] = Query(None, description="Filter by commune name"),
+    region: Optional[str] = Query(None, description="Filter by region"),
+    annee: Optional[int] = Query(None, description="Filter by year"),
+    match: MatchMode = Query("contains", description="Name matching: exact, prefix or contains"),
+    bbox: Optional[str] = Query(None, description=BBOX_DESCRIPTION),
+    near: Optional[str] = Query(None, description=NEAR_DESCRIPTION),
+    radius_km: float = Query(10, gt=0, le=500, description="Radius of the near search (km)"),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: AnySession = Depends(get_db)
+):
+    """
+    Download every record matching the filters.
+    
+    Rows are streamed from a server-side cursor, so memory stays flat
+    whatever the result size. Text formats are gzip-compressed on the fly
+    when the client sends `Accept-Encoding: gzip`. `Accept:
+    application/vnd.apache.arrow.stream` selects the Arrow IPC stream
+    format when `format` is not given.
+    """
+    location = _location_filters(bbox, near, radius_km)
+    export_format = export.negotiate(export_format, accept, "ndjson")
+    if export_format not in export.TEXT_FORMATS:
+        try:
+            export.arrow_schema()
+        except ValueError as e:
+            raise HTTPException(status_code=406, detail=str(e))
+    
+    batches = crud_async.stream_records(
+        db, commune=commune, region=region, annee=annee, match=match, **location
+    )
+    body = export.encode(batches, export_format)
+    headers = {
+        "Content-Disposition": f'attachment; filename="air_quality.{export.FILE_EXTENSIONS[export_format]}"',
+        "Vary": "Accept, Accept-Encoding"
     }
+    if export_format in export.TEXT_FORMATS and export.accepts_gzip(accept_encoding):
+        body = export.gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=export.MEDIA_TYPES[export_format], headers=headers)
 
 
 @router.get("/records/{record_id}", response_model=AirQualityResponse)
-def get_record(record_id: int, db: Session = Depends(get_db)):
+async def get_record(record_id: int, db: AnySession = Depends(get_db)):
     """Get a single air quality record by ID"""
-    record = crud.get_record_by_id(db, record_id)
+    record = await crud_async.get_record_by_id(db, record_id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     return record
 
 
 @router.post("/records", response_model=AirQualityResponse, status_code=201)
-def create_record(record: AirQualityCreate, db: Session = Depends(get_db)):
+async def create_record(record: AirQualityCreate, db: AnySession = Depends(get_db)):
     """
     Create a new air quality record.
     
     All pollutant values are in µg/m³.
     """
-    return crud.create_record(db, record)
+    try:
+        return await crud_async.create_record(db, record)
+    except IntegrityError:
+        await crud_async.rollback(db)
+        raise HTTPException(
+            status_code=409,
+            detail=f"A record already exists for {record.code_insee} in {record.annee}"
+        )
+
+
+@router.put("/records:upsert", response_model=UpsertResponse)
+async def upsert_records(
+    records: List[AirQualityCreate] = Body(..., max_length=10000),
+    db: AnySession = Depends(get_db)
+):
+    """
+    Insert or update records keyed on (code_insee, annee).
+    
+    Existing rows are only rewritten when a value actually changed, so
+    re-sending the same data is a no-op. Accepts up to 10 000 records.
+    """
+    return await crud_async.upsert_records(db, records)
+
+
+@router.post("/records/import", response_model=IngestReport, status_code=201)
+async def import_records(
+    file: UploadFile = File(..., description="CSV or Parquet file"),
+    chunk_size: int = Query(ingest.DEFAULT_CHUNK_SIZE, ge=100, le=100000, description="Rows per batch"),
+    db: Session = Depends(get_ingest_db)
+):
+    """
+    Bulk load records from a CSV or Parquet file.
+    
+    The file is streamed and validated in batches; invalid rows are
+    skipped and reported. Uses COPY on PostgreSQL. Runs in the threadpool
+    on the sync engine, even when requests are served by the async one.
+    """
+    try:
+        file_format = ingest.detect_format(file.filename or "")
+        return await run_in_threadpool(
+            ingest.import_file, db, file.file, file_format, chunk_size=chunk_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.put("/records/{record_id}", response_model=AirQualityResponse)
-def update_record(
+async def update_record(
     record_id: int,
     record_update: AirQualityUpdate,
-    db: Session = Depends(get_db)
+    db: AnySession = Depends(get_db)
 ):
     """Update an existing air quality record"""
-    updated = crud.update_record(db, record_id, record_update)
+    updated = await crud_async.update_record(db, record_id, record_update)
     if not updated:
         raise HTTPException(status_code=404, detail="Record not found")
     return updated
 
 
 @router.delete("/records/{record_id}", status_code=204)
-def delete_record(record_id: int, db: Session = Depends(get_db)):
+async def delete_record(record_id: int, db: AnySession = Depends(get_db)):
     """Delete an air quality record"""
-    deleted = crud.delete_record(db, record_id)
+    deleted = await crud_async.delete_record(db, record_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Record not found")
     return None
 
 
 @router.get("/regions", response_model=RegionListResponse)
-def get_regions(db: Session = Depends(get_db)):
+async def get_regions(response: Response, db: AnySession = Depends(get_db)):
     """Get list of all available regions"""
-    regions = crud.get_regions(db)
+    regions = await refresher.serve(response, db, crud_async.get_regions)
     return {"regions": regions}
 
 
 @router.get("/communes")
-def get_communes(
+async def get_communes(
+    response: Response,
     region: Optional[str] = Query(None, description="Filter by region"),
-    db: Session = Depends(get_db)
+    db: AnySession = Depends(get_db)
 ):
     """Get list of all communes, optionally filtered by region"""
-    communes = crud.get_communes(db, region=region)
+    communes = await refresher.serve(response, db, crud_async.get_communes, region=region)
+    return {"communes": communes}
+
+
+@router.get("/communes/nearest", response_model=NearestCommuneListResponse)
+async def get_nearest_communes(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude"),
+    limit: int = Query(5, ge=1, le=50, description="Number of communes"),
+    radius_km: float = Query(50, gt=0, le=500, description="Search radius (km)"),
+    db: AnySession = Depends(get_db)
+):
+    """Get the located communes closest to a point, closest first"""
+    communes = await crud_async.get_nearest_communes(db, lat, lon, limit=limit, radius_km=radius_km)
     return {"communes": communes}
 
 
 @router.get("/years", response_model=YearListResponse)
-def get_years(db: Session = Depends(get_db)):
+async def get_years(response: Response, db: AnySession = Depends(get_db)):
     """Get list of all available years"""
-    years = crud.get_years(db)
+    years = await refresher.serve(response, db, crud_async.get_years)
     return {"years": years}
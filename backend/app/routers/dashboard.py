@@ -0,0 +1,40 @@
+"""
+API Router for the dashboard bootstrap
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
+
+from app.database import get_db
+from app import crud_async, refresher
+from app.crud_async import AnySession
+from app.models import POLLUTANTS
+from app.schemas import DashboardResponse
+
+router = APIRouter()
+
+
+@router.get("/dashboard", response_model=DashboardResponse)
+async def get_dashboard(
+    response: Response,
+    page_size: int = Query(20, ge=1, le=1000, description="Records in the first page"),
+    pollutant: str = Query("no2", description="Pollutant of the trend"),
+    db: AnySession = Depends(get_db)
+):
+    """
+    Get everything the dashboard shows on load in one round trip.
+
+    Regions, years, the dataset summary, the first page of records (newest
+    first, unfiltered) and the national trend of a pollutant. Served like
+    the other metadata endpoints: from a snapshot, recomputed in the
+    background after a write or once older than the soft TTL.
+    """
+    pollutant = pollutant.lower()
+    if pollutant not in POLLUTANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid pollutant. Valid options: {', '.join(POLLUTANTS)}"
+        )
+    dashboard = await refresher.serve(
+        response, db, crud_async.get_dashboard, page_size=page_size, pollutant=pollutant
+    )
+    return ORJSONResponse(dashboard, headers=dict(response.headers))
@@ -0,0 +1,66 @@
+"""
+API Router for the map layer
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from typing import Optional
+
+from app.database import get_db
+from app import crud_async, geo
+from app.crud_async import AnySession
+from app.models import POLLUTANTS
+from app.thresholds import LEVEL_COLORS, level
+
+router = APIRouter()
+
+
+@router.get("/map")
+async def get_map_layer(
+    pollutant: str = Query("no2", description="Pollutant to map"),
+    annee: Optional[int] = Query(None, description="Filter by year (default: average of all years)"),
+    bbox: Optional[str] = Query(None, description="Viewport as min_lon,min_lat,max_lon,max_lat"),
+    zoom: int = Query(6, ge=0, le=20, description="Map zoom level"),
+    db: AnySession = Depends(get_db)
+):
+    """
+    Get the map layer as GeoJSON, aggregated to the viewport.
+
+    Above zoom 9, one feature per commune; below, one feature per grid cell
+    with the average over its communes. Each feature carries the value, its
+    level (good / moderate / poor) and the level's colour.
+    """
+    pollutant = pollutant.lower()
+    if pollutant not in POLLUTANTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid pollutant. Valid options: {', '.join(POLLUTANTS)}"
+        )
+    try:
+        viewport = geo.parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {e}")
+
+    cell_size = geo.cell_size(zoom)
+    rows = await crud_async.get_map_points(db, pollutant, annee, viewport, cell_size)
+
+    features = []
+    for row in rows:
+        value = round(row.value, 2)
+        rating = level(pollutant, value)
+        properties = {
+            "value": value,
+            "level": rating,
+            "color": LEVEL_COLORS.get(rating),
+            "communes": row.communes,
+        }
+        if cell_size is None:
+            properties.update(code_insee=row.code_insee, commune=row.commune, region=row.region)
+        features.append(geo.point_feature(round(row.longitude, 5), round(row.latitude, 5), properties))
+
+    return ORJSONResponse(geo.feature_collection(
+        features,
+        pollutant=pollutant,
+        annee=annee,
+        zoom=zoom,
+        clustered=cell_size is not None,
+    ))
@@ -1,53 +1,67 @@
 """
 API Router for Statistics and Analytics
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from typing import Optional
 
 from app.database import get_db
-from app import crud
-from app.schemas import StatsResponse, TrendResponse
+from app import crud_async, refresher
+from app.crud_async import AnySession
+from app.schemas import StatsResponse, ThresholdsResponse, TrendResponse
+from app.search import MatchMode
+from app.thresholds import LEVELS, THRESHOLDS
 
 router = APIRouter()
 
 
 @router.get("/stats/region/{region}", response_model=StatsResponse)
-def get_region_stats(
+async def get_region_stats(
     region: str,
     annee: Optional[int] = Query(None, description="Filter by year"),
-    db: Session = Depends(get_db)
+    match: MatchMode = Query("contains", description="Name matching: exact, prefix or contains"),
+    percentiles: bool = Query(False, description="Include p50/p90/p98 (reads every measurement)"),
+    db: AnySession = Depends(get_db)
 ):
     """
     Get aggregated statistics for a region.
     
-    Returns average, min, and max values for all pollutants.
+    Returns average, min, and max values for all pollutants, with the
+    number of communes above the guideline values and, on request, their
+    p50/p90/p98.
     """
-    stats = crud.get_stats_by_region(db, region, annee)
+    stats = await crud_async.get_stats_by_region(db, region, annee, match=match, percentiles=percentiles)
     if stats["count"] == 0:
         raise HTTPException(status_code=404, detail=f"No data found for region: {region}")
     return stats
 
 
 @router.get("/stats/commune/{commune}", response_model=StatsResponse)
-def get_commune_stats(commune: str, db: Session = Depends(get_db)):
+async def get_commune_stats(
+    commune: str,
+    match: MatchMode = Query("contains", description="Name matching: exact, prefix or contains"),
+    percentiles: bool = Query(False, description="Include p50/p90/p98 (reads every measurement)"),
+    db: AnySession = Depends(get_db)
+):
     """
     Get aggregated statistics for a commune.
     
-    Returns average values for all pollutants across all years.
+    Returns average values for all pollutants across all years, with the
+    number of communes above the guideline values and, on request, their
+    p50/p90/p98.
     """
-    stats = crud.get_stats_by_commune(db, commune)
+    stats = await crud_async.get_stats_by_commune(db, commune, match=match, percentiles=percentiles)
     if stats["count"] == 0:
         raise HTTPException(status_code=404, detail=f"No data found for commune: {commune}")
     return stats
 
 
 @router.get("/trends/{pollutant}", response_model=TrendResponse)
-def get_pollutant_trend(
+async def get_pollutant_trend(
     pollutant: str,
     region: Optional[str] = Query(None, description="Filter by region"),
     commune: Optional[str] = Query(None, description="Filter by commune"),
-    db: Session = Depends(get_db)
+    match: MatchMode = Query("contains", description="Name matching: exact, prefix or contains"),
+    db: AnySession = Depends(get_db)
 ):
     """
     Get trend of a specific pollutant over time.
@@ -62,11 +76,12 @@ def get_pollutant_trend(
             detail=f"Invalid pollutant. Valid options: {', '.join(valid_pollutants)}"
         )
     
-    trend_data = crud.get_pollutant_trend(
+    trend_data = await crud_async.get_pollutant_trend(
         db,
         pollutant=pollutant.lower(),
         region=region,
-        commune=commune
+        commune=commune,
+        match=match
     )
     
     if not trend_data:
@@ -81,30 +96,34 @@ def get_pollutant_trend(
 
 
 @router.get("/compare")
-def compare_regions(
-    regions: str = Query(..., description="Comma-separated list of regions"),
+async def compare_regions(
+    regions: str = Query(..., description="Comma-separated list of regions, or * for all"),
     annee: Optional[int] = Query(None, description="Filter by year"),
-    db: Session = Depends(get_db)
+    match: MatchMode = Query("contains", description="Name matching: exact, prefix or contains"),
+    percentiles: bool = Query(False, description="Include p50/p90/p98 (reads every measurement)"),
+    db: AnySession = Depends(get_db)
 ):
     """
     Compare statistics across multiple regions.
     
-    - **regions**: Comma-separated list of region names
+    - **regions**: Comma-separated list of region names, or `*` for every region
     - **annee**: Optional year filter
+    - **match**: How names are matched, as on `/stats/region`
+    - **percentiles**: Include p50/p90/p98 of every region
     """
-    region_list = [r.strip() for r in regions.split(",")]
-    
-    if len(region_list) < 2:
-        raise HTTPException(
-            status_code=400,
-            detail="Please provide at least 2 regions to compare"
-        )
-    
-    results = []
-    for region in region_list:
-        stats = crud.get_stats_by_region(db, region, annee)
-        if stats["count"] > 0:
-            results.append(stats)
+    if regions.strip() == "*":
+        region_list = None
+    else:
+        region_list = [r.strip() for r in regions.split(",")]
+        if len(region_list) < 2:
+            raise HTTPException(
+                status_code=400,
+                detail="Please provide at least 2 regions to compare"
+            )
+    
+    results = await crud_async.compare_regions(
+        db, region_list, annee, percentiles=percentiles, match=match
+    )
     
     if not results:
         raise HTTPException(status_code=404, detail="No data found for the specified regions")
@@ -116,43 +135,25 @@ def compare_regions(
 
 
 @router.get("/summary")
-def get_summary(db: Session = Depends(get_db)):
+async def get_summary(response: Response, db: AnySession = Depends(get_db)):
     """
     Get a summary of the entire dataset.
     
     Returns total records, available regions, years, and global averages.
+    Served from a snapshot, refreshed in the background once the data changes.
+    """
+    return await refresher.serve(response, db, crud_async.get_summary)
+
+
+@router.get("/thresholds", response_model=ThresholdsResponse)
+async def get_thresholds():
+    """
+    Get the thresholds used to rate measurements.
+
+    A measurement is `good` up to `low`, `moderate` up to `high` and `poor`
+    above; values above `low` count as exceedances in the statistics.
     """
-    from sqlalchemy import func
-    from app.models import AirQualityRecord
-    
-    # Get counts
-    total_records = db.query(func.count(AirQualityRecord.id)).scalar()
-    total_regions = db.query(func.count(func.distinct(AirQualityRecord.region))).scalar()
-    total_communes = db.query(func.count(func.distinct(AirQualityRecord.commune))).scalar()
-    
-    # Get averages
-    averages = db.query(
-        func.avg(AirQualityRecord.no2).label('avg_no2'),
-        func.avg(AirQualityRecord.pm10).label('avg_pm10'),
-        func.avg(AirQualityRecord.pm25).label('avg_pm25'),
-        func.avg(AirQualityRecord.o3).label('avg_o3'),
-    ).first()
-    
-    # Get year range
-    years = crud.get_years(db)
-    
     return {
-        "total_records": total_records,
-        "total_regions": total_regions,
-        "total_communes": total_communes,
-        "year_range": {
-            "min": min(years) if years else None,
-            "max": max(years) if years else None
-        },
-        "global_averages": {
-            "no2": round(averages.avg_no2, 2) if averages.avg_no2 else None,
-            "pm10": round(averages.avg_pm10, 2) if averages.avg_pm10 else None,
-            "pm25": round(averages.avg_pm25, 2) if averages.avg_pm25 else None,
-            "o3": round(averages.avg_o3, 2) if averages.avg_o3 else None,
-        }
+        "pollutants": {p: t._asdict() for p, t in THRESHOLDS.items()},
+        "levels": [{"name": name, "color": color} for name, color in LEVELS],
     }
@@ -2,7 +2,7 @@
 Pydantic Schemas for API validation and serialization
 """
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Literal
 from datetime import datetime
 
 
@@ -51,12 +51,22 @@ class AirQualityResponse(AirQualityBase):
 
 class AirQualityListResponse(BaseModel):
     """Schema for paginated list response"""
-    total: int
+    total: Optional[int]
+    count_mode: Literal["exact", "estimate", "none"] = "exact"
     page: int
     page_size: int
+    next_cursor: Optional[str] = None
     data: List[AirQualityResponse]
 
 
+class PollutantDistribution(BaseModel):
+    """Percentiles of a pollutant and communes above its guideline value"""
+    p50: Optional[float] = None
+    p90: Optional[float] = None
+    p98: Optional[float] = None
+    exceedances: int = 0
+
+
 class StatsResponse(BaseModel):
     """Schema for statistics response"""
     region: Optional[str] = None
@@ -71,6 +81,25 @@ class StatsResponse(BaseModel):
     max_pm10: Optional[float] = None
     min_no2: Optional[float] = None
     min_pm10: Optional[float] = None
+    distribution: Optional[Dict[str, PollutantDistribution]] = None
+
+
+class PollutantThreshold(BaseModel):
+    """Thresholds of a pollutant (µg/m³)"""
+    low: float
+    high: float
+
+
+class ThresholdLevel(BaseModel):
+    """Rating of a measurement and its display colour"""
+    name: str
+    color: str
+
+
+class ThresholdsResponse(BaseModel):
+    """Thresholds used to rate measurements and count exceedances"""
+    pollutants: Dict[str, PollutantThreshold]
+    levels: List[ThresholdLevel]
 
 
 class RegionListResponse(BaseModel):
@@ -78,6 +107,22 @@ class RegionListResponse(BaseModel):
     regions: List[str]
 
 
+class NearestCommune(BaseModel):
+    """A commune and its distance to the searched point"""
+    commune: str
+    code_insee: str
+    region: str
+    departement: str
+    latitude: float
+    longitude: float
+    distance_km: float
+
+
+class NearestCommuneListResponse(BaseModel):
+    """Communes closest to a point"""
+    communes: List[NearestCommune]
+
+
 class YearListResponse(BaseModel):
     """List of available years"""
     years: List[int]
@@ -95,3 +140,49 @@ class TrendResponse(BaseModel):
     region: Optional[str] = None
     commune: Optional[str] = None
     data: List[PollutantTrend]
+
+
+class DashboardResponse(BaseModel):
+    """Initial data of the dashboard"""
+    regions: List[str]
+    years: List[int]
+    summary: Dict[str, Any]
+    records: AirQualityListResponse
+    trend: TrendResponse
+
+
+class IngestReport(BaseModel):
+    """Outcome of a bulk ingestion run"""
+    files: int = 0
+    rows_read: int = 0
+    rows_written: int = 0
+    rows_unchanged: int = 0
+    rows_rejected: int = 0
+    errors: List[str] = []
+    elapsed_seconds: float = 0.0
+    rows_per_second: float = 0.0
+
+
+class UpsertResponse(BaseModel):
+    """Outcome of a bulk upsert"""
+    received: int
+    written: int
+    unchanged: int
+
+
+class SlowQuery(BaseModel):
+    """A statement that exceeded the slow query threshold"""
+    timestamp: datetime
+    function: str
+    elapsed_ms: float
+    rows: Optional[int] = None
+    statement: str
+    parameters: Any = None
+    plan: Optional[List[str]] = None
+
+
+class SlowQueryListResponse(BaseModel):
+    """Recorded slow queries, most recent first"""
+    threshold_ms: float
+    explain_sample: float
+    queries: List[SlowQuery]
@@ -0,0 +1,74 @@
+"""
+Text search on commune and region names
+
+Names are matched against lower-cased, accent-folded shadow columns
+(``commune_norm``, ``region_norm``) so filters never have to wrap the
+column in a function, which would defeat its index:
+
+- PostgreSQL: ``pg_trgm`` GIN indexes serve ``exact``, ``prefix`` and
+  ``contains`` lookups
+- SQLite: a plain B-tree index serves ``exact`` and ``prefix`` lookups
+  (the prefix is turned into a range scan); ``contains`` still scans
+"""
+import unicodedata
+from typing import Literal, Optional
+
+MatchMode = Literal["exact", "prefix", "contains"]
+
+MATCH_MODES = ("exact", "prefix", "contains")
+
+_LIKE_ESCAPE = "\\"
+
+
+def normalize_text(value: Optional[str]) -> Optional[str]:
+    """Lower-case and strip accents: "Île-de-France" -> "ile-de-france" """
+    if value is None:
+        return None
+    decomposed = unicodedata.normalize("NFKD", value)
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return folded.casefold().strip()
+
+
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input is matched literally"""
+    return (
+        value.replace(_LIKE_ESCAPE, _LIKE_ESCAPE * 2)
+        .replace("%", _LIKE_ESCAPE + "%")
+        .replace("_", _LIKE_ESCAPE + "_")
+    )
+
+
+def match_condition(column, value: str, mode: MatchMode = "contains", dialect: str = "sqlite"):
+    """
+    Build the SQL condition matching ``value`` against a normalized column.
+
+    ``column`` must be one of the ``*_norm`` shadow columns.
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Invalid match mode: {mode}")
+
+    term = normalize_text(value)
+    if mode == "exact":
+        return column == term
+
+    if mode == "prefix":
+        if dialect == "postgresql" or not term:
+            return column.like(_escape_like(term) + "%", escape=_LIKE_ESCAPE)
+        # Half-open range on the binary collation: an index range scan on SQLite
+        upper = term[:-1] + chr(ord(term[-1]) + 1)
+        return (column >= term) & (column < upper)
+
+    return column.like("%" + _escape_like(term) + "%", escape=_LIKE_ESCAPE)
+
+
+def matches(normalized: str, value: str, mode: MatchMode = "contains") -> bool:
+    """Python counterpart of ``match_condition`` for an already normalized name"""
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Invalid match mode: {mode}")
+
+    term = normalize_text(value)
+    if mode == "exact":
+        return normalized == term
+    if mode == "prefix":
+        return normalized.startswith(term)
+    return term in normalized
@@ -0,0 +1,123 @@
+"""
+Single-flight coalescing of identical concurrent reads
+
+When the dashboard loads, many clients ask for the same summary, region
+list or region statistics at the same instant. ``coalesce`` wraps an async
+``crud`` read so that concurrent calls with the same arguments, on the
+same database and at the same dataset version, share one call: the first
+caller runs the query on its own session and every caller arriving while
+it runs awaits that result. Calls arriving once it has finished start a
+new one; keeping results around is the job of ``app.cache``.
+
+The dataset version is part of the key, so a read starting after a write
+has committed never joins a call started before it. Results are shared
+between callers and must not be mutated. If the leading caller is
+cancelled (client gone), its waiters start over and one of them leads a
+new call on its own session, since the leader's session is closed with
+its request.
+
+Coalescing is per process and can be turned off with ``SINGLE_FLIGHT=false``.
+"""
+import asyncio
+import functools
+import inspect
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from app.cache import dataset_version
+from app.metrics import COALESCED_CALLS
+
+T = TypeVar("T")
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+
+class _Abandoned(Exception):
+    """The leading call was cancelled before it completed"""
+
+
+class SingleFlight:
+    """Calls in flight, by key"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Await ``call()``, or the identical call already in flight.
+
+        Returns ``(result, shared)`` where ``shared`` tells whether the
+        result came from another caller's call.
+        """
+        while key in self._flights:
+            try:
+                return await asyncio.shield(self._flights[key]), True
+            except _Abandoned:
+                continue
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            flight.set_exception(_Abandoned())
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(result)
+            return result, False
+        finally:
+            del self._flights[key]
+            # Mark the exception retrieved when no caller was waiting
+            flight.exception()
+
+
+flights = SingleFlight()
+
+
+def _freeze(value: Any) -> Hashable:
+    """Hashable form of an argument (lists become tuples)"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def coalesce(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Share concurrent identical calls of an async read taking a session first.
+
+    Arguments are matched after binding them to the signature, so
+    positional and keyword spellings of a call coalesce. Calls whose
+    arguments cannot be hashed run on their own.
+    """
+    signature = inspect.signature(fn)
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(db, *args: Any, **kwargs: Any) -> T:
+        if not SINGLE_FLIGHT:
+            return await fn(db, *args, **kwargs)
+
+        bound = signature.bind(db, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())[1:]
+        database = db.bind if db.bind is not None else db
+        key = (name, database, dataset_version(), _freeze(arguments))
+        try:
+            hash(key)
+        except TypeError:
+            return await fn(db, *args, **kwargs)
+
+        result, shared = await flights.do(key, lambda: fn(db, *args, **kwargs))
+        if shared:
+            COALESCED_CALLS.labels(function=name).inc()
+        return result
+
+    return wrapper
@@ -0,0 +1,160 @@
+"""
+Slow query recorder
+
+Statements slower than ``SLOW_QUERY_MS`` (default 200 ms) are logged with
+their bound parameters, the ``crud`` function that issued them (see
+``app.metrics.instrument``), the elapsed time and the row count, and kept
+in a ring buffer of the last ``SLOW_QUERY_BUFFER`` entries served by the
+admin router.
+
+A sampled fraction (``SLOW_QUERY_EXPLAIN_SAMPLE``, 0 to 1, default 0) of
+slow SELECTs also gets its plan captured: ``EXPLAIN (ANALYZE, BUFFERS)``
+on PostgreSQL, which runs the query a second time, and ``EXPLAIN QUERY
+PLAN`` on SQLite. Plans are fetched on the raw DBAPI cursor so they are
+not themselves timed or recorded, inside a savepoint: a failed EXPLAIN
+(timeout, cancel) would otherwise leave the request's PostgreSQL
+transaction aborted.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.metrics import current_function
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "100"))
+
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+EXPLAIN_SAVEPOINT = "slow_query_explain"
+
+_QUERY_START_KEY = "slow_query_start"
+
+
+def _loggable(value):
+    """Make a bound parameter JSON serializable"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_loggable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _loggable(v) for k, v in value.items()}
+    return str(value)
+
+
+class SlowQueryRecorder:
+    """Keeps the most recent slow queries in a bounded buffer"""
+
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_MS,
+        explain_sample: float = SLOW_QUERY_EXPLAIN_SAMPLE,
+        maxlen: int = SLOW_QUERY_BUFFER
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain_sample = explain_sample
+        self._entries: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, entry: dict) -> None:
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self, limit: Optional[int] = None) -> List[dict]:
+        """Recorded queries, most recent first"""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit is not None else entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def should_explain(self, statement: str, executemany: bool) -> bool:
+        return (
+            not executemany
+            and self.explain_sample > 0
+            and statement.lstrip()[:6].upper() == "SELECT"
+            and random.random() < self.explain_sample
+        )
+
+
+recorder = SlowQueryRecorder()
+
+
+def _explain(conn, statement: str, parameters) -> Optional[List[str]]:
+    """Plan of a statement, fetched on a separate DBAPI cursor in a savepoint"""
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None:
+        return None
+    explain_cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        explain_cursor.execute(f"SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            plan = [str(row[-1]) for row in explain_cursor.fetchall()]
+        except Exception as e:
+            # Leaves the request's transaction usable again
+            explain_cursor.execute(f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}")
+            logger.warning(f"Could not capture query plan: {e}")
+            plan = None
+        explain_cursor.execute(f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        return plan
+    except Exception as e:
+        logger.warning(f"Could not capture query plan: {e}")
+        return None
+    finally:
+        explain_cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_QUERY_START_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_slow_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info[_QUERY_START_KEY].pop()) * 1000
+    if elapsed_ms < recorder.threshold_ms:
+        return
+
+    function = current_function()
+    rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    entry = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "function": function,
+        "elapsed_ms": round(elapsed_ms, 3),
+        "rows": rows,
+        "statement": statement,
+        "parameters": _loggable(parameters),
+        "plan": None,
+    }
+    if recorder.should_explain(statement, executemany):
+        entry["plan"] = _explain(conn, statement, parameters)
+
+    recorder.record(entry)
+    logger.warning(
+        f"Slow query in {function}: {elapsed_ms:.1f} ms, {rows} rows: "
+        f"{' '.join(statement.split())} {entry['parameters']}"
+    )
+
+
+@event.listens_for(Engine, "handle_error")
+def _discard_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get(_QUERY_START_KEY):
+        connection.info[_QUERY_START_KEY].pop()
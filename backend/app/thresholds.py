@@ -0,0 +1,46 @@
+"""
+Air quality thresholds per pollutant
+
+Single source of the values the dashboard colours measurements with and
+the statistics endpoints count exceedances against (annual means, in
+µg/m³, after the WHO air quality guidelines):
+
+- ``low``: guideline value; a measurement above it is an exceedance
+- ``high``: above it, a measurement is rated poor
+"""
+from typing import Dict, NamedTuple, Optional
+
+
+class Threshold(NamedTuple):
+    low: float
+    high: float
+
+
+THRESHOLDS: Dict[str, Threshold] = {
+    "no2": Threshold(low=20, high=40),
+    "pm10": Threshold(low=15, high=45),
+    "pm25": Threshold(low=10, high=25),
+    "o3": Threshold(low=60, high=100),
+}
+
+# Levels from best to worst, with their display colour
+LEVELS = (
+    ("good", "#22c55e"),
+    ("moderate", "#f59e0b"),
+    ("poor", "#ef4444"),
+)
+
+
+LEVEL_COLORS = dict(LEVELS)
+
+
+def level(pollutant: str, value: Optional[float]) -> Optional[str]:
+    """Level of a measurement, None when it cannot be rated"""
+    threshold = THRESHOLDS.get(pollutant)
+    if threshold is None or value is None:
+        return None
+    if value <= threshold.low:
+        return "good"
+    if value <= threshold.high:
+        return "moderate"
+    return "poor"
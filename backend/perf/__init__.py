@@ -0,0 +1,3 @@
+"""
+Performance tooling: synthetic datasets and load tests
+"""
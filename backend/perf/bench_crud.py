@@ -0,0 +1,150 @@
+"""
+Benchmarks of the crud functions
+
+Every benchmark runs at each scale of ``BENCH_ROWS`` (see ``conftest``).
+Write benchmarks leave the database as they found it: created records
+are deleted again (by ``conftest`` too, after an interrupted run) and
+updates alternate between two values.
+
+Run from ``backend/`` (the committed baseline is the 1k tier):
+    BENCH_ROWS=1000 python -m pytest perf --benchmark-json=results.json
+    python -m perf.compare results.json perf/baseline.json --threshold 0.2
+"""
+import itertools
+
+import pytest
+
+from app import crud
+from app.models import AirQualityRecord
+from app.schemas import AirQualityCreate, AirQualityUpdate
+from perf.conftest import WRITE_CODE_PREFIX
+
+PAGE_SIZE = 20
+REGION = "Occitanie"
+YEAR = 2015
+WRITE_ROUNDS = 50
+STATS_ROUNDS = 20
+
+_codes = itertools.count()
+
+
+@pytest.fixture
+def commune(db):
+    """Name of a commune of the dataset"""
+    return db.query(AirQualityRecord.commune).order_by(AirQualityRecord.id).limit(1).scalar()
+
+
+def _new_record() -> AirQualityCreate:
+    return AirQualityCreate(
+        commune="Benchmark", code_insee=f"{WRITE_CODE_PREFIX}{next(_codes)}", region=REGION,
+        departement="Département 31", annee=YEAR, no2=21.5, pm10=17.2, pm25=10.4, o3=55.1,
+        latitude=43.6, longitude=1.44
+    )
+
+
+# ============== Listing ==============
+
+def test_get_records_first_page(benchmark, db, rows):
+    result = benchmark(crud.get_records, db, skip=0, limit=PAGE_SIZE)
+    assert len(result) == min(PAGE_SIZE, rows)
+
+
+def test_get_records_deep_offset(benchmark, db, rows):
+    result = benchmark(crud.get_records, db, skip=rows - rows // 10, limit=PAGE_SIZE)
+    assert len(result) == min(PAGE_SIZE, rows // 10)
+
+
+def test_get_records_filtered(benchmark, db):
+    result = benchmark(crud.get_records, db, region=REGION, annee=YEAR, skip=0, limit=PAGE_SIZE)
+    assert all(r.annee == YEAR for r in result)
+
+
+def test_get_total_count(benchmark, db, rows):
+    assert benchmark(crud.get_total_count, db) == rows
+
+
+def test_get_total_count_filtered(benchmark, db):
+    assert benchmark(crud.get_total_count, db, region=REGION, annee=YEAR) > 0
+
+
+# ============== Statistics ==============
+
+def _uncached(benchmark, fn, *args, **kwargs):
+    """Benchmark ``fn`` with the distribution cache emptied before every round"""
+    return benchmark.pedantic(
+        fn, args=(*args,), kwargs=kwargs, setup=crud._distribution_cache.clear, rounds=STATS_ROUNDS
+    )
+
+
+def test_get_stats_by_region(benchmark, db):
+    assert _uncached(benchmark, crud.get_stats_by_region, db, REGION)["count"] > 0
+
+
+def test_get_stats_by_region_year(benchmark, db):
+    assert _uncached(benchmark, crud.get_stats_by_region, db, REGION, YEAR)["count"] > 0
+
+
+def test_get_stats_by_region_percentiles(benchmark, db):
+    result = _uncached(benchmark, crud.get_stats_by_region, db, REGION, percentiles=True)
+    assert result["distribution"]["no2"]["p50"] is not None
+
+
+def test_get_stats_by_commune(benchmark, db, commune):
+    assert _uncached(benchmark, crud.get_stats_by_commune, db, commune)["count"] > 0
+
+
+def test_get_pollutant_trend(benchmark, db):
+    assert benchmark(crud.get_pollutant_trend, db, "no2")
+
+
+def test_get_pollutant_trend_region(benchmark, db):
+    assert benchmark(crud.get_pollutant_trend, db, "no2", region=REGION)
+
+
+# ============== Metadata ==============
+
+def test_get_regions(benchmark, db):
+    assert benchmark(crud.get_regions, db)
+
+
+def test_get_communes(benchmark, db):
+    assert benchmark(crud.get_communes, db)
+
+
+def test_get_communes_region(benchmark, db):
+    assert benchmark(crud.get_communes, db, REGION)
+
+
+def test_get_years(benchmark, db):
+    assert benchmark(crud.get_years, db)
+
+
+# ============== Writes ==============
+
+def test_create_record(benchmark, db):
+    created = []
+
+    def create():
+        created.append(crud.create_record(db, _new_record()).id)
+
+    benchmark.pedantic(create, rounds=WRITE_ROUNDS)
+    for record_id in created:
+        crud.delete_record(db, record_id)
+
+
+def test_update_record(benchmark, db):
+    record_id = crud.create_record(db, _new_record()).id
+    values = itertools.cycle([AirQualityUpdate(no2=30.0), AirQualityUpdate(no2=21.5)])
+
+    def setup():
+        return (db, record_id, next(values)), {}
+
+    benchmark.pedantic(crud.update_record, setup=setup, rounds=WRITE_ROUNDS)
+    crud.delete_record(db, record_id)
+
+
+def test_delete_record(benchmark, db):
+    def setup():
+        return (db, crud.create_record(db, _new_record()).id), {}
+
+    benchmark.pedantic(crud.delete_record, setup=setup, rounds=WRITE_ROUNDS)
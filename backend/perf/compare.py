@@ -0,0 +1,98 @@
+"""
+Compare benchmark results with a stored baseline
+
+Reads two ``--benchmark-json`` files of ``perf/bench_*.py`` and reports,
+for every benchmark present in both, the relative change of a statistic
+(median by default). Exits with status 1 when any benchmark is slower
+than the baseline by more than ``--threshold`` (a fraction, 0.2 = +20%).
+
+``perf/baseline.json`` is a reference run of the 1k tier
+(``BENCH_ROWS=1000``, ``data`` timings stripped); regenerate it on the
+machine that compares. Exits with status 2 when a file is missing.
+
+Usage:
+    python -m perf.compare results.json perf/baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_STAT = "median"
+
+
+class Comparison(NamedTuple):
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        """Relative change, positive when slower"""
+        return self.current / self.baseline - 1 if self.baseline else 0.0
+
+
+def load_stats(path: str, stat: str = DEFAULT_STAT) -> Dict[str, float]:
+    """Statistic of each benchmark of a pytest-benchmark JSON file, by full name"""
+    with open(path, encoding="utf-8") as stream:
+        data = json.load(stream)
+    return {b["fullname"]: b["stats"][stat] for b in data["benchmarks"]}
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float]) -> List[Comparison]:
+    """Benchmarks present in both runs, in name order"""
+    return [
+        Comparison(name, baseline[name], current[name])
+        for name in sorted(current.keys() & baseline.keys())
+    ]
+
+
+def regressions(comparisons: List[Comparison], threshold: float = DEFAULT_THRESHOLD) -> List[Comparison]:
+    return [c for c in comparisons if c.change > threshold]
+
+
+def format_table(comparisons: List[Comparison], threshold: float) -> str:
+    width = max([len(c.name) for c in comparisons] + [9])
+    lines = [f"{'benchmark':<{width}}  {'baseline ms':>12}  {'current ms':>12}  {'change':>8}"]
+    for c in comparisons:
+        flag = "  REGRESSION" if c.change > threshold else ""
+        lines.append(
+            f"{c.name:<{width}}  {c.baseline * 1000:>12.3f}  {c.current * 1000:>12.3f}  "
+            f"{c.change:>+8.1%}{flag}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Compare benchmark results with a baseline")
+    parser.add_argument("results", help="JSON written by --benchmark-json")
+    parser.add_argument("baseline", help="Baseline JSON written by --benchmark-json")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Tolerated slowdown as a fraction (0.2 = +20%%)")
+    parser.add_argument("--stat", default=DEFAULT_STAT, choices=["min", "median", "mean", "max"])
+    args = parser.parse_args(argv)
+
+    for path in (args.results, args.baseline):
+        if not os.path.isfile(path):
+            parser.exit(2, f"{path} not found: write it with "
+                           f"python -m pytest perf --benchmark-json={path}\n")
+    current = load_stats(args.results, args.stat)
+    baseline = load_stats(args.baseline, args.stat)
+    comparisons = compare(current, baseline)
+    print(format_table(comparisons, args.threshold))
+
+    missing = sorted(baseline.keys() - current.keys())
+    if missing:
+        print(f"Not run: {', '.join(missing)}")
+
+    slower = regressions(comparisons, args.threshold)
+    if slower:
+        print(f"{len(slower)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Fixtures of the crud benchmarks
+
+Benchmarks run against SQLite databases of the synthetic dataset (see
+``perf.synthetic``), one per scale in ``BENCH_ROWS`` (comma separated row
+counts, default 1k, 100k and 1M). Databases are built once and kept in
+``BENCH_DATA_DIR`` so later runs measure the same data without paying
+for the load again. Records created by the write benchmarks (codes
+starting with ``WRITE_CODE_PREFIX``) are deleted before the benchmarks
+start and once they end, so an interrupted run leaves no row behind.
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app import rollup
+from app.models import AirQualityRecord, Base
+from perf.synthetic import SyntheticDataset
+
+BENCH_ROWS = [int(n) for n in os.getenv("BENCH_ROWS", "1000,100000,1000000").split(",")]
+BENCH_DATA_DIR = os.getenv(
+    "BENCH_DATA_DIR", os.path.join(os.path.dirname(__file__), ".bench-data")
+)
+BENCH_SEED = 42
+BENCH_YEARS = 20
+BUILD_CHUNK_SIZE = 10000
+WRITE_CODE_PREFIX = "BENCH"
+
+
+def scale_id(rows: int) -> str:
+    """``1k``, ``100k``, ``1M`` style label of a row count"""
+    for unit, size in (("M", 1_000_000), ("k", 1000)):
+        if rows >= size and rows % size == 0:
+            return f"{rows // size}{unit}"
+    return str(rows)
+
+
+def build_database(path: str, rows: int) -> None:
+    """Load ``rows`` synthetic records and their rollup into a new SQLite file"""
+    dataset = SyntheticDataset(
+        communes=max(rows // BENCH_YEARS, 1), years=BENCH_YEARS, seed=BENCH_SEED
+    )
+    partial = f"{path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    engine = create_engine(f"sqlite:///{partial}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            for chunk in dataset.chunks(BUILD_CHUNK_SIZE):
+                connection.execute(
+                    insert(AirQualityRecord.__table__),
+                    [AirQualityRecord.derived_values(row) for row in chunk]
+                )
+            rollup.rebuild(connection)
+            connection.exec_driver_sql("ANALYZE")
+    finally:
+        engine.dispose()
+    os.replace(partial, path)
+
+
+def delete_written_records(engine) -> int:
+    """Delete the records created by write benchmarks; returns how many there were"""
+    session = sessionmaker(bind=engine)()
+    try:
+        # Through the session, so the rollup follows
+        records = session.query(AirQualityRecord).filter(
+            AirQualityRecord.code_insee.like(f"{WRITE_CODE_PREFIX}%")
+        ).all()
+        for record in records:
+            session.delete(record)
+        session.commit()
+        return len(records)
+    finally:
+        session.close()
+
+
+def pytest_generate_tests(metafunc):
+    if "rows" in metafunc.fixturenames:
+        metafunc.parametrize("rows", BENCH_ROWS, ids=scale_id, scope="session")
+
+
+@pytest.fixture(scope="session")
+def engine(rows):
+    """Engine on the cached database of the current scale"""
+    os.makedirs(BENCH_DATA_DIR, exist_ok=True)
+    path = os.path.join(BENCH_DATA_DIR, f"crud-{scale_id(rows)}-{BENCH_SEED}.db")
+    if not os.path.exists(path):
+        build_database(path, rows)
+
+    engine = create_engine(f"sqlite:///{path}")
+    delete_written_records(engine)  # Left by an interrupted run
+    yield engine
+    delete_written_records(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine, autoflush=False)()
+    try:
+        yield session
+    finally:
+        session.close()
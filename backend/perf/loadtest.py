@@ -0,0 +1,244 @@
+"""
+Load test replaying the dashboard's call mix
+
+Each simulated user runs one session of the frontend (``frontend/js``):
+
+1. ``checkApiHealth`` then ``loadInitialData``: the dashboard bootstrap
+   (regions, years, summary, first page of records, default trend)
+2. dashboard filters: a region, then a year (records reloaded each time)
+3. paging through the data table
+4. commune search (prefix of a commune seen in the table)
+5. trends view for a pollutant and the selected region
+6. map at country zoom, then zoomed in on a commune
+7. region statistics and comparison, which the API serves to other clients
+
+Users run concurrently, each with its own seeded random choices, against
+the ASGI app in process (default) or a running server (``--url``).
+Latencies are reported per endpoint as throughput and p50/p95/p99.
+
+Usage:
+    python -m perf.loadtest --users 20 --sessions 5 [--url http://localhost:8000]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+API_PREFIX = "/api/v1"
+
+POLLUTANTS = ("no2", "pm10", "pm25", "o3")
+
+PAGE_SIZE = 20
+
+# Metropolitan France, as shown by the map on load
+FRANCE_BBOX = "-5.5,41.0,10.0,51.5"
+COUNTRY_ZOOM = 6
+COMMUNE_ZOOM = 11
+
+
+class LoadTestResults:
+    """Latencies and errors per endpoint label"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.elapsed = 0.0
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    @property
+    def total_requests(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+    @property
+    def total_errors(self) -> int:
+        return sum(self.errors.values())
+
+    def summary(self) -> dict:
+        """Per endpoint requests, errors, throughput and percentiles in ms"""
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "throughput": round(len(latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+            }
+        return {
+            "requests": self.total_requests,
+            "errors": self.total_errors,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "throughput": round(self.total_requests / self.elapsed, 2) if self.elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+    def format_table(self) -> str:
+        summary = self.summary()
+        lines = [f"{'endpoint':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+        for endpoint, s in summary["endpoints"].items():
+            lines.append(
+                f"{endpoint:<24}{s['requests']:>10}{s['errors']:>8}{s['throughput']:>10.1f}"
+                f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}"
+            )
+        lines.append(
+            f"{summary['requests']} requests, {summary['errors']} errors in "
+            f"{summary['elapsed_seconds']} s ({summary['throughput']} req/s)"
+        )
+        return "\n".join(lines)
+
+
+class Session:
+    """One user of the dashboard"""
+
+    def __init__(self, client: httpx.AsyncClient, results: LoadTestResults, rng: random.Random):
+        self.client = client
+        self.results = results
+        self.rng = rng
+
+    async def get(self, endpoint: str, path: str, params: Optional[dict] = None) -> Optional[dict]:
+        """GET ``path``, timed under ``endpoint``; the JSON body when successful"""
+        params = {k: v for k, v in (params or {}).items() if v not in (None, "")}
+        started = time.perf_counter()
+        try:
+            response = await self.client.get(path, params=params)
+        except httpx.HTTPError:
+            self.results.record(endpoint, time.perf_counter() - started, False)
+            return None
+        self.results.record(endpoint, time.perf_counter() - started, response.status_code < 400)
+        if response.status_code >= 400:
+            return None
+        return response.json()
+
+    async def records(self, **params) -> Optional[dict]:
+        return await self.get("records", f"{API_PREFIX}/records", {"page_size": PAGE_SIZE, **params})
+
+    async def run(self) -> None:
+        await self.get("health", "/health")
+
+        # loadInitialData
+        dashboard = await self.get("dashboard", f"{API_PREFIX}/dashboard", {"page_size": PAGE_SIZE}) or {}
+        page = dashboard.get("records")
+        regions = dashboard.get("regions") or []
+        years = dashboard.get("years") or []
+
+        # Dashboard filters
+        region = self.rng.choice(regions) if regions else None
+        year = self.rng.choice(years) if years else None
+        page = await self.records(page=1, region=region) or page
+        await self.records(page=1, region=region, annee=year)
+
+        # Paging
+        total = (page or {}).get("total", 0)
+        for number in range(2, min(3, -(-total // PAGE_SIZE)) + 1):
+            await self.records(page=number, region=region)
+
+        # Commune search, typed as a prefix
+        rows = (page or {}).get("data") or []
+        commune = self.rng.choice(rows) if rows else None
+        if commune:
+            await self.records(page=1, commune=commune["commune"][:3])
+
+        # Trends view
+        pollutant = self.rng.choice(POLLUTANTS)
+        await self.get("trends", f"{API_PREFIX}/trends/{pollutant}", {"region": region})
+
+        # Map: the whole country, then zoomed in on a commune
+        await self.get("map", f"{API_PREFIX}/map", {
+            "pollutant": pollutant, "annee": year, "bbox": FRANCE_BBOX, "zoom": COUNTRY_ZOOM,
+        })
+        if commune and commune.get("latitude") is not None and commune.get("longitude") is not None:
+            lat, lon = commune["latitude"], commune["longitude"]
+            bbox = f"{lon - 0.2:.4f},{lat - 0.1:.4f},{lon + 0.2:.4f},{lat + 0.1:.4f}"
+            await self.get("map", f"{API_PREFIX}/map", {
+                "pollutant": pollutant, "annee": year, "bbox": bbox, "zoom": COMMUNE_ZOOM,
+            })
+
+        # Statistics
+        if region:
+            await self.get("stats_region", f"{API_PREFIX}/stats/region/{region}", {"annee": year})
+        if len(regions) > 1:
+            compared = self.rng.sample(regions, min(3, len(regions)))
+            await self.get("compare", f"{API_PREFIX}/compare", {"regions": ",".join(compared), "annee": year})
+
+
+async def run_load_test(
+    users: int = 10,
+    sessions: int = 1,
+    seed: int = 0,
+    url: Optional[str] = None,
+    app=None,
+    timeout: float = 30.0
+) -> LoadTestResults:
+    """
+    Run ``sessions`` sessions for each of ``users`` concurrent users.
+
+    Requests go to ``url`` when given, to the ASGI ``app`` in process
+    otherwise (``app.main.app`` by default).
+    """
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=timeout)
+    else:
+        if app is None:
+            from app.main import app
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=timeout
+        )
+
+    results = LoadTestResults()
+
+    async def user(number: int) -> None:
+        rng = random.Random(seed + number)
+        for _ in range(sessions):
+            await Session(client, results, rng).run()
+
+    async with client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(n) for n in range(users)))
+        results.elapsed = time.perf_counter() - started
+    return results
+
+
+async def _run(args) -> LoadTestResults:
+    if args.url:
+        return await run_load_test(args.users, args.sessions, args.seed, url=args.url)
+
+    # In process, start the app as the server would: tables, rollup, grid
+    from app.main import app
+    async with app.router.lifespan_context(app):
+        return await run_load_test(args.users, args.sessions, args.seed, app=app)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Replay the dashboard call mix and report latencies")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent users")
+    parser.add_argument("--sessions", type=int, default=1, help="Sessions per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Base URL of a running API (in process when omitted)")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    # One log line per request would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(_run(args))
+    print(results.format_table())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(results.summary(), stream, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Deterministic synthetic air quality dataset at France scale
+
+Generates ``AirQualityRecord`` rows for any number of communes and years
+(35,000 communes x 20 years by default) spread over the 13 metropolitan
+regions and their 96 departements. The same seed always yields the same
+rows, whatever the chunk size.
+
+Values follow a simple but realistic model: each commune gets an
+urbanisation level (mostly rural, a few dense cities) that drives its
+NO2 and particulate baselines, ozone is higher in the south and in the
+countryside, every pollutant follows a yearly trend (NO2 and particles
+decreasing, ozone slowly increasing) with multiplicative noise, and a
+fraction of measurements is missing. Values are rounded to 0.1 like the
+published data.
+
+The ground truth (per region statistics, yearly trends, dataset summary)
+is computed from the generated values themselves, so it can be compared
+with what the API returns once the rows are loaded.
+
+Usage:
+    python -m perf.synthetic --load [--communes 35000 --years 20 --seed 42]
+    python -m perf.synthetic --output synthetic.parquet --truth truth.json
+"""
+import argparse
+import json
+import logging
+import random
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMUNES = 35000
+DEFAULT_YEARS = 20
+DEFAULT_FIRST_YEAR = 2005
+DEFAULT_SEED = 42
+DEFAULT_MISSING_RATE = 0.05
+DEFAULT_CHUNK_SIZE = 5000
+
+MAX_COMMUNES_PER_DEPARTEMENT = 999
+
+# Region: (center latitude, center longitude, spread in degrees, departements)
+REGIONS = {
+    "Auvergne-Rhône-Alpes": (45.5, 4.6, 1.4, ["01", "03", "07", "15", "26", "38", "42", "43", "63", "69", "73", "74"]),
+    "Bourgogne-Franche-Comté": (47.2, 4.8, 1.1, ["21", "25", "39", "58", "70", "71", "89", "90"]),
+    "Bretagne": (48.2, -2.9, 0.9, ["22", "29", "35", "56"]),
+    "Centre-Val de Loire": (47.5, 1.7, 1.0, ["18", "28", "36", "37", "41", "45"]),
+    "Corse": (42.1, 9.0, 0.4, ["2A", "2B"]),
+    "Grand Est": (48.7, 5.6, 1.2, ["08", "10", "51", "52", "54", "55", "57", "67", "68", "88"]),
+    "Hauts-de-France": (50.0, 2.8, 0.8, ["02", "59", "60", "62", "80"]),
+    "Île-de-France": (48.7, 2.4, 0.5, ["75", "77", "78", "91", "92", "93", "94", "95"]),
+    "Normandie": (49.1, 0.1, 0.9, ["14", "27", "50", "61", "76"]),
+    "Nouvelle-Aquitaine": (45.2, 0.2, 1.7, ["16", "17", "19", "23", "24", "33", "40", "47", "64", "79", "86", "87"]),
+    "Occitanie": (43.7, 2.2, 1.4, ["09", "11", "12", "30", "31", "32", "34", "46", "48", "65", "66", "81", "82"]),
+    "Pays de la Loire": (47.5, -0.8, 0.9, ["44", "49", "53", "72", "85"]),
+    "Provence-Alpes-Côte d'Azur": (43.9, 6.1, 0.9, ["04", "05", "06", "13", "83", "84"]),
+}
+
+# Pollutant: yearly trend factor and noise (standard deviation of the log)
+TRENDS = {
+    "no2": (0.97, 0.12),
+    "pm10": (0.98, 0.10),
+    "pm25": (0.98, 0.12),
+    "o3": (1.005, 0.06),
+    "somo35": (1.01, 0.20),
+    "aot40": (1.01, 0.25),
+}
+
+# Pollutants of the statistics endpoints, whose ground truth is computed
+TRUTH_POLLUTANTS = ("no2", "pm10", "pm25", "o3")
+
+_SYLLABLES = [
+    "bar", "bel", "bon", "cha", "mont", "lan", "mar", "ro", "ver", "fon", "tai", "gre",
+    "lu", "ne", "ri", "sa", "tou", "vi", "beau", "cour", "ber", "co", "vil", "mé", "ré",
+]
+_ENDINGS = ["ac", "ay", "ville", "court", "ières", "ieu", "y", "gny", "an", "ens", "euil", ""]
+_PREFIXES = ["Saint-", "Sainte-", "Le ", "La ", "Les "]
+_SUFFIXES = ["-sur-Mer", "-sur-Loire", "-les-Bains", "-en-Bresse", "-la-Forêt"]
+
+
+def _commune_name(rng: random.Random) -> str:
+    name = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 2))) + rng.choice(_ENDINGS)
+    name = name.capitalize()
+    if rng.random() < 0.15:
+        name = rng.choice(_PREFIXES) + name
+    if rng.random() < 0.08:
+        name += rng.choice(_SUFFIXES)
+    return name
+
+
+class SyntheticDataset:
+    """Communes with their static attributes, and their yearly measurements on demand"""
+
+    def __init__(
+        self,
+        communes: int = DEFAULT_COMMUNES,
+        years: int = DEFAULT_YEARS,
+        first_year: int = DEFAULT_FIRST_YEAR,
+        seed: int = DEFAULT_SEED,
+        missing_rate: float = DEFAULT_MISSING_RATE
+    ):
+        departements = sum(len(d) for *_, d in REGIONS.values())
+        if communes > departements * MAX_COMMUNES_PER_DEPARTEMENT:
+            raise ValueError(f"At most {departements * MAX_COMMUNES_PER_DEPARTEMENT} communes")
+        self.size = communes
+        self.years = list(range(first_year, first_year + years))
+        self.seed = seed
+        self.missing_rate = missing_rate
+
+        rng = np.random.default_rng([seed, 0])
+        names_rng = random.Random(seed)
+
+        # Regions weighted by their number of departements, departements uniform
+        region_names = list(REGIONS)
+        weights = np.array([len(REGIONS[r][3]) for r in region_names], dtype=float)
+        region_index = rng.choice(len(region_names), size=communes, p=weights / weights.sum())
+
+        self.region = np.empty(communes, dtype=object)
+        self.departement = np.empty(communes, dtype=object)
+        self.code_insee = np.empty(communes, dtype=object)
+        self.latitude = np.empty(communes)
+        self.longitude = np.empty(communes)
+        sequence: Dict[str, int] = {}
+        for i, r in enumerate(region_index):
+            name = region_names[r]
+            lat, lon, spread, codes = REGIONS[name]
+            code = codes[rng.integers(len(codes))]
+            while sequence.get(code, 0) >= MAX_COMMUNES_PER_DEPARTEMENT:
+                code = codes[rng.integers(len(codes))]
+            sequence[code] = sequence.get(code, 0) + 1
+            self.region[i] = name
+            self.departement[i] = f"Département {code}"
+            self.code_insee[i] = f"{code}{sequence[code]:03d}"
+            self.latitude[i] = round(float(np.clip(lat + rng.normal(0, spread / 2), 41.3, 51.1)), 4)
+            self.longitude[i] = round(float(np.clip(lon + rng.normal(0, spread / 2), -5.2, 9.6)), 4)
+        self.commune = np.array([_commune_name(names_rng) for _ in range(communes)], dtype=object)
+
+        # Urbanisation in [0, 1]: mostly rural, a long tail of cities
+        urban = rng.beta(0.6, 5.0, size=communes)
+        urban[self.region == "Île-de-France"] = np.maximum(urban[self.region == "Île-de-France"], 0.3)
+        south = np.clip((46.5 - self.latitude) / 4, 0, 1)
+        pm10 = 11 + 14 * urban + rng.normal(0, 1.5, communes)
+        o3 = 52 + 14 * south - 12 * urban + rng.normal(0, 3, communes)
+        self.baseline = {
+            "no2": 6 + 38 * urban + rng.normal(0, 2, communes),
+            "pm10": pm10,
+            "pm25": pm10 * (0.6 + 0.05 * rng.standard_normal(communes)),
+            "o3": o3,
+            "somo35": np.maximum(o3 - 40, 1) * 220,
+            "aot40": np.maximum(o3 - 45, 1) * 1400,
+        }
+        for values in self.baseline.values():
+            np.maximum(values, 0.5, out=values)
+
+    def __len__(self) -> int:
+        return self.size * len(self.years)
+
+    def measurements(self, year: int) -> Dict[str, np.ndarray]:
+        """Values of every commune for one year (NaN when missing)"""
+        rng = np.random.default_rng([self.seed, 1, year])
+        elapsed = year - self.years[0]
+        values = {}
+        for pollutant, (trend, noise) in TRENDS.items():
+            series = self.baseline[pollutant] * trend ** elapsed * np.exp(rng.normal(0, noise, self.size))
+            series = np.round(series, 1)
+            series[rng.random(self.size) < self.missing_rate] = np.nan
+            values[pollutant] = series
+        return values
+
+    def chunks(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[dict]]:
+        """Rows as ``AirQualityCreate`` dicts, year by year"""
+        for year in self.years:
+            values = self.measurements(year)
+            for start in range(0, self.size, chunk_size):
+                stop = min(start + chunk_size, self.size)
+                columns = {p: values[p][start:stop].tolist() for p in TRENDS}
+                chunk = []
+                for offset, i in enumerate(range(start, stop)):
+                    row = {
+                        "commune": self.commune[i],
+                        "code_insee": self.code_insee[i],
+                        "region": self.region[i],
+                        "departement": self.departement[i],
+                        "annee": year,
+                        "latitude": float(self.latitude[i]),
+                        "longitude": float(self.longitude[i]),
+                    }
+                    for p in TRENDS:
+                        value = columns[p][offset]
+                        row[p] = None if value != value else value  # NaN -> None
+                    chunk.append(row)
+                yield chunk
+
+    def ground_truth(self) -> dict:
+        """Statistics the API should return once the dataset is loaded"""
+        regions = sorted(REGIONS)
+        region_codes = {r: i for i, r in enumerate(regions)}
+        region_index = np.array([region_codes[r] for r in self.region])
+        size = len(regions)
+        present = np.bincount(region_index, minlength=size) > 0
+
+        totals = {p: np.zeros(size) for p in TRUTH_POLLUTANTS}
+        counts = {p: np.zeros(size, dtype=np.int64) for p in TRUTH_POLLUTANTS}
+        lows = {p: np.full(size, np.inf) for p in ("no2", "pm10")}
+        highs = {p: np.full(size, -np.inf) for p in ("no2", "pm10")}
+        trends = {p: [] for p in TRUTH_POLLUTANTS}
+
+        for year in self.years:
+            values = self.measurements(year)
+            for p in TRUTH_POLLUTANTS:
+                valid = ~np.isnan(values[p])
+                totals[p] += np.bincount(region_index[valid], weights=values[p][valid], minlength=size)
+                counts[p] += np.bincount(region_index[valid], minlength=size)
+                if p in lows:
+                    np.minimum.at(lows[p], region_index[valid], values[p][valid])
+                    np.maximum.at(highs[p], region_index[valid], values[p][valid])
+                trends[p].append({
+                    "annee": year,
+                    "value": _rounded(values[p][valid].sum() / valid.sum()) if valid.any() else None,
+                })
+
+        def average(p: str, group=slice(None)) -> Optional[float]:
+            count = counts[p][group].sum()
+            return _rounded(totals[p][group].sum() / count) if count else None
+
+        region_stats = {}
+        for name in regions:
+            g = region_codes[name]
+            if not present[g]:
+                continue
+            stats = {"count": int((region_index == g).sum()) * len(self.years)}
+            for p in TRUTH_POLLUTANTS:
+                stats[f"avg_{p}"] = average(p, g)
+            for p in ("no2", "pm10"):
+                stats[f"max_{p}"] = float(highs[p][g]) if counts[p][g] else None
+                stats[f"min_{p}"] = float(lows[p][g]) if counts[p][g] else None
+            region_stats[name] = stats
+
+        return {
+            "regions": region_stats,
+            "trends": trends,
+            "years": sorted(self.years, reverse=True),
+            "summary": {
+                "total_records": len(self),
+                "total_regions": len(region_stats),
+                "total_communes": len(set(self.commune)),
+                "year_range": {"min": self.years[0], "max": self.years[-1]},
+                "global_averages": {p: average(p) for p in TRUTH_POLLUTANTS},
+            },
+        }
+
+
+def _rounded(value: float) -> float:
+    return round(float(value), 2)
+
+
+def write_file(dataset: SyntheticDataset, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """Write the rows to a CSV or Parquet file that ``app.ingest`` can load"""
+    if path.lower().endswith((".parquet", ".pq")):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in dataset.chunks(chunk_size):
+                batch = pa.RecordBatch.from_pylist(chunk)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, batch.schema)
+                writer.write_batch(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        return
+
+    import csv
+    with open(path, "w", newline="", encoding="utf-8") as stream:
+        writer = None
+        for chunk in dataset.chunks(chunk_size):
+            if writer is None:
+                writer = csv.DictWriter(stream, fieldnames=list(chunk[0]))
+                writer.writeheader()
+            writer.writerows(chunk)
+
+
+def load(db, dataset: SyntheticDataset, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Upsert the rows through the ingestion pipeline; returns its report"""
+    from app.ingest import ingest_chunks, ingest_run
+    with ingest_run(db) as report:
+        ingest_chunks(db, dataset.chunks(chunk_size), report)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Generate a synthetic air quality dataset")
+    parser.add_argument("--communes", type=int, default=DEFAULT_COMMUNES)
+    parser.add_argument("--years", type=int, default=DEFAULT_YEARS)
+    parser.add_argument("--first-year", type=int, default=DEFAULT_FIRST_YEAR)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--missing-rate", type=float, default=DEFAULT_MISSING_RATE)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--output", help="Write a .csv or .parquet file")
+    parser.add_argument("--load", action="store_true", help="Load into DATABASE_URL")
+    parser.add_argument("--truth", help="Write the ground truth aggregates as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    dataset = SyntheticDataset(
+        args.communes, args.years, args.first_year, args.seed, args.missing_rate
+    )
+    logger.info(f"Generating {len(dataset)} records ({args.communes} communes x {args.years} years)")
+
+    if args.output:
+        write_file(dataset, args.output, args.chunk_size)
+        logger.info(f"Wrote {args.output}")
+
+    if args.load:
+        from app.database import SessionLocal, create_tables, sync_schema
+
+        create_tables()
+        sync_schema()  # Upsert key and search columns of older databases
+        db = SessionLocal()
+        try:
+            report = load(db, dataset, args.chunk_size)
+        finally:
+            db.close()
+        print(report.model_dump_json(indent=2))
+
+    if args.truth:
+        with open(args.truth, "w", encoding="utf-8") as stream:
+            json.dump(dataset.ground_truth(), stream, ensure_ascii=False, indent=2)
+        logger.info(f"Wrote {args.truth}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Parity tests between the SQL and in-memory (NumPy) analytics engines
+Run with: pytest tests/ -v
+"""
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import analytics, crud, rollup
+from app.models import Base, AirQualityRecord, POLLUTANTS
+
+engine = create_engine(
+    "sqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+REGIONS = {
+    "Île-de-France": ["Paris", "Versailles", "Évry"],
+    "Auvergne-Rhône-Alpes": ["Lyon", "Grenoble", "Annecy"],
+    "Provence-Alpes-Côte d'Azur": ["Marseille", "Nice"],
+    "Occitanie": ["Toulouse", "Montpellier", "Nîmes"],
+}
+
+QUERIES = [
+    ("get_stats_by_region", dict(region="Île-de-France")),
+    ("get_stats_by_region", dict(region="ile", match="prefix")),
+    ("get_stats_by_region", dict(region="occitanie", annee=2021, match="exact")),
+    ("get_stats_by_region", dict(region="Bretagne")),
+    ("get_stats_by_region", dict(region="Île-de-France", percentiles=True)),
+    ("get_stats_by_commune", dict(commune="Paris")),
+    ("get_stats_by_commune", dict(commune="nim", match="prefix")),
+    ("get_stats_by_commune", dict(commune="inconnue")),
+    ("get_stats_by_commune", dict(commune="nim", match="prefix", percentiles=True)),
+    ("get_pollutant_trend", dict(pollutant="no2")),
+    ("get_pollutant_trend", dict(pollutant="pm25", region="alpes")),
+    ("get_pollutant_trend", dict(pollutant="o3", commune="lyon", match="exact")),
+    ("get_pollutant_trend", dict(pollutant="somo35", region="Occitanie", commune="to", match="prefix")),
+    ("compare_regions", dict(regions=["Occitanie", "île-de-france", "Bretagne"])),
+    ("compare_regions", dict(regions=None, annee=2020)),
+    ("compare_regions", dict(regions=None, percentiles=True)),
+    ("compare_regions", dict(regions=["alpes", "ile", "bretagne"], match="contains")),
+    ("compare_regions", dict(regions=["occ", "ile"], annee=2020, match="prefix", percentiles=True)),
+    ("get_summary", dict()),
+]
+
+
+def _random_record(rng: random.Random, region: str, commune: str, annee: int) -> AirQualityRecord:
+    """A record with some missing pollutant values"""
+    values = {p: (None if rng.random() < 0.15 else round(rng.uniform(0, 80), 1)) for p in POLLUTANTS}
+    return AirQualityRecord(
+        commune=commune,
+        code_insee=f"{abs(hash(commune)) % 100000:05d}",
+        region=region,
+        departement=commune,
+        annee=annee,
+        latitude=round(rng.uniform(42, 51), 4),
+        longitude=round(rng.uniform(-4, 8), 4),
+        **values
+    )
+
+
+@pytest.fixture
+def db():
+    """Session on a seeded dataset, with a fresh analytics store"""
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    session = TestingSessionLocal()
+    for region, communes in REGIONS.items():
+        for commune in communes:
+            for annee in range(2018, 2023):
+                session.add(_random_record(rng, region, commune, annee))
+    session.commit()
+    analytics.store.clear()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+    analytics.store.clear()
+
+
+def _run(db, monkeypatch, engine_name: str, name: str, kwargs: dict):
+    monkeypatch.setattr(analytics, "ANALYTICS_ENGINE", engine_name)
+    crud._summary_cache.clear()
+    crud._distribution_cache.clear()
+    return getattr(crud, name)(db, **kwargs)
+
+
+def _close(actual, expected) -> bool:
+    """Equality, allowing one unit of the last rounded digit on floats
+
+    Sums run in a different order in SQL and NumPy, so an average that
+    falls on a rounding boundary may round either way.
+    """
+    if isinstance(expected, float) and isinstance(actual, float):
+        return abs(actual - expected) <= 0.01 + 1e-9
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return actual.keys() == expected.keys() and all(_close(actual[k], expected[k]) for k in expected)
+    if isinstance(expected, list) and isinstance(actual, list):
+        return len(actual) == len(expected) and all(map(_close, actual, expected))
+    return actual == expected
+
+
+def _assert_parity(db, monkeypatch):
+    for name, kwargs in QUERIES:
+        expected = _run(db, monkeypatch, "sql", name, kwargs)
+        actual = _run(db, monkeypatch, "numpy", name, kwargs)
+        assert _close(actual, expected), f"{name}({kwargs}): {actual} != {expected}"
+
+
+class TestAnalyticsParity:
+    """Tests that the NumPy engine answers exactly like SQL"""
+
+    def test_parity(self, db, monkeypatch):
+        """Test every statistics function on the seeded dataset"""
+        _assert_parity(db, monkeypatch)
+        assert analytics.store.version is not None
+
+    def test_parity_empty(self, db, monkeypatch):
+        """Test statistics over an empty table"""
+        for record in db.query(AirQualityRecord).all():
+            db.delete(record)
+        db.commit()
+        _assert_parity(db, monkeypatch)
+
+    def test_incremental_refresh(self, db, monkeypatch):
+        """Test ORM writes are spliced into the store without a reload"""
+        _assert_parity(db, monkeypatch)
+        loads = []
+        monkeypatch.setattr(
+            analytics.store, "_load",
+            lambda session: loads.append(1) or analytics.ColumnStore._load(analytics.store, session)
+        )
+
+        record = db.query(AirQualityRecord).filter_by(commune="Paris", annee=2020).one()
+        record.no2 = 99.9
+        record.region = "Occitanie"
+        db.delete(db.query(AirQualityRecord).filter_by(commune="Nice", annee=2018).one())
+        db.add(_random_record(random.Random(1), "Bretagne", "Rennes", 2021))
+        db.commit()
+
+        _assert_parity(db, monkeypatch)
+        assert loads == []
+
+    def test_bulk_write_reloads(self, db, monkeypatch):
+        """Test writes with unknown rows (bulk upsert) trigger a full reload"""
+        _assert_parity(db, monkeypatch)
+        crud.upsert_rows(db, [AirQualityRecord.derived_values({
+            "commune": "Lyon", "code_insee": "69123", "region": "Auvergne-Rhône-Alpes",
+            "departement": "Rhône", "annee": 2030, "no2": 10.0, "pm10": None, "pm25": None,
+            "o3": None, "somo35": None, "aot40": None, "latitude": None, "longitude": None
+        })])
+        db.commit()
+        _assert_parity(db, monkeypatch)
+
+    def test_load_in_batches(self, db, monkeypatch):
+        """Test streaming the table in several partitions gives the same arrays"""
+        monkeypatch.setattr(analytics, "LOAD_BATCH_SIZE", 7)
+        _assert_parity(db, monkeypatch)
+        assert len(analytics.store.snapshot(db)) == db.query(AirQualityRecord).count()
+
+    def test_external_insert_detected(self, db, monkeypatch):
+        """Test rows written by another process are seen once the check interval elapses"""
+        monkeypatch.setattr(analytics, "ANALYTICS_CHECK_INTERVAL", 0)
+        _assert_parity(db, monkeypatch)
+
+        # Core DML on a connection bypasses the session events, like another process
+        with engine.begin() as connection:
+            connection.execute(AirQualityRecord.__table__.insert(), [AirQualityRecord.derived_values({
+                "commune": "Rennes", "code_insee": "35238", "region": "Bretagne",
+                "departement": "Ille-et-Vilaine", "annee": 2021, "no2": 15.0, "pm10": 12.0,
+                "pm25": None, "o3": None, "somo35": None, "aot40": None,
+                "latitude": None, "longitude": None
+            })])
+            rollup.rebuild(connection)
+        _assert_parity(db, monkeypatch)
+
+    def test_external_update_reloaded_after_max_age(self, db, monkeypatch):
+        """Test rows updated in place by another process are seen once the snapshot expires"""
+        _assert_parity(db, monkeypatch)
+        with engine.begin() as connection:
+            connection.execute(AirQualityRecord.__table__.update().values(no2=1.0))
+            rollup.rebuild(connection)
+        monkeypatch.setattr(analytics, "ANALYTICS_MAX_AGE", 0)
+        _assert_parity(db, monkeypatch)
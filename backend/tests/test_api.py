@@ -2,15 +2,25 @@
 Unit Tests for Air Quality API
 Run with: pytest tests/ -v
 """
+import csv
+import io
+import json
+import os
+import re
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from app import rollup
+from app.cache import bump_dataset_version
+from app.refresher import metadata as metadata_refresher
 from app.main import app
-from app.database import get_db
+from app.database import get_db, get_ingest_db
 from app.models import Base, AirQualityRecord
+from app.schemas import AirQualityResponse
 
 # Test database configuration
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -32,8 +42,9 @@ def override_get_db():
         db.close()
 
 
-# Override the dependency
+# Override the dependencies
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_ingest_db] = override_get_db
 
 
 @pytest.fixture(scope="function")
@@ -105,8 +116,17 @@ def client():
     
     with TestClient(app) as test_client:
         yield test_client
+        # A refresh still reading would lock the tables dropped below
+        wait_for_refresh(test_client)
     
     Base.metadata.drop_all(bind=engine)
+    bump_dataset_version()  # Dropping tables bypasses the session events
+    metadata_refresher.clear()
+
+
+def wait_for_refresh(test_client):
+    """Wait for the background refreshes of the metadata endpoints"""
+    test_client.portal.call(metadata_refresher.wait)
 
 
 # ============== Health Check Tests ==============
@@ -129,6 +149,83 @@ class TestHealthCheck:
         data = response.json()
         assert data["status"] == "healthy"
 
+    def test_pool_health(self, client):
+        """Test pool status reports the request engine's pool"""
+        response = client.get("/health/pool")
+        assert response.status_code == 200
+        assert "pool" in response.json()["sync"]
+
+    def test_metrics_endpoint(self, client):
+        """Test request and query metrics are labelled by route template and crud function"""
+        client.get("/api/v1/records/1")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        body = response.text
+        assert 'route="/api/v1/records/{record_id}"' in body
+        assert 'db_query_duration_seconds_count{function="get_record_by_id"}' in body
+        assert "http_requests_in_progress" in body
+
+    def test_pool_metrics(self, tmp_path):
+        """Test the timed pool records checkout waits and timeouts"""
+        from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+        from app.pool import TimedQueuePool, pool_status
+
+        pool_engine = create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}",
+            poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+        )
+        connection = pool_engine.connect()
+        assert pool_status(pool_engine)["checked_out"] == 1
+        with pytest.raises(PoolTimeoutError):
+            pool_engine.connect()
+        connection.close()
+
+        status = pool_status(pool_engine)
+        assert status["checked_out"] == 0
+        assert status["checkouts"] == 1
+        assert status["timeouts"] == 1
+        assert status["wait_seconds_max"] >= 0.05
+        pool_engine.dispose()
+
+
+# ============== JSON Response Tests ==============
+
+class TestJSONResponse:
+    """Tests for the ORJSON default response class"""
+
+    def test_non_ascii_and_null(self, client):
+        """Test accented names are sent as UTF-8 and missing values as null"""
+        created = client.post("/api/v1/records", json={
+            "commune": "Évry-Courcouronnes", "code_insee": "91228", "region": "Île-de-France",
+            "departement": "Essonne", "annee": 2022, "no2": 21.4
+        })
+        assert created.status_code == 201
+
+        response = client.get(f"/api/v1/records/{created.json()['id']}")
+        assert response.headers["content-type"] == "application/json"
+        assert "Évry-Courcouronnes".encode() in response.content
+        assert "Île-de-France".encode() in response.content
+        assert b"\\u" not in response.content
+        assert b'"pm25":null' in response.content
+        assert response.json()["pm25"] is None
+
+    def test_nan_serialized_as_null(self, client, monkeypatch):
+        """Test NaN and infinite floats become null instead of failing the response"""
+        from app import crud_async
+
+        async def stats_with_nan(db, region, annee=None, **kwargs):
+            return {"region": region, "annee": annee, "count": 1,
+                    "avg_no2": float("nan"), "max_no2": float("inf"), "avg_pm10": None}
+
+        monkeypatch.setattr(crud_async, "get_stats_by_region", stats_with_nan)
+        response = client.get("/api/v1/stats/region/Île-de-France")
+        assert response.status_code == 200
+        assert b'"avg_no2":null' in response.content
+        assert b'"max_no2":null' in response.content
+        data = response.json()
+        assert data["region"] == "Île-de-France"
+        assert data["avg_no2"] is None and data["max_no2"] is None and data["avg_pm10"] is None
+
 
 # ============== CRUD Tests ==============
 
@@ -153,6 +250,55 @@ class TestCRUDOperations:
         assert data["page"] == 1
         assert data["page_size"] == 2
     
+    def test_get_records_cursor_pagination(self, client):
+        """Test keyset pagination walks every record exactly once"""
+        response = client.get("/api/v1/records?page_size=3")
+        data = response.json()
+        assert len(data["data"]) == 3
+        assert data["next_cursor"] is not None
+
+        response = client.get(f"/api/v1/records?page_size=3&cursor={data['next_cursor']}")
+        assert response.status_code == 200
+        next_data = response.json()
+        assert len(next_data["data"]) == 1
+        assert next_data["next_cursor"] is None
+
+        ids = [r["id"] for r in data["data"] + next_data["data"]]
+        assert sorted(ids) == [1, 2, 3, 4]
+
+    def test_get_records_cursor_matches_offset_order(self, client):
+        """Test cursor pages follow the same order as offset pages"""
+        first = client.get("/api/v1/records?page_size=2").json()
+        second = client.get("/api/v1/records?page=2&page_size=2").json()
+        by_cursor = client.get(f"/api/v1/records?page_size=2&cursor={first['next_cursor']}").json()
+        assert [r["id"] for r in by_cursor["data"]] == [r["id"] for r in second["data"]]
+
+    def test_get_records_invalid_cursor(self, client):
+        """Test 400 for a malformed cursor"""
+        response = client.get("/api/v1/records?cursor=not-a-cursor")
+        assert response.status_code == 400
+
+    def test_get_records_count_none(self, client):
+        """Test count=none skips the total"""
+        response = client.get("/api/v1/records?count=none")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] is None
+        assert data["count_mode"] == "none"
+        assert len(data["data"]) == 4
+
+    def test_get_records_count_estimate_falls_back_to_exact(self, client):
+        """Test count=estimate is exact on SQLite (no planner statistics)"""
+        data = client.get("/api/v1/records?count=estimate").json()
+        assert data["total"] == 4
+        assert data["count_mode"] == "exact"
+
+    def test_cached_count_invalidated_on_write(self, client):
+        """Test the cached total follows creates and deletes"""
+        assert client.get("/api/v1/records?annee=2020").json()["total"] == 3
+        client.delete("/api/v1/records/1")
+        assert client.get("/api/v1/records?annee=2020").json()["total"] == 2
+
     def test_get_records_filter_by_commune(self, client):
         """Test filtering by commune"""
         response = client.get("/api/v1/records?commune=Paris")
@@ -176,6 +322,32 @@ class TestCRUDOperations:
         assert data["total"] == 3
         assert all(r["annee"] == 2020 for r in data["data"])
     
+    def test_filter_is_case_and_accent_insensitive(self, client):
+        """Test region filter ignores case and accents"""
+        data = client.get("/api/v1/records?region=ILE-DE-FRANCE").json()
+        assert data["total"] == 2
+
+    def test_filter_match_modes(self, client):
+        """Test exact, prefix and contains match modes"""
+        def total(query):
+            return client.get(f"/api/v1/records?{query}").json()["total"]
+
+        assert total("commune=ari&match=contains") == 2
+        assert total("commune=ari&match=prefix") == 0
+        assert total("commune=mars&match=prefix") == 1
+        assert total("commune=paris&match=exact") == 2
+        assert total("commune=par&match=exact") == 0
+
+    def test_filter_escapes_like_wildcards(self, client):
+        """Test LIKE wildcards in the search term match literally"""
+        data = client.get("/api/v1/records?commune=%25").json()
+        assert data["total"] == 0
+
+    def test_invalid_match_mode(self, client):
+        """Test 422 for an unknown match mode"""
+        response = client.get("/api/v1/records?commune=Paris&match=fuzzy")
+        assert response.status_code == 422
+
     def test_get_single_record(self, client):
         """Test getting a single record by ID"""
         response = client.get("/api/v1/records/1")
@@ -249,6 +421,386 @@ class TestCRUDOperations:
         assert response.status_code == 404
 
 
+# ============== Bulk Import Tests ==============
+
+IMPORT_CSV = (
+    "Commune;Code INSEE;Région;Département;Année;NO2;PM10;PM2.5;O3\n"
+    "Bordeaux;33063;Nouvelle-Aquitaine;Gironde;2020;22,5;17,8;11,2;49,5\n"
+    "Nantes;44109;Pays de la Loire;Loire-Atlantique;2020;20,5;;10,2;47,8\n"
+    "Invalid;1;Nowhere;Nowhere;1890;1;1;1;1\n"
+)
+
+
+class TestExport:
+    """Tests for streaming exports"""
+
+    def test_export_ndjson(self, client):
+        """Test NDJSON export has one record per line in listing order"""
+        response = client.get("/api/v1/records/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        listed = client.get("/api/v1/records").json()["data"]
+        assert lines == listed
+
+    def test_export_csv_with_filters(self, client):
+        """Test CSV export honours the listing filters"""
+        response = client.get("/api/v1/records/export?format=csv&commune=Paris")
+        assert response.status_code == 200
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert len(rows) == 2
+        assert {r["commune"] for r in rows} == {"Paris"}
+        assert rows[0]["somo35"] == ""
+
+    def test_export_gzip(self, client):
+        """Test export is compressed when the client accepts gzip"""
+        response = client.get("/api/v1/records/export", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.text.splitlines()) == 4
+
+    def test_export_empty(self, client):
+        """Test a CSV export without matches still has its header"""
+        response = client.get("/api/v1/records/export?format=csv&annee=1999")
+        assert response.text.splitlines() == [",".join(AirQualityResponse.model_fields)]
+
+    def test_export_parquet(self, client):
+        """Test Parquet export round-trips with the Arrow schema"""
+        pq = pytest.importorskip("pyarrow.parquet")
+        response = client.get("/api/v1/records/export?format=parquet&region=Île-de-France")
+        assert response.headers["content-type"] == "application/vnd.apache.parquet"
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.num_rows == 2
+        assert str(table.schema.field("no2").type) == "float"
+        assert str(table.schema.field("latitude").type) == "double"
+        assert not table.schema.field("commune").nullable
+        assert table.schema.field("somo35").nullable
+
+    def test_export_arrow_by_accept(self, client):
+        """Test the Arrow Accept header selects the IPC stream format"""
+        pa = pytest.importorskip("pyarrow")
+        response = client.get(
+            "/api/v1/records/export",
+            headers={"Accept": "application/vnd.apache.arrow.stream"}
+        )
+        assert "content-encoding" not in response.headers
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.num_rows == 4
+
+    def test_records_arrow_page(self, client):
+        """Test a /records page as an Arrow stream with metadata headers"""
+        pa = pytest.importorskip("pyarrow")
+        response = client.get(
+            "/api/v1/records?page_size=3",
+            headers={"Accept": "application/vnd.apache.arrow.stream"}
+        )
+        assert response.status_code == 200
+        assert response.headers["x-total-count"] == "4"
+        assert response.headers["x-next-cursor"]
+        table = pa.ipc.open_stream(response.content).read_all()
+        listed = client.get("/api/v1/records?page_size=3").json()["data"]
+        assert table.column("id").to_pylist() == [r["id"] for r in listed]
+        assert table.column_names == list(AirQualityResponse.model_fields)
+
+    def test_records_parquet_page(self, client):
+        """Test a /records page as Parquet"""
+        pq = pytest.importorskip("pyarrow.parquet")
+        response = client.get("/api/v1/records?format=parquet&commune=Lyon")
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.column("commune").to_pylist() == ["Lyon"]
+
+    def test_export_invalid_format(self, client):
+        """Test unknown formats are rejected"""
+        response = client.get("/api/v1/records/export?format=xml")
+        assert response.status_code == 422
+
+
+class TestBulkImport:
+    """Tests for bulk CSV/Parquet ingestion"""
+
+    def test_import_csv(self, client):
+        """Test CSV import with French headers, ';' and decimal commas"""
+        response = client.post(
+            "/api/v1/records/import?chunk_size=100",
+            files={"file": ("data.csv", IMPORT_CSV, "text/csv")}
+        )
+        assert response.status_code == 201
+        report = response.json()
+        assert report["rows_read"] == 3
+        assert report["rows_written"] == 2
+        assert report["rows_rejected"] == 1
+        assert len(report["errors"]) == 1
+
+        data = client.get("/api/v1/records?commune=Bordeaux").json()
+        assert data["total"] == 1
+        assert data["data"][0]["no2"] == 22.5
+
+        data = client.get("/api/v1/records?commune=Nantes").json()
+        assert data["data"][0]["pm10"] is None
+
+    def test_import_parquet(self, client):
+        """Test Parquet import"""
+        pa = pytest.importorskip("pyarrow")
+        import io
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            "commune": ["Bordeaux", "Lille"],
+            "code_insee": ["33063", "59350"],
+            "region": ["Nouvelle-Aquitaine", "Hauts-de-France"],
+            "departement": ["Gironde", "Nord"],
+            "annee": [2020, 2020],
+            "no2": [22.5, 26.2],
+        })
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+
+        response = client.post(
+            "/api/v1/records/import",
+            files={"file": ("data.parquet", buffer.getvalue(), "application/octet-stream")}
+        )
+        assert response.status_code == 201
+        assert response.json()["rows_written"] == 2
+        assert client.get("/api/v1/records").json()["total"] == 6
+
+    def test_reimport_is_idempotent(self, client):
+        """Test importing the same file twice creates no duplicates"""
+        files = {"file": ("data.csv", IMPORT_CSV, "text/csv")}
+        client.post("/api/v1/records/import", files=files)
+        report = client.post("/api/v1/records/import", files=files).json()
+        assert report["rows_written"] == 0
+        assert report["rows_unchanged"] == 2
+        assert client.get("/api/v1/records").json()["total"] == 6
+
+    def test_rebuild_failure_keeps_ingest_error(self, client, monkeypatch, caplog):
+        """Test a rollup rebuild failing after an ingest error is logged, not raised instead"""
+        from app import ingest
+
+        def chunks():
+            yield list(csv.DictReader(io.StringIO(IMPORT_CSV), delimiter=";"))
+            raise ValueError("truncated file")
+
+        def failing_rebuild(connection):
+            raise RuntimeError("rebuild failed")
+
+        monkeypatch.setattr(rollup, "rebuild", failing_rebuild)
+        db = TestingSessionLocal()
+        try:
+            with pytest.raises(ValueError, match="truncated file"):
+                with ingest.ingest_run(db) as report:
+                    ingest.ingest_chunks(db, chunks(), report)
+        finally:
+            db.close()
+        assert report.rows_written == 2  # The first chunk was committed
+        assert "Rollup rebuild failed after an ingest error" in caplog.text
+
+    def test_import_unsupported_format(self, client):
+        """Test 400 for an unsupported file type"""
+        response = client.post(
+            "/api/v1/records/import",
+            files={"file": ("data.xlsx", b"whatever", "application/octet-stream")}
+        )
+        assert response.status_code == 400
+
+
+class TestUpsert:
+    """Tests for the bulk upsert endpoint"""
+
+    def _paris_2020(self, **changes):
+        record = {
+            "commune": "Paris", "code_insee": "75056", "region": "Île-de-France",
+            "departement": "Paris", "annee": 2020, "no2": 32.5, "pm10": 22.1,
+            "pm25": 14.2, "o3": 45.3, "latitude": 48.8566, "longitude": 2.3522
+        }
+        record.update(changes)
+        return record
+
+    def test_upsert_unchanged_rows_are_not_rewritten(self, client):
+        """Test sending identical data writes nothing"""
+        response = client.put("/api/v1/records:upsert", json=[self._paris_2020()])
+        assert response.status_code == 200
+        assert response.json() == {"received": 1, "written": 0, "unchanged": 1}
+
+    def test_upsert_updates_and_inserts(self, client):
+        """Test changed rows are updated in place and new keys inserted"""
+        new_record = self._paris_2020(annee=2022, no2=25.1)
+        response = client.put(
+            "/api/v1/records:upsert",
+            json=[self._paris_2020(no2=40.0), new_record]
+        )
+        assert response.json() == {"received": 2, "written": 2, "unchanged": 0}
+
+        data = client.get("/api/v1/records?commune=Paris").json()
+        assert data["total"] == 3
+        assert {r["annee"]: r["no2"] for r in data["data"]}[2020] == 40.0
+        assert client.get("/api/v1/records/1").json()["no2"] == 40.0
+
+    def test_upsert_duplicate_keys_in_payload(self, client):
+        """Test the last row wins when a key appears twice"""
+        response = client.put(
+            "/api/v1/records:upsert",
+            json=[self._paris_2020(no2=1.0), self._paris_2020(no2=2.0)]
+        )
+        assert response.json()["written"] == 1
+        assert client.get("/api/v1/records/1").json()["no2"] == 2.0
+
+    def test_create_duplicate_key_conflict(self, client):
+        """Test 409 when creating a second record for the same commune and year"""
+        response = client.post("/api/v1/records", json=self._paris_2020())
+        assert response.status_code == 409
+
+
+# Schema of air_quality before the search, grid and upsert key columns
+BASELINE_SCHEMA = """
+CREATE TABLE air_quality (
+    id INTEGER NOT NULL PRIMARY KEY,
+    commune VARCHAR(100) NOT NULL,
+    code_insee VARCHAR(10) NOT NULL,
+    region VARCHAR(100) NOT NULL,
+    departement VARCHAR(100) NOT NULL,
+    annee INTEGER NOT NULL,
+    no2 FLOAT, pm10 FLOAT, pm25 FLOAT, o3 FLOAT, somo35 FLOAT, aot40 FLOAT,
+    latitude FLOAT, longitude FLOAT
+)
+"""
+
+BASELINE_ROWS = [
+    {"commune": "Paris", "code_insee": "75056", "region": "Île-de-France", "departement": "Paris",
+     "annee": 2020, "no2": 32.5, "latitude": 48.8566, "longitude": 2.3522},
+    {"commune": "Évry", "code_insee": "91228", "region": "Île-de-France", "departement": "Essonne",
+     "annee": 2020, "no2": 20.1, "latitude": 48.6239, "longitude": 2.4294},
+]
+
+
+@pytest.fixture
+def baseline_engine():
+    """Database created by the code predating the schema changes"""
+    legacy = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    with legacy.begin() as connection:
+        connection.exec_driver_sql(BASELINE_SCHEMA)
+        connection.execute(
+            text(
+                "INSERT INTO air_quality (commune, code_insee, region, departement, annee, no2, "
+                "latitude, longitude) VALUES (:commune, :code_insee, :region, :departement, :annee, "
+                ":no2, :latitude, :longitude)"
+            ),
+            BASELINE_ROWS
+        )
+    yield legacy
+    legacy.dispose()
+
+
+class TestSchemaUpgrade:
+    """Tests for the startup migrations of databases created by older versions"""
+
+    def test_search_columns_added_and_filled(self, baseline_engine):
+        """Test the normalized columns and their indexes are created and backfilled"""
+        from sqlalchemy import inspect
+        from app.database import sync_search_columns
+
+        sync_search_columns(baseline_engine)
+        sync_search_columns(baseline_engine)  # Idempotent
+
+        with baseline_engine.connect() as connection:
+            rows = connection.exec_driver_sql(
+                "SELECT commune_norm, region_norm FROM air_quality ORDER BY id"
+            ).all()
+        assert rows == [("paris", "ile-de-france"), ("evry", "ile-de-france")]
+
+        indexes = {i["name"] for i in inspect(baseline_engine).get_indexes("air_quality")}
+        assert {"idx_commune_norm", "idx_region_norm"} <= indexes
+
+    def test_upsert_key_deduplicates(self, baseline_engine):
+        """Test duplicate keys are collapsed to the latest row before the unique index"""
+        from sqlalchemy import inspect
+        from app.database import sync_upsert_key
+
+        with baseline_engine.begin() as connection:
+            connection.exec_driver_sql(
+                "INSERT INTO air_quality (commune, code_insee, region, departement, annee, no2) "
+                "VALUES ('Paris', '75056', 'Île-de-France', 'Paris', 2020, 40.0)"
+            )
+        sync_upsert_key(baseline_engine)
+        sync_upsert_key(baseline_engine)  # Idempotent
+
+        indexes = {i["name"]: i for i in inspect(baseline_engine).get_indexes("air_quality")}
+        assert indexes["uq_code_insee_annee"]["unique"]
+
+        with baseline_engine.begin() as connection:
+            rows = connection.exec_driver_sql(
+                "SELECT id, no2 FROM air_quality WHERE code_insee = '75056'"
+            ).all()
+            assert rows == [(3, 40.0)]
+
+            # The upsert paths rely on the unique index for ON CONFLICT
+            connection.exec_driver_sql(
+                "INSERT INTO air_quality (commune, code_insee, region, departement, annee, no2) "
+                "VALUES ('Paris', '75056', 'Île-de-France', 'Paris', 2020, 41.0) "
+                "ON CONFLICT (code_insee, annee) DO UPDATE SET no2 = excluded.no2"
+            )
+            assert connection.exec_driver_sql(
+                "SELECT COUNT(*), MAX(no2) FROM air_quality WHERE code_insee = '75056'"
+            ).one() == (1, 41.0)
+
+    def test_startup_on_baseline_database(self, baseline_engine):
+        """Test the startup sequence upgrades an old database that then serves queries"""
+        from app import crud
+        from app.geo import BBox
+        from sqlalchemy import inspect
+        from app.database import sync_schema
+
+        Base.metadata.create_all(bind=baseline_engine)
+        sync_schema(baseline_engine)
+
+        indexes = {i["name"] for i in inspect(baseline_engine).get_indexes("air_quality")}
+        assert {index.name for index in AirQualityRecord.__table__.indexes} <= indexes
+
+        db = sessionmaker(bind=baseline_engine)()
+        try:
+            assert [r.commune for r in crud.get_records(db, commune="evry", match="exact")] == ["Évry"]
+            assert crud.get_stats_by_region(db, "Île-de-France")["count"] == 2
+            bbox = BBox(min_lon=2.0, min_lat=48.0, max_lon=3.0, max_lat=49.0)
+            assert len(crud.get_records(db, bbox=bbox)) == 2
+        finally:
+            db.close()
+
+    def test_ingest_cli_on_baseline_database(self, baseline_engine, tmp_path, monkeypatch):
+        """Test the ingest CLI upgrades an old database and rebuilds the rollup once per run"""
+        from app import crud, database, ingest
+
+        monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=baseline_engine))
+        monkeypatch.setattr(database, "create_tables", lambda: Base.metadata.create_all(bind=baseline_engine))
+        calls = []
+        sync_schema = database.sync_schema
+        monkeypatch.setattr(
+            database, "sync_schema", lambda: calls.append("sync_schema") or sync_schema(baseline_engine)
+        )
+        rebuild = rollup.rebuild
+        monkeypatch.setattr(rollup, "rebuild", lambda connection: calls.append("rebuild") or rebuild(connection))
+
+        (tmp_path / "a.csv").write_text(IMPORT_CSV, encoding="utf-8")
+        (tmp_path / "b.csv").write_text(
+            "commune,code_insee,region,departement,annee,no2\n"
+            "Évry,91228,Île-de-France,Essonne,2020,18.4\n"
+            "Lille,59350,Hauts-de-France,Nord,2020,26.2\n",
+            encoding="utf-8"
+        )
+        ingest.main([str(tmp_path)])
+        # Past the migration's first build of the rollup, one rebuild for both files
+        assert calls[calls.index("sync_schema"):] == ["sync_schema", "rebuild", "rebuild"]
+
+        db = sessionmaker(bind=baseline_engine)()
+        try:
+            assert crud.get_stats_by_region(db, "Île-de-France")["count"] == 2  # Évry upserted
+            assert crud.get_stats_by_region(db, "Hauts-de-France")["count"] == 1
+            assert crud.get_stats_by_region(db, "Nouvelle-Aquitaine")["count"] == 1
+        finally:
+            db.close()
+
+
 # ============== Metadata Tests ==============
 
 class TestMetadataEndpoints:
@@ -357,6 +909,126 @@ class TestStatisticsEndpoints:
         response = client.get("/api/v1/compare?regions=Île-de-France")
         assert response.status_code == 400
     
+    def test_compare_regions_keeps_requested_order(self, client):
+        """Test comparison follows the requested order and skips unknown regions"""
+        response = client.get(
+            "/api/v1/compare?regions=Provence-Alpes-Côte d'Azur,Nowhere,Île-de-France"
+        )
+        data = response.json()
+        assert [r["region"] for r in data["comparison"]] == [
+            "Provence-Alpes-Côte d'Azur", "Île-de-France"
+        ]
+        region_stats = client.get("/api/v1/stats/region/Île-de-France").json()
+        assert all(region_stats[k] == v for k, v in data["comparison"][1].items())
+
+    def test_compare_matches_like_region_stats(self, client):
+        """Test names are matched as on /stats/region, by substring unless match says otherwise"""
+        response = client.get("/api/v1/compare?regions=Provence,Auvergne")
+        assert response.status_code == 200
+        comparison = response.json()["comparison"]
+        assert [r["region"] for r in comparison] == ["Provence", "Auvergne"]
+        for entry in comparison:
+            region_stats = client.get(f"/api/v1/stats/region/{entry['region']}").json()
+            assert all(region_stats[k] == v for k, v in entry.items())
+
+        assert client.get("/api/v1/compare?regions=Provence,Auvergne&match=exact").status_code == 404
+        prefix = client.get("/api/v1/compare?regions=ile,lyon&match=prefix").json()["comparison"]
+        assert [r["region"] for r in prefix] == ["ile"]
+
+    def test_compare_all_regions(self, client):
+        """Test regions=* compares every region"""
+        response = client.get("/api/v1/compare?regions=*&annee=2020")
+        assert response.status_code == 200
+        comparison = response.json()["comparison"]
+        assert len(comparison) == 3
+        assert sum(r["count"] for r in comparison) == 3
+
+    def test_region_stats_distribution(self, client):
+        """Test percentiles and exceedances of region statistics"""
+        data = client.get("/api/v1/stats/region/Île-de-France?percentiles=true").json()
+        assert data["distribution"]["no2"] == {
+            "p50": 30.4, "p90": 32.08, "p98": 32.42, "exceedances": 1
+        }
+        assert data["distribution"]["o3"]["exceedances"] == 0
+
+    def test_percentiles_opt_in(self, client):
+        """Test percentiles are only computed on request, exceedances always"""
+        data = client.get("/api/v1/stats/region/Île-de-France").json()
+        assert data["distribution"]["no2"] == {
+            "p50": None, "p90": None, "p98": None, "exceedances": 1
+        }
+
+    def test_exceedances_cached(self, client):
+        """Test repeated statistics do not scan the raw table again"""
+        from app import crud
+
+        db = TestingSessionLocal()
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        try:
+            crud.get_stats_by_region(db, "Île-de-France")
+            event.listen(engine, "before_cursor_execute", record)
+            crud.get_stats_by_region(db, "Île-de-France")
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+            db.close()
+        # Only the rollup is read again
+        assert statements and all("FROM air_quality_rollup" in s for s in statements)
+
+    def test_compare_distribution_per_region(self, client):
+        """Test every compared region gets its own distribution"""
+        comparison = client.get("/api/v1/compare?regions=*&annee=2020&percentiles=true").json()["comparison"]
+        assert [r["distribution"]["no2"]["p50"] for r in comparison] == [28.4, 30.2, 32.5]
+        assert all(r["distribution"]["pm10"]["exceedances"] == 1 for r in comparison)
+
+    def test_commune_stats_distribution(self, client):
+        """Test percentiles of commune statistics"""
+        data = client.get("/api/v1/stats/commune/Lyon?percentiles=true").json()
+        assert data["distribution"]["pm25"] == {
+            "p50": 13.1, "p90": 13.1, "p98": 13.1, "exceedances": 1
+        }
+
+    def test_get_thresholds(self, client):
+        """Test the thresholds table"""
+        response = client.get("/api/v1/thresholds")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["pollutants"]["no2"] == {"low": 20, "high": 40}
+        assert [level["name"] for level in data["levels"]] == ["good", "moderate", "poor"]
+
+    def test_summary_snapshot_skips_database(self, client):
+        """Test repeated summaries are served without any query"""
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        client.get("/api/v1/summary")
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            client.get("/api/v1/summary")
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+        assert statements == []
+
+    def test_summary_follows_writes(self, client):
+        """Test the summary snapshot is refreshed in the background after a write"""
+        assert client.get("/api/v1/summary").json()["total_records"] == 4
+        client.delete("/api/v1/records/4")
+        stale = client.get("/api/v1/summary")
+        assert stale.json()["total_records"] == 4
+        assert stale.headers["cache-control"] == "no-store"
+        assert "etag" not in stale.headers
+
+        wait_for_refresh(client)
+        response = client.get("/api/v1/summary")
+        assert "etag" in response.headers
+        assert response.json()["total_records"] == 3
+        assert response.json()["total_regions"] == 2
+
     def test_get_summary(self, client):
         """Test getting dataset summary"""
         response = client.get("/api/v1/summary")
@@ -368,6 +1040,855 @@ class TestStatisticsEndpoints:
         assert "year_range" in data
 
 
+class TestStatisticsRollup:
+    """Tests that rollup-backed statistics follow every kind of write"""
+
+    def test_rollup_follows_delete(self, client):
+        """Test region stats drop a deleted record"""
+        client.delete("/api/v1/records/1")
+        data = client.get("/api/v1/stats/region/Île-de-France").json()
+        assert data["count"] == 1
+        assert data["max_no2"] == 28.3
+
+    def test_rollup_follows_region_change(self, client):
+        """Test a record moved to another region leaves its old group"""
+        client.put("/api/v1/records/3", json={"region": "Île-de-France"})
+        assert client.get("/api/v1/stats/region/Île-de-France").json()["count"] == 3
+        response = client.get("/api/v1/stats/region/Auvergne-Rhône-Alpes")
+        assert response.status_code == 404
+
+    def test_rollup_follows_bulk_import(self, client):
+        """Test region stats and trends include imported rows"""
+        client.post(
+            "/api/v1/records/import",
+            files={"file": ("data.csv", IMPORT_CSV, "text/csv")}
+        )
+        data = client.get("/api/v1/stats/region/Nouvelle-Aquitaine").json()
+        assert data["count"] == 1
+        assert data["avg_no2"] == 22.5
+
+        trend = client.get("/api/v1/trends/no2").json()["data"]
+        assert {p["annee"]: p["value"] for p in trend}[2020] == round((32.5 + 28.4 + 30.2 + 22.5 + 20.5) / 5, 2)
+
+    def test_rollup_follows_upsert(self, client):
+        """Test region stats reflect upserted values"""
+        client.put("/api/v1/records:upsert", json=[{
+            "commune": "Paris", "code_insee": "75056", "region": "Île-de-France",
+            "departement": "Paris", "annee": 2020, "no2": 50.0
+        }])
+        data = client.get("/api/v1/stats/region/Île-de-France?annee=2020").json()
+        assert data["max_no2"] == 50.0
+
+
+class TestMapLayer:
+    """Tests for the GeoJSON map layer"""
+
+    def test_map_communes(self, client):
+        """Test one feature per commune when zoomed in"""
+        response = client.get("/api/v1/map?pollutant=no2&zoom=12")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["type"] == "FeatureCollection"
+        assert data["clustered"] is False
+        features = {f["properties"]["commune"]: f for f in data["features"]}
+        assert set(features) == {"Paris", "Lyon", "Marseille"}
+        paris = features["Paris"]
+        assert paris["geometry"]["coordinates"] == [2.3522, 48.8566]
+        assert paris["properties"]["value"] == 30.4
+        assert paris["properties"]["level"] == "moderate"
+        assert paris["properties"]["color"] == "#f59e0b"
+
+    def test_map_clusters(self, client):
+        """Test communes are grouped into grid cells when zoomed out"""
+        data = client.get("/api/v1/map?pollutant=no2&zoom=3").json()
+        assert data["clustered"] is True
+        communes = sorted(f["properties"]["communes"] for f in data["features"])
+        assert communes == [1, 2]
+
+    def test_map_bbox_and_year(self, client):
+        """Test only the records inside the viewport are mapped"""
+        data = client.get("/api/v1/map?pollutant=no2&zoom=12&bbox=2,48,3,49&annee=2021").json()
+        assert len(data["features"]) == 1
+        assert data["features"][0]["properties"]["value"] == 28.3
+
+    def test_map_invalid_parameters(self, client):
+        """Test 400 for an invalid pollutant or bbox"""
+        assert client.get("/api/v1/map?pollutant=co2").status_code == 400
+        assert client.get("/api/v1/map?bbox=1,2,3").status_code == 400
+        assert client.get("/api/v1/map?bbox=3,49,2,48").status_code == 400
+
+
+class TestSpatialQueries:
+    """Tests for bounding box and radius searches"""
+
+    def test_grid_cell_maintained(self, client):
+        """Test the grid cell follows the coordinates on create and upsert"""
+        from app import geo
+
+        created = client.post("/api/v1/records", json={
+            "commune": "Brest", "code_insee": "29019", "region": "Bretagne",
+            "departement": "Finistère", "annee": 2020, "latitude": 48.3904, "longitude": -4.4861
+        }).json()
+        client.put("/api/v1/records:upsert", json=[{
+            "commune": "Lyon", "code_insee": "69123", "region": "Auvergne-Rhône-Alpes",
+            "departement": "Rhône", "annee": 2020, "latitude": 45.75, "longitude": 4.85
+        }])
+
+        db = TestingSessionLocal()
+        cells = dict(db.query(AirQualityRecord.id, AirQualityRecord.grid_cell).all())
+        db.close()
+        assert cells[created["id"]] == geo.grid_cell(48.3904, -4.4861)
+        assert cells[3] == geo.grid_cell(45.75, 4.85)
+
+    def test_backfill_matches_python(self, client):
+        """Test grid cells computed in SQL equal the ones computed in Python"""
+        from app import crud, geo
+
+        with engine.begin() as connection:
+            connection.execute(AirQualityRecord.__table__.update().values(grid_cell=None))
+            assert crud.backfill_grid_cells(connection) == 4
+        db = TestingSessionLocal()
+        rows = db.query(AirQualityRecord).all()
+        assert all(r.grid_cell == geo.grid_cell(r.latitude, r.longitude) for r in rows)
+        db.close()
+
+    def test_records_bbox(self, client):
+        """Test filtering records by bounding box"""
+        data = client.get("/api/v1/records?bbox=2,48,3,49").json()
+        assert data["total"] == 2
+        assert {r["commune"] for r in data["data"]} == {"Paris"}
+
+    def test_records_near(self, client):
+        """Test filtering records by distance"""
+        data = client.get("/api/v1/records?near=45.76,4.83&radius_km=5").json()
+        assert [r["commune"] for r in data["data"]] == ["Lyon"]
+        data = client.get("/api/v1/records?near=45.76,4.83&radius_km=300").json()
+        assert {r["commune"] for r in data["data"]} == {"Lyon", "Marseille"}
+
+    def test_nearest_communes(self, client):
+        """Test nearest communes are sorted by distance"""
+        response = client.get("/api/v1/communes/nearest?lat=45.76&lon=4.83&limit=2&radius_km=500")
+        assert response.status_code == 200
+        communes = response.json()["communes"]
+        assert [c["commune"] for c in communes] == ["Lyon", "Marseille"]
+        assert communes[0]["distance_km"] < 1
+        assert 270 < communes[1]["distance_km"] < 290
+
+    def test_invalid_location_filters(self, client):
+        """Test 400 for malformed bbox / near parameters"""
+        assert client.get("/api/v1/records?bbox=2,48").status_code == 400
+        assert client.get("/api/v1/records?near=95,2").status_code == 400
+        assert client.get("/api/v1/records/export?near=abc").status_code == 400
+
+
+class TestResponseCache:
+    """Tests for ETag validation and cached read responses"""
+
+    def test_read_endpoint_has_etag(self, client):
+        """Test cacheable endpoints return a strong ETag"""
+        response = client.get("/api/v1/regions")
+        assert response.headers["etag"].startswith('"')
+        assert response.headers["cache-control"] == "no-cache"
+
+    def test_records_not_cached(self, client):
+        """Test the records listing is not cached"""
+        response = client.get("/api/v1/records")
+        assert "etag" not in response.headers
+
+    def test_etag_ignores_param_order(self, client):
+        """Test query parameter order does not change the ETag"""
+        first = client.get("/api/v1/trends/no2?commune=Par&match=prefix")
+        second = client.get("/api/v1/trends/no2?match=prefix&commune=Par")
+        assert first.headers["etag"] == second.headers["etag"]
+
+    def test_if_none_match_returns_304(self, client):
+        """Test a matching If-None-Match is answered without querying the database"""
+        etag = client.get("/api/v1/stats/region/Île-de-France").headers["etag"]
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            response = client.get(
+                "/api/v1/stats/region/Île-de-France",
+                headers={"If-None-Match": etag}
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+        assert response.status_code == 304
+        assert response.content == b""
+        assert statements == []
+
+    def test_cached_body_served_without_query(self, client):
+        """Test a repeated request is served from the response cache"""
+        first = client.get("/api/v1/years")
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            second = client.get("/api/v1/years")
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+        assert second.json() == first.json()
+        assert statements == []
+
+    def test_write_invalidates_etag(self, client):
+        """Test a committed write changes the ETag and the cached body"""
+        first = client.get("/api/v1/regions")
+        client.delete("/api/v1/records/4")
+        client.get("/api/v1/regions")
+        wait_for_refresh(client)
+        response = client.get("/api/v1/regions", headers={"If-None-Match": first.headers["etag"]})
+        assert response.status_code == 200
+        assert response.headers["etag"] != first.headers["etag"]
+        assert len(response.json()["regions"]) == 2
+
+    def test_etag_expires_with_ttl(self, client, monkeypatch):
+        """Test validators expire after the TTL even when this process saw no write"""
+        from app import http_cache
+
+        monkeypatch.setattr(http_cache, "ttl_period", lambda ttl: 1)
+        etag = client.get("/api/v1/summary").headers["etag"]
+        assert client.get("/api/v1/summary", headers={"If-None-Match": etag}).status_code == 304
+
+        monkeypatch.setattr(http_cache, "ttl_period", lambda ttl: 2)
+        response = client.get("/api/v1/summary", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    def test_errors_not_cached(self, client):
+        """Test error responses carry no ETag"""
+        response = client.get("/api/v1/stats/region/Inconnue")
+        assert response.status_code == 404
+        assert "etag" not in response.headers
+
+
+class TestSlowQueries:
+    """Tests for the slow query recorder and its admin endpoint"""
+
+    ADMIN = {"X-Admin-Token": "secret"}
+
+    @pytest.fixture
+    def recorder(self, monkeypatch):
+        """Record every query and capture every plan, with an admin token configured"""
+        from app.routers import admin
+        from app.slow_queries import recorder
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        monkeypatch.setattr(recorder, "threshold_ms", 0)
+        monkeypatch.setattr(recorder, "explain_sample", 1.0)
+        recorder.clear()
+        yield recorder
+        recorder.clear()
+
+    def test_slow_query_recorded_with_plan(self, client, recorder):
+        """Test slow queries carry the crud function, parameters and plan"""
+        client.get("/api/v1/records?commune=par&count=none")
+        response = client.get("/api/v1/admin/slow-queries?function=get_records", headers=self.ADMIN)
+        assert response.status_code == 200
+        queries = response.json()["queries"]
+        assert len(queries) == 1
+        assert queries[0]["statement"].lstrip().upper().startswith("SELECT")
+        assert "%par%" in queries[0]["parameters"]
+        assert queries[0]["plan"]
+
+    def test_clear_slow_queries(self, client, recorder):
+        """Test the buffer can be emptied"""
+        client.get("/api/v1/years")
+        assert client.delete("/api/v1/admin/slow-queries", headers=self.ADMIN).status_code == 204
+        assert client.get("/api/v1/admin/slow-queries", headers=self.ADMIN).json()["queries"] == []
+
+    def test_admin_requires_token(self, client, recorder):
+        """Test a missing or wrong admin token is refused"""
+        assert client.get("/api/v1/admin/slow-queries").status_code == 403
+        response = client.delete("/api/v1/admin/slow-queries", headers={"X-Admin-Token": "guess"})
+        assert response.status_code == 403
+
+    def test_admin_disabled_without_token(self, client, monkeypatch):
+        """Test the admin endpoints do not exist when no ADMIN_TOKEN is configured"""
+        from app.routers import admin
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+        assert client.get("/api/v1/admin/slow-queries").status_code == 404
+        assert client.delete("/api/v1/admin/slow-queries", headers=self.ADMIN).status_code == 404
+
+    def test_failed_explain_keeps_request(self, client, recorder, monkeypatch):
+        """Test a failing EXPLAIN is rolled back to its savepoint and the request still succeeds"""
+        from app import slow_queries
+
+        monkeypatch.setitem(slow_queries.EXPLAIN_PREFIXES, "sqlite", "EXPLAIN NOT A PLAN ")
+        statements = []
+        shared = engine.raw_connection().driver_connection
+        shared.set_trace_callback(statements.append)
+        try:
+            response = client.get("/api/v1/records?commune=par")
+        finally:
+            shared.set_trace_callback(None)
+
+        assert response.status_code == 200
+        assert response.json()["total"] == 2
+        assert f"ROLLBACK TO SAVEPOINT {slow_queries.EXPLAIN_SAVEPOINT}" in statements
+        assert all(entry["plan"] is None for entry in recorder.entries())
+
+    def test_failed_explain_leaves_transaction_usable(self):
+        """Test the savepoint undoes the aborted state a failed EXPLAIN leaves on PostgreSQL"""
+        from types import SimpleNamespace
+        from app.slow_queries import _explain
+
+        class AbortingCursor:
+            """DBAPI cursor with PostgreSQL's aborted transaction semantics"""
+            def __init__(self, connection):
+                self.connection = connection
+
+            def execute(self, statement, parameters=None):
+                if self.connection.aborted and not statement.startswith("ROLLBACK TO SAVEPOINT"):
+                    raise RuntimeError("current transaction is aborted")
+                if statement.startswith("EXPLAIN"):
+                    self.connection.aborted = True
+                    raise RuntimeError("canceling statement due to statement timeout")
+                self.connection.aborted = False
+
+            def close(self):
+                pass
+
+        dbapi_connection = SimpleNamespace(aborted=False)
+        dbapi_connection.cursor = lambda: AbortingCursor(dbapi_connection)
+        conn = SimpleNamespace(
+            dialect=SimpleNamespace(name="postgresql"),
+            connection=SimpleNamespace(dbapi_connection=dbapi_connection)
+        )
+
+        assert _explain(conn, "SELECT 1", ()) is None
+        assert not dbapi_connection.aborted
+        dbapi_connection.cursor().execute("SELECT 1")  # The request's next query
+
+    def test_buffer_is_bounded(self):
+        """Test the ring buffer keeps only the most recent entries"""
+        from app.slow_queries import SlowQueryRecorder
+        buffer = SlowQueryRecorder(maxlen=2)
+        for i in range(3):
+            buffer.record({"statement": str(i)})
+        assert [e["statement"] for e in buffer.entries()] == ["2", "1"]
+
+
+class TestAsyncSession:
+    """Tests for the async database path (aiosqlite)"""
+
+    @pytest.fixture
+    def async_client(self, tmp_path):
+        """Client whose requests use an AsyncSession on a file database"""
+        pytest.importorskip("aiosqlite")
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import NullPool
+
+        path = tmp_path / "async.db"
+        sync_engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=sync_engine)
+        with sessionmaker(bind=sync_engine)() as db:
+            db.add(AirQualityRecord(
+                commune="Paris", code_insee="75056", region="Île-de-France",
+                departement="Paris", annee=2020, no2=32.5
+            ))
+            db.commit()
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+        AsyncTestingSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        async def override_get_async_db():
+            async with AsyncTestingSession() as db:
+                yield db
+
+        def override_get_ingest_db():
+            with sessionmaker(bind=sync_engine)() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_async_db
+        app.dependency_overrides[get_ingest_db] = override_get_ingest_db
+        try:
+            with TestClient(app) as test_client:
+                yield test_client
+                wait_for_refresh(test_client)
+        finally:
+            app.dependency_overrides[get_db] = override_get_db
+            app.dependency_overrides[get_ingest_db] = override_get_db
+            metadata_refresher.clear()
+            sync_engine.dispose()
+
+    def test_async_read(self, async_client):
+        """Test listing records and statistics through an AsyncSession"""
+        response = async_client.get("/api/v1/records")
+        assert response.status_code == 200
+        assert response.json()["total"] == 1
+        assert async_client.get("/api/v1/stats/region/Île-de-France").json()["count"] == 1
+
+    def test_async_write(self, async_client):
+        """Test writes through an AsyncSession keep rollup and caches in sync"""
+        assert async_client.get("/api/v1/summary").json()["total_records"] == 1
+        response = async_client.post("/api/v1/records", json={
+            "commune": "Lyon", "code_insee": "69123", "region": "Auvergne-Rhône-Alpes",
+            "departement": "Rhône", "annee": 2020, "no2": 28.4
+        })
+        assert response.status_code == 201
+        assert response.json()["commune"] == "Lyon"
+        async_client.get("/api/v1/summary")
+        wait_for_refresh(async_client)
+        assert async_client.get("/api/v1/summary").json()["total_records"] == 2
+        assert async_client.get("/api/v1/stats/region/Auvergne-Rhône-Alpes").json()["count"] == 1
+
+    def test_async_export(self, async_client):
+        """Test exports stream through an AsyncSession"""
+        response = async_client.get("/api/v1/records/export?format=csv")
+        assert response.status_code == 200
+        assert len(response.text.splitlines()) == 2
+
+    def test_async_import(self, async_client, monkeypatch):
+        """Test imports run on a sync session in a worker thread on the async path"""
+        import threading
+        from app import ingest
+
+        calls = []
+        ingest_file = ingest.ingest_file
+
+        def record(db, *args, **kwargs):
+            calls.append((type(db).__name__, threading.current_thread().name))
+            return ingest_file(db, *args, **kwargs)
+
+        monkeypatch.setattr(ingest, "ingest_file", record)
+        response = async_client.post(
+            "/api/v1/records/import",
+            files={"file": ("data.csv", IMPORT_CSV, "text/csv")}
+        )
+        assert response.status_code == 201
+        assert response.json()["rows_written"] == 2
+        assert calls == [("Session", "AnyIO worker thread")]
+        assert async_client.get("/api/v1/records?commune=Bordeaux").json()["total"] == 1
+
+    def test_async_conflict(self, async_client):
+        """Test a duplicate create is rolled back on the async path"""
+        duplicate = {
+            "commune": "Paris", "code_insee": "75056", "region": "Île-de-France",
+            "departement": "Paris", "annee": 2020
+        }
+        assert async_client.post("/api/v1/records", json=duplicate).status_code == 409
+
+
+class TestDashboard:
+    """Tests for the dashboard bootstrap endpoint"""
+
+    def test_matches_individual_endpoints(self, client):
+        """Test the payload matches the endpoints it replaces"""
+        response = client.get("/api/v1/dashboard?page_size=3")
+        assert response.status_code == 200
+        assert "etag" in response.headers
+        data = response.json()
+
+        assert data["regions"] == client.get("/api/v1/regions").json()["regions"]
+        assert data["years"] == client.get("/api/v1/years").json()["years"]
+        assert data["summary"] == client.get("/api/v1/summary").json()
+        records = client.get("/api/v1/records?page_size=3").json()
+        assert data["records"] == records
+        assert data["trend"] == client.get("/api/v1/trends/no2").json()
+
+    def test_trend_pollutant(self, client):
+        """Test the trend follows the requested pollutant"""
+        data = client.get("/api/v1/dashboard?pollutant=PM10").json()
+        assert data["trend"] == client.get("/api/v1/trends/pm10").json() | {"pollutant": "pm10"}
+        assert client.get("/api/v1/dashboard?pollutant=co2").status_code == 400
+
+    def test_few_queries_and_cached(self, client):
+        """Test a cold call runs at most three queries and a warm one none"""
+        from app import crud
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        crud._summary_cache.clear()
+        event.listen(engine, "before_cursor_execute", record)
+        db = TestingSessionLocal()
+        try:
+            first = crud.get_dashboard(db)
+            cold = len(statements)
+            assert crud.get_dashboard(db) is first
+        finally:
+            db.close()
+            event.remove(engine, "before_cursor_execute", record)
+        assert cold <= 3
+        assert len(statements) == cold
+
+    def test_follows_writes(self, client):
+        """Test the snapshot is served once more after a write, then replaced"""
+        assert client.get("/api/v1/dashboard").json()["records"]["total"] == 4
+        client.post("/api/v1/records", json={
+            "commune": "Nantes", "code_insee": "44109", "region": "Pays de la Loire",
+            "departement": "Loire-Atlantique", "annee": 2022, "no2": 22.0
+        })
+        stale = client.get("/api/v1/dashboard")
+        assert stale.json()["records"]["total"] == 4
+        assert stale.headers["cache-control"] == "no-store"
+        assert int(stale.headers["content-length"]) == len(stale.content)
+
+        wait_for_refresh(client)
+        data = client.get("/api/v1/dashboard").json()
+        assert data["records"]["total"] == 5
+        assert data["records"]["data"][0]["commune"] == "Nantes"
+        assert "Pays de la Loire" in data["regions"]
+        assert data["years"][0] == 2022
+        assert data["summary"]["total_records"] == 5
+
+    def test_refresh_sees_other_process_writes(self, client, monkeypatch):
+        """Test the payload follows writes made through another engine once the soft TTL passes"""
+        from app import crud
+
+        assert crud._dashboard_cache.ttl == metadata_refresher.soft_ttl
+        # As with METADATA_SOFT_TTL=0
+        monkeypatch.setattr(metadata_refresher, "soft_ttl", 0)
+        monkeypatch.setattr(crud._summary_cache, "ttl", 0)
+        monkeypatch.setattr(crud._dashboard_cache, "ttl", 0)
+        assert client.get("/api/v1/dashboard").json()["records"]["total"] == 4
+
+        shared = engine.raw_connection().driver_connection
+        other = create_engine("sqlite://", creator=lambda: shared, poolclass=StaticPool)
+        with other.begin() as connection:
+            connection.execute(AirQualityRecord.__table__.delete().where(AirQualityRecord.id == 4))
+            rollup.rebuild(connection)
+
+        # Distinct query strings get past the response cache
+        assert client.get("/api/v1/dashboard?request=1").json()["records"]["total"] == 4
+        wait_for_refresh(client)
+        data = client.get("/api/v1/dashboard?request=2").json()
+        assert data["records"]["total"] == 3
+        assert data["summary"]["total_records"] == 3
+        assert len(data["regions"]) == 2
+
+
+class TestSingleFlight:
+    """Tests for the coalescing of identical concurrent reads"""
+
+    @pytest.fixture
+    def slow_queries(self):
+        """Statements run on the test engine, each made to take 50 ms"""
+        import time
+        statements = []
+
+        def slow(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+            time.sleep(0.05)
+
+        event.listen(engine, "before_cursor_execute", slow)
+        yield statements
+        event.remove(engine, "before_cursor_execute", slow)
+
+    @staticmethod
+    async def _get_all(paths):
+        import asyncio
+        import httpx
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.get(path) for path in paths))
+
+    def test_burst_runs_one_query_per_key(self, client, slow_queries):
+        """Test a burst of identical requests runs each distinct query once"""
+        import asyncio
+
+        responses = asyncio.run(self._get_all(
+            ["/api/v1/regions"] * 10 + ["/api/v1/stats/region/Île-de-France"] * 5
+        ))
+        assert all(r.status_code == 200 for r in responses)
+        assert len({r.text for r in responses[:10]}) == 1
+        assert len(responses[0].json()["regions"]) == 3
+
+        assert sum("DISTINCT air_quality.region" in s for s in slow_queries) == 1
+        assert sum("FROM air_quality_rollup" in s for s in slow_queries) == 1
+
+    def test_shared_result_and_distinct_keys(self):
+        """Test concurrent calls share one call per key"""
+        import asyncio
+        from app.singleflight import SingleFlight
+
+        calls = []
+
+        async def call(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key * 2
+
+        async def burst():
+            flights = SingleFlight()
+            results = await asyncio.gather(
+                *(flights.do(k, lambda k=k: call(k)) for k in [1, 1, 1, 2])
+            )
+            assert len(flights) == 0
+            return results
+
+        assert asyncio.run(burst()) == [(2, False), (2, True), (2, True), (4, False)]
+        assert calls == [1, 2]
+
+    def test_errors_are_shared(self):
+        """Test waiters receive the exception of the shared call"""
+        import asyncio
+        from app.singleflight import SingleFlight
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def burst():
+            flights = SingleFlight()
+            return await asyncio.gather(
+                *(flights.do("key", failing) for _ in range(3)), return_exceptions=True
+            )
+
+        assert all(isinstance(r, ValueError) for r in asyncio.run(burst()))
+
+    def test_cancelled_leader_hands_over(self):
+        """Test waiters start a new call when the leading caller is cancelled"""
+        import asyncio
+        from app.singleflight import SingleFlight
+
+        calls = []
+
+        async def call():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def scenario():
+            flights = SingleFlight()
+            leader = asyncio.ensure_future(flights.do("key", call))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flights.do("key", call))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await waiter
+
+        assert asyncio.run(scenario()) == ("done", False)
+        assert len(calls) == 2
+
+
+class TestMetadataRefresher:
+    """Tests for the stale-while-revalidate cache of the metadata endpoints"""
+
+    @pytest.fixture
+    def queries(self):
+        """SELECT DISTINCT statements run on the test engine"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT DISTINCT"):
+                statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        yield statements
+        event.remove(engine, "before_cursor_execute", record)
+
+    def test_warm_reads_skip_the_database(self, client, queries):
+        """Test only the cold read queries while the data is unchanged"""
+        for _ in range(3):
+            assert len(client.get("/api/v1/years").json()["years"]) == 2
+            assert client.get("/api/v1/communes?region=Île-de-France").json()["communes"] == ["Paris"]
+        wait_for_refresh(client)
+        assert len(queries) == 2
+
+    def test_soft_ttl_refreshes_in_background(self, client, queries, monkeypatch):
+        """Test an expired entry is served and recomputed once in the background"""
+        monkeypatch.setattr(metadata_refresher, "soft_ttl", 0)
+        client.get("/api/v1/regions")
+        # Distinct query strings get past the response cache
+        for i in range(3):
+            response = client.get(f"/api/v1/regions?request={i}")
+            assert len(response.json()["regions"]) == 3
+            assert "etag" in response.headers
+        wait_for_refresh(client)
+        assert 2 <= len(queries) <= 4
+
+    def test_write_serves_previous_value_then_refreshes(self, client):
+        """Test a write never makes a warm request wait on the recompute"""
+        assert len(client.get("/api/v1/regions").json()["regions"]) == 3
+        client.post("/api/v1/records", json={
+            "commune": "Nantes", "code_insee": "44109", "region": "Pays de la Loire",
+            "departement": "Loire-Atlantique", "annee": 2020, "no2": 22.0
+        })
+        stale = client.get("/api/v1/regions")
+        assert len(stale.json()["regions"]) == 3
+        assert stale.headers["cache-control"] == "no-store"
+
+        wait_for_refresh(client)
+        assert "Pays de la Loire" in client.get("/api/v1/regions").json()["regions"]
+
+    def test_refresh_sees_other_process_writes(self, client, monkeypatch):
+        """Test the summary follows writes made through another engine once the soft TTL passes"""
+        from app import crud
+
+        # The refresh would only reread the summary snapshot if it outlived the soft TTL
+        assert crud._summary_cache.ttl == metadata_refresher.soft_ttl
+        # As with METADATA_SOFT_TTL=0
+        monkeypatch.setattr(metadata_refresher, "soft_ttl", 0)
+        monkeypatch.setattr(crud._summary_cache, "ttl", 0)
+        assert client.get("/api/v1/summary").json()["total_records"] == 4
+
+        # Same database, different engine: no session event reaches this process
+        shared = engine.raw_connection().driver_connection
+        other = create_engine("sqlite://", creator=lambda: shared, poolclass=StaticPool)
+        with other.begin() as connection:
+            connection.execute(AirQualityRecord.__table__.delete().where(AirQualityRecord.id == 4))
+
+        # Distinct query strings get past the response cache
+        assert client.get("/api/v1/summary?request=1").json()["total_records"] == 4
+        wait_for_refresh(client)
+        assert client.get("/api/v1/summary?request=2").json()["total_records"] == 3
+
+    def test_failed_refresh_keeps_previous_value(self, client, monkeypatch):
+        """Test a refresh error keeps serving the cached value"""
+        import asyncio
+        from app.refresher import Refresher
+
+        async def scenario():
+            refresher = Refresher(soft_ttl=0)
+            calls = []
+
+            async def read(db):
+                calls.append(db)
+                if len(calls) > 1:
+                    raise RuntimeError("database down")
+                return ["Bretagne"]
+
+            db = TestingSessionLocal()
+            try:
+                first = await refresher.get(db, read)
+                second = await refresher.get(db, read)
+                await refresher.wait()
+                third = await refresher.get(db, read)
+                await refresher.wait()
+            finally:
+                db.close()
+            return first, second, third, len(calls)
+
+        first, second, third, calls = asyncio.run(scenario())
+        assert first == second == third == (["Bretagne"], True)
+        assert calls == 3
+
+
+class TestSyntheticData:
+    """Tests for the synthetic dataset generator and the load test"""
+
+    @pytest.fixture
+    def dataset(self, client):
+        """A small synthetic dataset loaded in place of the test data"""
+        from perf.synthetic import SyntheticDataset, load
+
+        dataset = SyntheticDataset(communes=300, years=3, seed=7)
+        db = TestingSessionLocal()
+        try:
+            for record in db.query(AirQualityRecord).all():
+                db.delete(record)
+            db.commit()
+            report = load(db, dataset, chunk_size=250)
+        finally:
+            db.close()
+        assert report.rows_written == len(dataset) == 900
+        return dataset
+
+    def test_deterministic(self):
+        """Test the same seed yields the same rows whatever the chunk size"""
+        from perf.synthetic import SyntheticDataset
+
+        first = [row for chunk in SyntheticDataset(50, 2, seed=3).chunks(7) for row in chunk]
+        second = [row for chunk in SyntheticDataset(50, 2, seed=3).chunks(100) for row in chunk]
+        assert first == second
+        assert len({(r["code_insee"], r["annee"]) for r in first}) == 100
+
+    def test_ground_truth_matches_api(self, client, dataset):
+        """Test the API returns the aggregates computed by the generator"""
+        truth = dataset.ground_truth()
+
+        summary = client.get("/api/v1/summary").json()
+        assert summary["total_records"] == truth["summary"]["total_records"]
+        assert summary["total_regions"] == truth["summary"]["total_regions"]
+        assert summary["total_communes"] == truth["summary"]["total_communes"]
+        for pollutant, value in truth["summary"]["global_averages"].items():
+            assert summary["global_averages"][pollutant] == pytest.approx(value, abs=0.01)
+        assert client.get("/api/v1/years").json()["years"] == truth["years"]
+
+        for region, expected in truth["regions"].items():
+            stats = client.get(f"/api/v1/stats/region/{region}").json()
+            for field, value in expected.items():
+                assert stats[field] == pytest.approx(value, abs=0.01), (region, field)
+
+        trend = client.get("/api/v1/trends/no2").json()["data"]
+        assert [p["annee"] for p in trend] == [p["annee"] for p in truth["trends"]["no2"]]
+
+    def test_load_test(self, client, dataset):
+        """Test the load test replays sessions without errors"""
+        import asyncio
+        from perf.loadtest import run_load_test
+
+        results = asyncio.run(run_load_test(users=2, sessions=2, seed=1, app=app))
+        summary = results.summary()
+        assert summary["errors"] == 0
+        assert {"dashboard", "records", "trends", "map"} <= set(summary["endpoints"])
+        assert summary["endpoints"]["dashboard"]["requests"] == 4
+        assert summary["endpoints"]["records"]["p99_ms"] >= summary["endpoints"]["records"]["p50_ms"]
+
+
+class TestBenchmarkCompare:
+    """Tests for the comparison of benchmark results with a baseline"""
+
+    @staticmethod
+    def _write(path, medians):
+        path.write_text(json.dumps({"benchmarks": [
+            {"fullname": name, "stats": {"median": value}} for name, value in medians.items()
+        ]}))
+        return str(path)
+
+    def test_regressions_above_threshold(self, tmp_path, capsys):
+        """Test only slowdowns above the threshold fail the comparison"""
+        from perf import compare
+
+        baseline = self._write(tmp_path / "baseline.json", {"a": 0.010, "b": 0.010, "c": 0.010})
+        results = self._write(tmp_path / "results.json", {"a": 0.011, "b": 0.020, "d": 0.5})
+
+        comparisons = compare.compare(compare.load_stats(results), compare.load_stats(baseline))
+        assert [c.name for c in comparisons] == ["a", "b"]
+        assert [c.name for c in compare.regressions(comparisons, 0.2)] == ["b"]
+        assert compare.regressions(comparisons, 1.5) == []
+
+        with pytest.raises(SystemExit) as exit_info:
+            compare.main([results, baseline, "--threshold", "0.2"])
+        assert exit_info.value.code == 1
+        output = capsys.readouterr().out
+        assert "REGRESSION" in output and "Not run: c" in output
+
+        compare.main([results, baseline, "--threshold", "1.5"])
+
+    def test_missing_file(self, tmp_path, capsys):
+        """Test a missing results or baseline file is reported, not a traceback"""
+        from perf import compare
+
+        results = self._write(tmp_path / "results.json", {"a": 0.010})
+        missing = str(tmp_path / "baseline.json")
+
+        with pytest.raises(SystemExit) as exit_info:
+            compare.main([results, missing])
+        assert exit_info.value.code == 2
+        assert f"{missing} not found" in capsys.readouterr().err
+
+    def test_committed_baseline(self):
+        """Test the committed baseline covers every benchmark at the 1k tier"""
+        from perf import compare
+
+        perf_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "perf")
+        baseline = compare.load_stats(os.path.join(perf_dir, "baseline.json"))
+        with open(os.path.join(perf_dir, "bench_crud.py"), encoding="utf-8") as stream:
+            names = re.findall(r"^def (test_\w+)", stream.read(), re.MULTILINE)
+        assert sorted(baseline) == sorted(f"bench_crud.py::{name}[1k]" for name in names)
+
+
 # ============== Integration Tests ==============
 
 class TestIntegration:
@@ -67,6 +67,7 @@ async function getRecords(params = {}) {
     if (params.annee) queryParams.append('annee', params.annee);
     if (params.page) queryParams.append('page', params.page);
     if (params.page_size) queryParams.append('page_size', params.page_size);
+    if (params.cursor) queryParams.append('cursor', params.cursor);
     
     const queryString = queryParams.toString();
     const endpoint = `/records${queryString ? `?${queryString}` : ''}`;
@@ -185,6 +186,40 @@ async function getSummary() {
     return apiFetch('/summary');
 }
 
+/**
+ * Get everything the dashboard shows on load in one request
+ */
+async function getDashboard(params = {}) {
+    const queryParams = new URLSearchParams();
+    
+    if (params.page_size) queryParams.append('page_size', params.page_size);
+    if (params.pollutant) queryParams.append('pollutant', params.pollutant);
+    
+    const queryString = queryParams.toString();
+    return apiFetch(`/dashboard${queryString ? `?${queryString}` : ''}`);
+}
+
+/**
+ * Get the map layer (GeoJSON aggregated to the viewport)
+ */
+async function getMapLayer(params = {}) {
+    const queryParams = new URLSearchParams();
+    
+    if (params.pollutant) queryParams.append('pollutant', params.pollutant);
+    if (params.annee) queryParams.append('annee', params.annee);
+    if (params.bbox) queryParams.append('bbox', params.bbox);
+    if (params.zoom !== undefined) queryParams.append('zoom', params.zoom);
+    
+    return apiFetch(`/map?${queryParams.toString()}`);
+}
+
+/**
+ * Get the thresholds used to rate measurements
+ */
+async function getThresholds() {
+    return apiFetch('/thresholds');
+}
+
 // ============== Export API functions ==============
 
 window.AirQualityAPI = {
@@ -202,4 +237,7 @@ window.AirQualityAPI = {
     getPollutantTrend,
     compareRegions,
     getSummary,
+    getDashboard,
+    getThresholds,
+    getMapLayer,
 };
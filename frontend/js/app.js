@@ -10,6 +10,7 @@ const AppState = {
     regions: [],
     years: [],
     summary: null,
+    defaultTrend: null,
     pagination: {
         page: 1,
         pageSize: 20,
@@ -21,7 +22,8 @@ const AppState = {
         commune: ''
     },
     map: null,
-    mapMarkers: []
+    mapMarkers: [],
+    mapRequest: 0
 };
 
 // ============== Initialization ==============
@@ -113,22 +115,24 @@ async function loadInitialData() {
     showLoading(true);
     
     try {
-        // Load metadata
-        const [regionsData, yearsData, summaryData] = await Promise.all([
-            window.AirQualityAPI.getRegions(),
-            window.AirQualityAPI.getYears(),
-            window.AirQualityAPI.getSummary()
-        ]);
+        // Metadata, first page of records and default trend in one request
+        const dashboard = await window.AirQualityAPI.getDashboard({
+            page_size: AppState.pagination.pageSize
+        });
         
-        AppState.regions = regionsData.regions;
-        AppState.years = yearsData.years;
-        AppState.summary = summaryData;
+        AppState.regions = dashboard.regions;
+        AppState.years = dashboard.years;
+        AppState.summary = dashboard.summary;
+        AppState.data = dashboard.records.data;
+        AppState.pagination.total = dashboard.records.total;
+        AppState.defaultTrend = dashboard.trend;
         
         // Populate filter dropdowns
         populateFilters();
         
-        // Load records
-        await loadRecords();
+        // Update table
+        updateDataTable();
+        updatePaginationInfo();
         
         // Update dashboard stats
         updateDashboardStats();
@@ -351,69 +355,71 @@ function initializeMap() {
         attribution: '© OpenStreetMap contributors'
     }).addTo(AppState.map);
     
+    // Reload the layer for each new viewport
+    AppState.map.on('moveend', updateMapMarkers);
+    
     // Add markers
     updateMapMarkers();
 }
 
-function updateMapMarkers() {
+async function updateMapMarkers() {
     if (!AppState.map) return;
     
-    // Clear existing markers
-    AppState.mapMarkers.forEach(marker => marker.remove());
-    AppState.mapMarkers = [];
-    
     const pollutant = document.getElementById('map-pollutant')?.value || 'no2';
     const yearFilter = document.getElementById('map-year')?.value;
+    const bounds = AppState.map.getBounds();
     
-    // Filter data
-    let filteredData = AppState.data;
-    if (yearFilter) {
-        filteredData = filteredData.filter(d => d.annee == yearFilter);
+    // Only the latest request may draw, earlier responses are dropped
+    const request = ++AppState.mapRequest;
+    let layer;
+    try {
+        layer = await window.AirQualityAPI.getMapLayer({
+            pollutant,
+            annee: yearFilter,
+            bbox: [
+                Math.max(bounds.getWest(), -180), Math.max(bounds.getSouth(), -90),
+                Math.min(bounds.getEast(), 180), Math.min(bounds.getNorth(), 90)
+            ].map(v => v.toFixed(4)).join(','),
+            zoom: AppState.map.getZoom()
+        });
+    } catch (error) {
+        console.error('Error loading map layer:', error);
+        showToast('Erreur lors du chargement de la carte', 'error');
+        return;
     }
+    if (request !== AppState.mapRequest) return;
     
-    // Add markers
-    filteredData.forEach(record => {
-        if (record.latitude && record.longitude && record[pollutant]) {
-            const value = record[pollutant];
-            const color = getColorForValue(value, pollutant);
-            
-            const marker = L.circleMarker([record.latitude, record.longitude], {
-                radius: 8,
-                fillColor: color,
-                color: '#fff',
-                weight: 2,
-                opacity: 1,
-                fillOpacity: 0.8
-            });
-            
-            marker.bindPopup(`
-                <strong>${record.commune}</strong><br>
-                ${record.region}<br>
-                <hr style="margin: 8px 0;">
-                ${pollutant.toUpperCase()}: ${value} µg/m³<br>
-                Année: ${record.annee}
-            `);
-            
-            marker.addTo(AppState.map);
-            AppState.mapMarkers.push(marker);
-        }
-    });
-}
-
-function getColorForValue(value, pollutant) {
-    // Thresholds based on WHO guidelines
-    const thresholds = {
-        no2: { low: 20, high: 40 },
-        pm10: { low: 15, high: 45 },
-        pm25: { low: 10, high: 25 },
-        o3: { low: 60, high: 100 }
-    };
-    
-    const t = thresholds[pollutant] || { low: 20, high: 40 };
+    // Clear existing markers
+    AppState.mapMarkers.forEach(marker => marker.remove());
+    AppState.mapMarkers = [];
     
-    if (value <= t.low) return '#22c55e';  // Green
-    if (value <= t.high) return '#f59e0b'; // Yellow
-    return '#ef4444';                       // Red
+    // Add markers: values and colours are computed by the API
+    layer.features.forEach(feature => {
+        const [longitude, latitude] = feature.geometry.coordinates;
+        const props = feature.properties;
+        const where = layer.clustered
+            ? `${props.communes} commune${props.communes > 1 ? 's' : ''}`
+            : `<strong>${props.commune}</strong><br>${props.region}`;
+        
+        const marker = L.circleMarker([latitude, longitude], {
+            radius: layer.clustered ? Math.min(8 + 2 * Math.log2(props.communes), 24) : 8,
+            fillColor: props.color || '#94a3b8',
+            color: '#fff',
+            weight: 2,
+            opacity: 1,
+            fillOpacity: 0.8
+        });
+        
+        marker.bindPopup(`
+            ${where}
+            <hr style="margin: 8px 0;">
+            ${pollutant.toUpperCase()}: ${props.value} µg/m³<br>
+            Année: ${layer.annee || 'moyenne toutes années'}
+        `);
+        
+        marker.addTo(AppState.map);
+        AppState.mapMarkers.push(marker);
+    });
 }
 
 // ============== Trends ==============
@@ -423,7 +429,12 @@ async function loadTrendData() {
     const region = document.getElementById('trend-region')?.value || '';
     
     try {
-        const result = await window.AirQualityAPI.getPollutantTrend(pollutant, { region });
+        // The national trend of the default pollutant came with the initial data
+        const initial = AppState.defaultTrend;
+        AppState.defaultTrend = null;
+        const result = (initial && !region && initial.pollutant === pollutant)
+            ? initial
+            : await window.AirQualityAPI.getPollutantTrend(pollutant, { region });
         
         // Create chart
         window.AirQualityCharts.createTrendChart('chart-trend', result.data, pollutant);